@@ -5,3 +5,10 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from .caches import SharedCache
+        SharedCache.check()
+        from . import signals
+        from .starterkit import StarterKit
+        StarterKit.load()
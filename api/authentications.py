@@ -1,7 +1,287 @@
+import os
+import copy
+import hmac
+import hashlib
+import threading
+
+from .caches import LRUCache, SharedVersion
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+
+from rest_framework.authtoken.models import Token
+from rest_framework import exceptions
 from rest_framework.authentication import TokenAuthentication
+from rest_framework.authentication import BasicAuthentication
 from rest_framework.authentication import SessionAuthentication
 
-class CsrfExemptTokenAuthentication(TokenAuthentication):
+
+class TokenCache():
+    """
+    Two tier cache of authenticated tokens: key -> id, name and flags of the user.
+
+    The first tier is private to the process (LRU with a short TTL), the second one is
+    the shared cache. Entries carry the version of their token, kept in the shared cache
+    and read before the token: revoking a token bumps it, which invalidates the entries of
+    both tiers in every process. A hit costs one read of the shared cache, a miss two.
+
+    The password hash and the personal data of the user are not cached, requests get a
+    user rebuilt from the cached fields.
+    """
+
+    local = LRUCache(getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', 10000), getattr(settings, 'AUTH_TOKEN_CACHE_LOCAL_TIMEOUT', 60))
+    versions = SharedVersion('auth-token-version')
+    lock = threading.Lock()
+    sharedHits = 0
+    sharedMisses = 0
+
+    @staticmethod
+    def cacheKey(key):
+        return 'auth-token:%s' % key
+
+    @staticmethod
+    def entry(user):
+        # is_staff is kept for the admin only endpoints (IsAdminUser)
+        return {'id': user.id, 'username': user.username, 'is_active': user.is_active, 'is_staff': user.is_staff}
+
+    @staticmethod
+    def credentials(key, entry):
+        # Requests get their own user, built from the cached fields only
+        user = User(id=entry['id'], username=entry['username'], is_active=entry['is_active'], is_staff=entry['is_staff'])
+        return (user, Token(key=key, user_id=entry['id']))
+
+    @staticmethod
+    def get(key, version):
+        entry = TokenCache.local.get(key)
+        if (entry is None) or (entry['version'] != version):
+            entry = cache.get(TokenCache.cacheKey(key))
+            if (entry is not None) and (entry['version'] != version):
+                entry = None
+            with TokenCache.lock:
+                if entry is None:
+                    TokenCache.sharedMisses += 1
+                else:
+                    TokenCache.sharedHits += 1
+            if entry is not None:
+                TokenCache.local.set(key, entry)
+        if entry is None:
+            return None
+        return TokenCache.credentials(key, entry)
+
+    @staticmethod
+    def set(key, credentials, version):
+        # The version was read before the token: a concurrent revocation makes the entry stale
+        entry = dict(TokenCache.entry(credentials[0]), version=version)
+        TokenCache.local.set(key, entry)
+        cache.set(TokenCache.cacheKey(key), entry, getattr(settings, 'AUTH_TOKEN_CACHE_TIMEOUT', 600))
+
+    @staticmethod
+    def revoke(key):
+        TokenCache.delete(key)
+        # Again once committed, in case a concurrent request cached the old state meanwhile
+        transaction.on_commit(lambda: TokenCache.delete(key))
+
+    @staticmethod
+    def revokeUser(user):
+        TokenCache.local.deleteMatching(lambda key, entry: entry['id'] == user.id)
+        for key in Token.objects.filter(user_id=user.id).values_list('key', flat=True):
+            TokenCache.revoke(key)
+        AccessTokens.revoke(user.id)
+
+    @staticmethod
+    def delete(key):
+        TokenCache.versions.bump(key)
+        TokenCache.local.delete(key)
+        cache.delete(TokenCache.cacheKey(key))
+
+    @staticmethod
+    def stats():
+        stats = TokenCache.local.stats()
+        with TokenCache.lock:
+            stats['sharedHits'] = TokenCache.sharedHits
+            stats['sharedMisses'] = TokenCache.sharedMisses
+        return stats
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that keeps authenticated tokens in the TokenCache,
+    so that the token and user tables are only read on cache misses.
+    """
+
+    def authenticate_credentials(self, key):
+        version = TokenCache.versions.get(key)
+        credentials = TokenCache.get(key, version)
+        if credentials is None:
+            credentials = super(CachedTokenAuthentication, self).authenticate_credentials(key)
+            TokenCache.set(key, credentials, version)
+        return credentials
+
+
+class AccessTokens():
+    """
+    Signed, expiring access tokens carrying the user id and name.
+
+    Access tokens are obtained with a refresh token (the Token key handed out at login)
+    and expire after ACCESS_TOKEN_LIFETIME seconds. They also carry a stamp (digest) of
+    their refresh token, checked against the state of the user: whether it is active and
+    the stamps of its current refresh tokens. The state is kept in the shared cache for
+    ACCESS_TOKEN_STATE_TIMEOUT seconds and dropped when the user changes or logs out, so
+    revoking the refresh token or deactivating the user ends access at once.
+    """
+
+    SALT = 'api.authentications.AccessTokens'
+
+    @staticmethod
+    def lifetime():
+        return getattr(settings, 'ACCESS_TOKEN_LIFETIME', 300)
+
+    @staticmethod
+    def stamp(refreshKey):
+        # The refresh token itself cannot be read from the (signed, not encrypted) access token
+        return hashlib.sha256(refreshKey.encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def create(user, refreshKey):
+        return signing.dumps({'id': user.id, 'username': user.username, 'stamp': AccessTokens.stamp(refreshKey)}, salt=AccessTokens.SALT)
+
+    @staticmethod
+    def cacheKey(userId):
+        return 'access-token-state:%s' % userId
+
+    @staticmethod
+    def state(userId):
+        state = cache.get(AccessTokens.cacheKey(userId))
+        if state is None:
+            isActive = User.objects.filter(id=userId, is_active=True).exists()
+            stamps = [AccessTokens.stamp(key) for key in Token.objects.filter(user_id=userId).values_list('key', flat=True)]
+            state = {'is_active': isActive, 'stamps': stamps}
+            cache.set(AccessTokens.cacheKey(userId), state, getattr(settings, 'ACCESS_TOKEN_STATE_TIMEOUT', 60))
+        return state
+
+    @staticmethod
+    def revoke(userId):
+        cache.delete(AccessTokens.cacheKey(userId))
+        # Again once committed, in case a concurrent request cached the old state meanwhile
+        transaction.on_commit(lambda: cache.delete(AccessTokens.cacheKey(userId)))
+
+    @staticmethod
+    def load(accessToken):
+        try:
+            return signing.loads(accessToken, salt=AccessTokens.SALT, max_age=AccessTokens.lifetime())
+        except signing.SignatureExpired:
+            raise exceptions.AuthenticationFailed('Access token expired.')
+        except signing.BadSignature:
+            raise exceptions.AuthenticationFailed('Invalid access token.')
+
+
+class SignedTokenAuthentication(TokenAuthentication):
+    """
+    Authentication with access tokens: "Authorization: Bearer <access token>".
+    The user is built from the token content and its cached state (see AccessTokens).
+    """
+
+    keyword = 'Bearer'
+
+    def authenticate_credentials(self, key):
+        data = AccessTokens.load(key)
+        state = AccessTokens.state(data['id'])
+        if not state['is_active']:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        if data.get('stamp') not in state['stamps']:
+            raise exceptions.AuthenticationFailed('Access token revoked.')
+        return (User(id=data['id'], username=data['username'], is_active=state['is_active']), None)
+
+
+class BasicCredentialCache():
+    """
+    Recently verified basic auth credentials: username -> (digest, user, version).
+
+    Only an HMAC of the credentials, keyed with a random per-process salt, is kept, so
+    a cache hit costs one HMAC and one read of the shared cache instead of a full password
+    hash verification. Entries carry the version of their username, kept in the shared cache
+    and read before the password is verified: revoke() (password change, deactivation) bumps
+    it, which invalidates the entries of every process.
+
+    Failed verifications are counted per client address and username, further attempts of
+    the client are rejected for BASIC_AUTH_FAILURE_WINDOW seconds after BASIC_AUTH_MAX_FAILURES
+    failures (other clients can still log in as the user).
+    """
+
+    salt = os.urandom(32)
+    local = LRUCache(getattr(settings, 'BASIC_AUTH_CACHE_SIZE', 10000), getattr(settings, 'BASIC_AUTH_CACHE_TIMEOUT', 60))
+    failures = LRUCache(getattr(settings, 'BASIC_AUTH_CACHE_SIZE', 10000), getattr(settings, 'BASIC_AUTH_FAILURE_WINDOW', 300))
+    versions = SharedVersion('basic-auth-version')
+    lock = threading.Lock()
+
+    @staticmethod
+    def digest(username, password):
+        credentials = ('%s:%s' % (username, password)).encode('utf-8')
+        return hmac.new(BasicCredentialCache.salt, credentials, hashlib.sha256).digest()
+
+    @staticmethod
+    def get(username, password, version):
+        entry = BasicCredentialCache.local.get(username)
+        if (entry is None) or (entry[2] != version) or not hmac.compare_digest(entry[0], BasicCredentialCache.digest(username, password)):
+            return None
+        return copy.copy(entry[1])
+
+    @staticmethod
+    def set(username, password, user, version):
+        BasicCredentialCache.local.set(username, (BasicCredentialCache.digest(username, password), user, version))
+
+    @staticmethod
+    def isBlocked(client, username):
+        return BasicCredentialCache.failures.get((client, username), 0) >= getattr(settings, 'BASIC_AUTH_MAX_FAILURES', 5)
+
+    @staticmethod
+    def addFailure(client, username):
+        with BasicCredentialCache.lock:
+            BasicCredentialCache.failures.set((client, username), BasicCredentialCache.failures.get((client, username), 0) + 1)
+
+    @staticmethod
+    def revoke(username):
+        BasicCredentialCache.versions.bump(username)
+        BasicCredentialCache.local.delete(username)
+        BasicCredentialCache.failures.deleteMatching(lambda key, count: key[1] == username)
+        # Again once committed, in case a concurrent request verified the old password meanwhile
+        transaction.on_commit(lambda: BasicCredentialCache.versions.bump(username))
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    Basic authentication that skips the password hash verification for credentials
+    verified recently (see BasicCredentialCache).
+    """
+
+    client = None
+
+    def authenticate(self, request):
+        # Authenticators are created per request, the client address is kept for the failure counts
+        self.client = request.META.get('REMOTE_ADDR')
+        return super(CachedBasicAuthentication, self).authenticate(request)
+
+    def authenticate_credentials(self, userid, password, request=None):
+        version = BasicCredentialCache.versions.get(userid)
+        user = BasicCredentialCache.get(userid, password, version)
+        if user is not None:
+            return (user, None)
+
+        if BasicCredentialCache.isBlocked(self.client, userid):
+            raise exceptions.AuthenticationFailed('Too many failed attempts, try again later.')
+        try:
+            credentials = super(CachedBasicAuthentication, self).authenticate_credentials(userid, password)
+        except exceptions.AuthenticationFailed:
+            BasicCredentialCache.addFailure(self.client, userid)
+            raise
+        BasicCredentialCache.set(userid, password, credentials[0], version)
+        return credentials
+
+
+class CsrfExemptTokenAuthentication(CachedTokenAuthentication):
 
     def enforce_csrf(self, request):
         print "here"
@@ -12,4 +292,4 @@ class CsrfExemptSessionAuthentication(SessionAuthentication):
 
     def enforce_csrf(self, request):
         print "here"
-        return  # To not perform the csrf check previously happening
\ No newline at end of file
+        return  # To not perform the csrf check previously happening
@@ -0,0 +1,152 @@
+import bisect
+
+from .models import Ingredient, IngredientLocation
+from .caches import LRUCache, SharedVersion
+from .search import SearchIndex
+
+from django.conf import settings
+from django.db import transaction
+
+
+class IngredientIndex(object):
+    """
+    Per-user prefix index of the ingredient names, for autocompletion.
+
+    The index is a sorted list of keys: the normalized name of each ingredient and the name
+    from each of its following words on, so that "mi" matches both "milk" and "oat milk".
+    Prefix matches are found by bisection, names within one typo are only looked for when
+    there are not enough of them. Indexes are warmed lazily and kept per process
+    (INGREDIENT_INDEX_CACHE_SIZE users), with the same versioning as PantryIndex.
+    """
+
+    local = LRUCache(getattr(settings, 'INGREDIENT_INDEX_CACHE_SIZE', 1000), getattr(settings, 'INGREDIENT_INDEX_TIMEOUT', 3600))
+    versions = SharedVersion('ingredient-index-version')
+
+    def __init__(self, userId, version):
+        self.userId = userId
+        self.version = version
+        self.ingredients = {}   # ingredientId -> (name, locationIds)
+        self.keys = None        # sorted [(key, starts the name, ingredientId)], built on first use
+        self.names = None       # [(normalized name, ingredientId)], built with the keys
+
+    #--- Access
+
+    @staticmethod
+    def get(userId):
+        version = IngredientIndex.versions.get(userId)
+        index = IngredientIndex.local.get(userId)
+        if (index is None) or (index.version != version):
+            index = IngredientIndex.build(userId, version)
+            IngredientIndex.local.set(userId, index)
+        return index
+
+    @staticmethod
+    def build(userId, version):
+        index = IngredientIndex(userId, version)
+        locationIds = {}
+        for ingredientId, locationId in IngredientLocation.objects.filter(ingredient__user_id=userId).values_list('ingredient_id', 'location_id'):
+            locationIds.setdefault(ingredientId, []).append(locationId)
+        for ingredientId, name in Ingredient.objects.filter(user_id=userId).values_list('id', 'name'):
+            index.ingredients[ingredientId] = (name, locationIds.get(ingredientId, []))
+        return index
+
+    def sortedKeys(self):
+        keys = self.keys
+        if keys is None:
+            keys = []
+            names = []
+            for ingredientId, (name, locationIds) in self.ingredients.items():
+                words = SearchIndex.normalize(name).split()
+                names.append((' '.join(words), ingredientId))
+                for i in range(len(words)):
+                    keys.append((' '.join(words[i:]), i == 0, ingredientId))
+            keys.sort()
+            self.names = names
+            self.keys = keys
+        return keys
+
+    #--- Updates
+
+    @staticmethod
+    def ingredientChanged(userId, ingredientId):
+        # Applied once committed, so that other processes cannot rebuild from the old data
+        transaction.on_commit(lambda: IngredientIndex.update(userId, ingredientId))
+
+    @staticmethod
+    def invalidate(userId):
+        def bump():
+            IngredientIndex.versions.bump(userId)
+            IngredientIndex.local.delete(userId)
+        transaction.on_commit(bump)
+
+    @staticmethod
+    def update(userId, ingredientId):
+        index = IngredientIndex.local.get(userId)
+        version = IngredientIndex.versions.bump(userId)
+        # Without a version yet, nobody has an index to keep up to date
+        if (version is None) or (index is None) or (index.version != version - 1):
+            IngredientIndex.local.delete(userId)
+            return
+
+        # A new index replaces the old one, which may still be in use by other threads
+        newIndex = IngredientIndex(userId, version)
+        newIndex.ingredients = dict(index.ingredients)
+        name = Ingredient.objects.filter(id=ingredientId, user_id=userId).values_list('name', flat=True).first()
+        if name is None:
+            newIndex.ingredients.pop(ingredientId, None)
+        else:
+            locationIds = list(IngredientLocation.objects.filter(ingredient_id=ingredientId).values_list('location_id', flat=True))
+            newIndex.ingredients[ingredientId] = (name, locationIds)
+        IngredientIndex.local.set(userId, newIndex)
+
+    #--- Queries
+
+    def complete(self, prefix, limit=10):
+        # Names starting with the prefix first (shortest first), then names with a word starting
+        # with it, then names starting with the prefix up to one typo
+        prefix = ' '.join(SearchIndex.normalize(prefix).split())
+        if not prefix:
+            return []
+        keys = self.sortedKeys()
+
+        matches = {}
+        position = bisect.bisect_left(keys, (prefix,))
+        while position < len(keys) and keys[position][0].startswith(prefix):
+            key, startsName, ingredientId = keys[position]
+            rank = (0 if startsName else 1, len(key))
+            if rank < matches.get(ingredientId, (2,)):
+                matches[ingredientId] = rank
+            position += 1
+
+        if len(matches) < limit and len(prefix) > 3:
+            # With a single edit, either the first two characters are unchanged or the third
+            # character of the name is one of the second to fourth characters of the prefix
+            length = len(prefix)
+            start = prefix[:2]
+            shifted = prefix[1:4]
+            for name, ingredientId in self.names:
+                if (name[:2] != start) and (name[2:3] not in shifted):
+                    continue
+                if (ingredientId not in matches) and (IngredientIndex.oneEditApart(prefix, name[:length])
+                        or IngredientIndex.oneEditApart(prefix, name[:length + 1]) or IngredientIndex.oneEditApart(prefix, name[:length - 1])):
+                    matches[ingredientId] = (2, len(name))
+
+        ranking = sorted(matches.items(), key=lambda match: (match[1], self.ingredients[match[0]][0], match[0]))
+        return [{'id': ingredientId, 'name': self.ingredients[ingredientId][0], 'locations': self.ingredients[ingredientId][1]}
+                for ingredientId, rank in ranking[:limit]]
+
+    @staticmethod
+    def oneEditApart(a, b):
+        # At most one character replaced, inserted, removed, or two adjacent ones swapped
+        if a == b:
+            return True
+        if abs(len(a) - len(b)) > 1:
+            return False
+        i = 0
+        while i < len(a) and i < len(b) and a[i] == b[i]:
+            i += 1
+        if len(a) == len(b):
+            return a[i + 1:] == b[i + 1:] or (i + 1 < len(a) and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:])
+        if len(a) > len(b):
+            return a[i + 1:] == b[i:]
+        return a[i:] == b[i + 1:]
@@ -0,0 +1,154 @@
+import re
+import json
+from io import BytesIO
+
+from .profiles import UserProfiles
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.urlresolvers import resolve, Resolver404
+from django.db import transaction
+from django.utils import six
+from django.utils.six.moves.urllib.parse import urlsplit
+
+
+class BatchError(Exception):
+
+    def __init__(self, index, responses):
+        self.index = index
+        self.responses = responses
+        self.status = responses[index]['status']
+
+
+class Batch(object):
+    """
+    Runs a list of API requests in-process, with the authentication of the batch request
+    and in a single transaction: either all of them succeed or none of them is applied.
+
+    Each request is {"method": ..., "url": "/api/...", "body": ...}. Strings of the form
+    "$<n>.<field>[.<field>...]" refer to the response of the n-th request of the batch, e.g.
+    "$0.id" is the id of an object created by the first request. In urls, the references
+    are replaced in the text ("/api/recipe/$1.id"). Only the data endpoints given by the
+    caller can be batched, other urls (authentication, account, batches, ...) are rejected.
+    """
+
+    METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+    REFERENCE = re.compile(r'\$(\d+)((?:\.\w+)+)')
+
+    def __init__(self, request, views):
+        self.request = request
+        self.views = views
+        self.responses = []
+        self.userProfile = None
+
+    @staticmethod
+    def isValid(batchRequests):
+        if not isinstance(batchRequests, list) or len(batchRequests) > getattr(settings, 'BATCH_MAX_REQUESTS', 50):
+            return False
+        for batchRequest in batchRequests:
+            if not isinstance(batchRequest, dict) or not isinstance(batchRequest.get('url'), six.string_types):
+                return False
+            if batchRequest.get('method', 'GET') not in Batch.METHODS:
+                return False
+        return True
+
+    def run(self, batchRequests):
+        # Returns the responses, raises BatchError (after rolling back) when a request fails
+        with transaction.atomic():
+            for index, batchRequest in enumerate(batchRequests):
+                response = self.execute(index, batchRequest)
+                self.responses.append(response)
+                if response['status'] >= 400:
+                    raise BatchError(index, self.responses)
+        return self.responses
+
+    #--- References
+
+    def lookup(self, index, path):
+        if index >= len(self.responses):
+            raise ValueError('$%s refers to a later request' % index)
+        value = self.responses[index]['body']
+        for field in path.split('.')[1:]:
+            if isinstance(value, dict) and field in value:
+                value = value[field]
+            elif isinstance(value, list) and field.isdigit() and int(field) < len(value):
+                value = value[int(field)]
+            else:
+                raise ValueError('$%s%s not found' % (index, path))
+        return value
+
+    def resolveReferences(self, value):
+        if isinstance(value, six.string_types):
+            match = Batch.REFERENCE.match(value)
+            if match and match.end() == len(value):
+                return self.lookup(int(match.group(1)), match.group(2))
+            return value
+        if isinstance(value, list):
+            return [self.resolveReferences(item) for item in value]
+        if isinstance(value, dict):
+            return dict((key, self.resolveReferences(item)) for key, item in value.items())
+        return value
+
+    def resolveUrl(self, url):
+        return Batch.REFERENCE.sub(lambda match: six.text_type(self.lookup(int(match.group(1)), match.group(2))), url)
+
+    #--- Execution
+
+    def execute(self, index, batchRequest):
+        try:
+            url = urlsplit(self.resolveUrl(batchRequest['url']))
+            body = self.resolveReferences(batchRequest.get('body'))
+        except ValueError as e:
+            return {'status': 400, 'body': six.text_type(e)}
+
+        try:
+            match = resolve(url.path)
+        except Resolver404:
+            return {'status': 404, 'body': 'Unknown url: %s' % url.path}
+        if getattr(match.func, 'view_class', None) not in self.views:
+            return {'status': 400, 'body': 'Url cannot be batched: %s' % url.path}
+
+        subRequest = self.subRequest(batchRequest.get('method', 'GET'), url, body)
+        response = match.func(subRequest, *match.args, **match.kwargs)
+        return {'status': response.status_code, 'body': Batch.responseBody(response)}
+
+    def subRequest(self, method, url, body):
+        request = self.request._request
+        content = b'' if body is None else json.dumps(body).encode('utf-8')
+
+        environ = dict(request.META)
+        environ.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': url.path,
+            'SCRIPT_NAME': '',
+            'QUERY_STRING': url.query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(content)),
+            'wsgi.input': BytesIO(content),
+        })
+        environ.pop('HTTP_IF_NONE_MATCH', None)
+        environ.pop('HTTP_IF_MATCH', None)
+        # The bodies are embedded in the batch response
+        environ.pop('HTTP_ACCEPT_ENCODING', None)
+        subRequest = WSGIRequest(environ)
+
+        # The batch request is authenticated once, the sub-requests reuse its user, session and profile
+        subRequest.user = self.request.user
+        subRequest.session = getattr(request, 'session', None)
+        subRequest._force_auth_user = self.request.user
+        subRequest._force_auth_token = self.request.auth
+        subRequest._dont_enforce_csrf_checks = True
+        # The same profile object is seen (and changed) by all the sub-requests, cached profiles
+        # are only invalidated once the batch is committed
+        if self.userProfile is None:
+            self.userProfile = UserProfiles.get(self.request)
+        subRequest._userProfile = self.userProfile
+        return subRequest
+
+    @staticmethod
+    def responseBody(response):
+        if hasattr(response, 'data'):
+            return response.data
+        if response.get('Content-Type', '').startswith('application/json'):
+            return json.loads(response.content.decode('utf-8'))
+        return None
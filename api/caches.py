@@ -0,0 +1,122 @@
+import time
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+
+class LRUCache(object):
+    """
+    Thread-safe, in-process LRU cache with a time-to-live per entry.
+
+    Entries are evicted when they expire or when the cache holds more than maxSize
+    of them (least recently used first). With sizeOf, maxSize is the total size of the
+    entries instead, e.g. sizeOf=len for byte strings. Hits, misses and evictions are counted.
+    """
+
+    def __init__(self, maxSize, timeout, sizeOf=None):
+        self.maxSize = maxSize
+        self.timeout = timeout
+        self.sizeOf = sizeOf or (lambda value: 1)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if (entry is None) or (entry[0] < time.time()):
+                if entry is not None:
+                    self.size -= entry[2]
+                self.misses += 1
+                return default
+            # re-insert as most recently used
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, timeout=None):
+        expiresAt = time.time() + (self.timeout if timeout is None else timeout)
+        size = self.sizeOf(value)
+        with self.lock:
+            self.delete_(key)
+            self.entries[key] = (expiresAt, value, size)
+            self.size += size
+            while self.size > self.maxSize:
+                self.size -= self.entries.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.delete_(key)
+
+    def delete_(self, key):
+        # The lock is held by the caller
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def deleteMatching(self, predicate):
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if predicate(key, entry[1])]:
+                self.delete_(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {'size': self.size, 'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class SharedVersion(object):
+    """
+    Version numbers kept in the shared cache, e.g. per user, used to tell processes that the
+    data behind their local copies changed. A missing (e.g. evicted) version is restarted
+    from the current time in milliseconds, so that it does not take an old value again.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def key(self, objectId):
+        return '%s:%s' % (self.prefix, objectId)
+
+    def get(self, objectId):
+        version = cache.get(self.key(objectId))
+        if version is None:
+            version = int(time.time() * 1000)
+            if not cache.add(self.key(objectId), version, None):
+                version = cache.get(self.key(objectId), version)
+        return version
+
+    def bump(self, objectId):
+        # Returns the new version, or None if there was none yet
+        try:
+            return cache.incr(self.key(objectId))
+        except ValueError:
+            return None
+
+
+class SharedCache():
+    """
+    The default cache is shared by the processes: it keeps the versions above, the cached
+    profiles, tokens and consolidated shopping lists, and their invalidations have to reach
+    every process. A per-process backend only works with a single process, set
+    SHARED_CACHE_REQUIRED when running several of them to refuse it at startup.
+    """
+
+    PER_PROCESS_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+    @staticmethod
+    def check():
+        backend = settings.CACHES.get('default', {}).get('BACKEND')
+        if getattr(settings, 'SHARED_CACHE_REQUIRED', False) and (backend in SharedCache.PER_PROCESS_BACKENDS):
+            raise ImproperlyConfigured('SHARED_CACHE_REQUIRED is set, but the default cache (%s) is private to each process' % backend)
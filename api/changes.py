@@ -0,0 +1,116 @@
+from .models import ChangeSequence, Change
+
+from datetime import timedelta
+
+from .utils import Utils
+
+from django.db import transaction, IntegrityError
+from django.db.models import F, Max
+from django.utils import timezone
+
+
+class Changes():
+    """
+    Per-user log of the changed and deleted objects, for delta synchronization (see sync.py).
+
+    Every change takes the next number of the user's ChangeSequence and stores it with the
+    object (kind, id) in the Change table, one row per object. Taking the number locks the
+    sequence row until the transaction commits, so the changes of a user are numbered in
+    commit order (a change made outside a transaction is recorded in one of its own).
+    Changes are recorded by the signals in signals.py.
+
+    The rows of deleted objects (tombstones) are pruned after CHANGE_RETENTION_DAYS days by
+    prune_changes.py; the number up to which they were pruned is kept with the sequence, a
+    client whose cursor is older gets all the objects again (see sync.py).
+    """
+
+    RECIPE = 'recipe'
+    INGREDIENT = 'ingredient'
+    SHOP = 'shop'
+    LOCATION = 'location'
+    SHOPPING_LIST = 'shoppingList'
+    PROFILE = 'profile'
+
+    @staticmethod
+    def next(userId):
+        sequences = ChangeSequence.objects.filter(user_id=userId)
+        if sequences.update(value=F('value') + 1) == 0:
+            try:
+                with transaction.atomic():
+                    ChangeSequence.objects.create(user_id=userId, value=1)
+                    return 1
+            except IntegrityError:
+                sequences.update(value=F('value') + 1)
+        return sequences.values_list('value', flat=True).get()
+
+    @staticmethod
+    def lock(userId):
+        # No other change of the user can be recorded until the transaction ends
+        sequences = ChangeSequence.objects.filter(user_id=userId)
+        if sequences.update(value=F('value')) == 0:
+            try:
+                with transaction.atomic():
+                    ChangeSequence.objects.create(user_id=userId, value=0)
+            except IntegrityError:
+                sequences.update(value=F('value'))
+
+    @staticmethod
+    def current(userId):
+        value = ChangeSequence.objects.filter(user_id=userId).values_list('value', flat=True).first()
+        return value or 0
+
+    @staticmethod
+    def state(userId):
+        # (last change number, change number up to which deletions were pruned)
+        return ChangeSequence.objects.filter(user_id=userId).values_list('value', 'pruned').first() or (0, 0)
+
+    @staticmethod
+    @transaction.atomic
+    def record(userId, kind, objectId, deleted=False):
+        sequence = Changes.next(userId)
+        # The sequence row is locked, no other change of the user can create the same row meanwhile
+        changes = Change.objects.filter(user_id=userId, kind=kind, objectId=objectId)
+        if changes.update(sequence=sequence, deleted=deleted, changed=timezone.now()) == 0:
+            Change.objects.create(user_id=userId, kind=kind, objectId=objectId, sequence=sequence, deleted=deleted)
+        return sequence
+
+    @staticmethod
+    @transaction.atomic
+    def recordMany(userId, kind, objectIds):
+        # Record the changes of objects written in bulk (no signals), in a constant number of queries
+        objectIds = list(objectIds)
+        if not objectIds:
+            return
+        sequences = ChangeSequence.objects.filter(user_id=userId)
+        if sequences.update(value=F('value') + len(objectIds)) == 0:
+            try:
+                with transaction.atomic():
+                    ChangeSequence.objects.create(user_id=userId, value=len(objectIds))
+            except IntegrityError:
+                sequences.update(value=F('value') + len(objectIds))
+        first = sequences.values_list('value', flat=True).get() - len(objectIds) + 1
+        Change.objects.filter(user_id=userId, kind=kind, objectId__in=objectIds).delete()
+        Change.objects.bulk_create([
+            Change(user_id=userId, kind=kind, objectId=objectId, sequence=first + i) for i, objectId in enumerate(objectIds)
+        ])
+
+    @staticmethod
+    def prune(retentionDays):
+        # Delete the tombstones older than the retention period, return the number of rows deleted
+        before = timezone.now() - timedelta(days=retentionDays)
+        tombstones = Change.objects.filter(deleted=True, changed__lt=before).values('user_id').annotate(last=Max('sequence'))
+        deleted = 0
+        for userId, last in tombstones.values_list('user_id', 'last'):
+            with transaction.atomic():
+                ChangeSequence.objects.filter(user_id=userId, pruned__lt=last).update(pruned=last)
+                deleted += Utils.bulkDelete(Change.objects.filter(user_id=userId, deleted=True, sequence__lte=last))
+        return deleted
+
+    @staticmethod
+    def since(userId, sequence, upTo):
+        # {kind: ([changed ids], [deleted ids])} of the changes after sequence, up to upTo
+        changes = {}
+        rows = Change.objects.filter(user_id=userId, sequence__gt=sequence, sequence__lte=upTo).values_list('kind', 'objectId', 'deleted')
+        for kind, objectId, deleted in rows:
+            changes.setdefault(kind, ([], []))[1 if deleted else 0].append(objectId)
+        return changes
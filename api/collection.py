@@ -0,0 +1,388 @@
+import json
+import numbers
+import tempfile
+
+from .models import Recipe, RecipeIngredient, Ingredient, ShoppingList, ShoppingItem, UserProfile, Shop, Location, IngredientLocation
+from .statistics import Statistics
+from .search import SearchIndex
+from .pantry import PantryIndex
+from .autocomplete import IngredientIndex
+from .changes import Changes
+from .images import imageStore, UserImages
+from .utils import Utils
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import six
+from django.utils.dateparse import parse_date
+
+
+class CollectionExport():
+    """
+    A user's whole collection as NDJSON, one object per line: the shops, locations, ingredients,
+    recipes (with their ingredients) and shopping lists (with their items), then the profile.
+    Objects reference each other by id. Rows are read in chunks of COLLECTION_EXPORT_CHUNK_SIZE,
+    so the memory used does not depend on the size of the collection.
+    """
+
+    FORMAT = 'recipicon-collection'
+    VERSION = 1
+
+    @staticmethod
+    def chunks(queryset, fields, chunkSize):
+        # Rows in id order, chunkSize at a time (keyset pagination)
+        lastId = 0
+        while True:
+            rows = list(queryset.filter(id__gt=lastId).order_by('id').values(*fields)[:chunkSize].iterator())
+            if rows:
+                yield rows
+            if len(rows) < chunkSize:
+                return
+            lastId = rows[-1]['id']
+
+    @staticmethod
+    def line(kind, data):
+        data['type'] = kind
+        return json.dumps(data, separators=(',', ':')) + '\n'
+
+    @staticmethod
+    def lines(userId, chunkSize=None):
+        chunkSize = chunkSize or getattr(settings, 'COLLECTION_EXPORT_CHUNK_SIZE', 500)
+        yield CollectionExport.line('header', {'format': CollectionExport.FORMAT, 'version': CollectionExport.VERSION})
+
+        #--- Shops and locations
+        for shops in CollectionExport.chunks(Shop.objects.filter(user_id=userId), ('id', 'name'), chunkSize):
+            for shop in shops:
+                yield CollectionExport.line('shop', shop)
+        for locations in CollectionExport.chunks(Location.objects.filter(user_id=userId), ('id', 'name', 'shop_id'), chunkSize):
+            for location in locations:
+                yield CollectionExport.line('location', {'id': location['id'], 'name': location['name'], 'shop': location['shop_id']})
+
+        #--- Ingredients, with their locations
+        for ingredients in CollectionExport.chunks(Ingredient.objects.filter(user_id=userId), ('id', 'name'), chunkSize):
+            ingredientLocations = {}
+            for ingredientId, locationId in IngredientLocation.objects.filter(ingredient_id__in=[ingredient['id'] for ingredient in ingredients]).values_list('ingredient_id', 'location_id'):
+                ingredientLocations.setdefault(ingredientId, []).append(locationId)
+            for ingredient in ingredients:
+                ingredient['locations'] = ingredientLocations.get(ingredient['id'], [])
+                yield CollectionExport.line('ingredient', ingredient)
+
+        #--- Recipes, with their ingredients
+        recipeFields = ('id', 'name', 'category', 'duration', 'serves', 'description', 'image')
+        for recipes in CollectionExport.chunks(Recipe.objects.filter(user_id=userId), recipeFields, chunkSize):
+            recipeIngredients = {}
+            rows = RecipeIngredient.objects.filter(recipe_id__in=[recipe['id'] for recipe in recipes]).order_by('id')
+            for recipeId, ingredientId, unit, quantity in rows.values_list('recipe_id', 'ingredient_id', 'unit', 'quantity'):
+                recipeIngredients.setdefault(recipeId, []).append({'ingredient': ingredientId, 'unit': unit, 'quantity': quantity})
+            for recipe in recipes:
+                recipe['ingredients'] = recipeIngredients.get(recipe['id'], [])
+                yield CollectionExport.line('recipe', recipe)
+
+        #--- Shopping lists, with their items
+        for shoppingLists in CollectionExport.chunks(ShoppingList.objects.filter(user_id=userId), ('id', 'name', 'date'), chunkSize):
+            items = {}
+            rows = ShoppingItem.objects.filter(shoppingList_id__in=[shoppingList['id'] for shoppingList in shoppingLists]).order_by('id')
+            for shoppingListId, recipeId, ingredientId, unit, quantity in rows.values_list('shoppingList_id', 'recipe_id', 'ingredient_id', 'unit', 'quantity'):
+                items.setdefault(shoppingListId, []).append({'recipe': recipeId, 'ingredient': ingredientId, 'unit': unit, 'quantity': quantity})
+            for shoppingList in shoppingLists:
+                shoppingList['date'] = shoppingList['date'].isoformat()
+                shoppingList['items'] = items.get(shoppingList['id'], [])
+                yield CollectionExport.line('shoppingList', shoppingList)
+
+        #--- Profile
+        profile = UserProfile.objects.filter(user_id=userId).values('shop_id', 'shoppingList_id').first()
+        if profile is not None:
+            yield CollectionExport.line('profile', {'shop': profile['shop_id'], 'shoppingList': profile['shoppingList_id']})
+
+
+class CollectionImportError(Exception):
+    """
+    Invalid line of an imported collection, nothing is imported.
+    """
+
+    def __init__(self, line, message):
+        super(CollectionImportError, self).__init__('Line %d: %s' % (line, message))
+        self.line = line
+        self.message = message
+
+
+class CollectionImport(object):
+    """
+    Adds a collection in the format of CollectionExport to the collection of a user.
+
+    The lines are parsed one by one and the objects are written in bulk, COLLECTION_IMPORT_BATCH_SIZE
+    objects of the same type at a time. Ids in the stream (exported ids or '_'-style temporary ids)
+    only serve as references: every object is created again, except ingredients, which are merged
+    with the user's ingredients of the same name. Objects have to be listed after the objects they
+    reference. Run in a transaction: on a CollectionImportError nothing should be kept. Streams
+    from clients are spooled first (see spool), the transaction does not wait for the network.
+    As bulk inserts send no signals, the statistics, the search index, the change log and the
+    cached indexes and responses of the user are updated explicitly.
+    """
+
+    KINDS = ('shop', 'location', 'ingredient', 'recipe', 'shoppingList', 'profile')
+
+    def __init__(self, user, batchSize=None):
+        self.user = user
+        self.batchSize = batchSize or getattr(settings, 'COLLECTION_IMPORT_BATCH_SIZE', 500)
+        self.ids = dict((kind, {}) for kind in CollectionImport.KINDS)   # kind -> {id in the stream: id}
+        self.counts = dict((kind, 0) for kind in CollectionImport.KINDS)
+        self.ingredientIds = None                                        # name -> id of the user's ingredients
+        self.pendingKind = None
+        self.pending = []                                                # [(line number, object)]
+
+    @staticmethod
+    def spool(lines, maxBytes, maxLines):
+        # The lines copied to a temporary file (in memory up to COLLECTION_IMPORT_SPOOL_SIZE bytes),
+        # at most maxBytes bytes and maxLines lines
+        spooled = tempfile.SpooledTemporaryFile(max_size=getattr(settings, 'COLLECTION_IMPORT_SPOOL_SIZE', 1024 * 1024))
+        size = 0
+        try:
+            for number, line in enumerate(lines, 1):
+                size += len(line)
+                if size > maxBytes:
+                    raise CollectionImportError(number, 'the collection is larger than %d bytes' % maxBytes)
+                if number > maxLines:
+                    raise CollectionImportError(number, 'the collection has more than %d lines' % maxLines)
+                spooled.write(line)
+        except CollectionImportError:
+            spooled.close()
+            raise
+        spooled.seek(0)
+        return spooled
+
+    def run(self, lines):
+        # Imports an iterable of NDJSON lines, returns the number of objects created per kind
+        Changes.lock(self.user.id)
+        for number, line in enumerate(lines, 1):
+            if isinstance(line, six.binary_type):
+                try:
+                    line = line.decode('utf-8')
+                except UnicodeDecodeError:
+                    raise CollectionImportError(number, 'invalid UTF-8')
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                raise CollectionImportError(number, 'invalid JSON')
+            if not isinstance(data, dict):
+                raise CollectionImportError(number, 'an object is expected')
+
+            kind = data.get('type')
+            if kind == 'header':
+                if data.get('format') != CollectionExport.FORMAT or data.get('version') != CollectionExport.VERSION:
+                    raise CollectionImportError(number, 'unsupported format')
+                continue
+            if kind not in CollectionImport.KINDS:
+                raise CollectionImportError(number, 'unknown type %r' % (kind,))
+            if (kind != self.pendingKind) or (len(self.pending) >= self.batchSize):
+                self.flush()
+            self.pendingKind = kind
+            self.pending.append((number, data))
+        self.flush()
+        self.finish()
+        return dict(self.counts)
+
+    #--- Validation
+
+    @staticmethod
+    def check(number, condition, message):
+        if not condition:
+            raise CollectionImportError(number, message)
+
+    @staticmethod
+    def text(number, data, field, maxLength, default=None):
+        value = data.get(field, default)
+        CollectionImport.check(number, isinstance(value, six.string_types) and len(value) <= maxLength,
+                               'invalid %s (text of at most %d characters expected)' % (field, maxLength))
+        return value
+
+    @staticmethod
+    def date(number, data, field):
+        value = data.get(field)
+        if value is None:
+            return None
+        try:
+            value = parse_date(value) if isinstance(value, six.string_types) else None
+        except ValueError:
+            value = None
+        CollectionImport.check(number, value is not None, 'invalid %s (YYYY-MM-DD expected)' % field)
+        return value
+
+    @staticmethod
+    def number(number, data, field, default, numberType=numbers.Number):
+        value = data.get(field, default)
+        CollectionImport.check(number, isinstance(value, numberType) and not isinstance(value, bool), 'invalid %s' % field)
+        return value
+
+    def reference(self, number, kind, key):
+        # Id of the object of the given kind that was listed with the given id
+        newId = self.ids[kind].get(six.text_type(key))
+        CollectionImport.check(number, newId is not None, 'unknown %s %r' % (kind, key))
+        return newId
+
+    def image(self, number, image):
+        # Image store reference, the image may be embedded (encoded as by RecipeEp.post).
+        # References to images the user did not upload are dropped.
+        if (image is None) or (image == ''):
+            return None
+        CollectionImport.check(number, isinstance(image, six.string_types), 'invalid image')
+        if imageStore.isImageId(image):
+            return image if UserImages.owns(self.user.id, image) else None
+        try:
+            return UserImages.store(self.user.id, image)
+        except ValueError as e:
+            raise CollectionImportError(number, 'invalid image (%s)' % e)
+
+    #--- Writing
+
+    def created(self, model, lastId, objects):
+        # bulk_create does not set the ids (MySQL, SQLite). The user's new rows are the ones after
+        # lastId, in insertion order; the imports of a user are serialized by Changes.lock.
+        model.objects.bulk_create(objects)
+        return list(model.objects.filter(user=self.user, id__gt=lastId).order_by('id').values_list('id', flat=True))
+
+    def lastId(self, model):
+        return model.objects.filter(user=self.user).aggregate(lastId=Max('id'))['lastId'] or 0
+
+    def register(self, kind, entries, newIds):
+        # entries: [(line number, object)] in the order of newIds
+        for (number, data), newId in zip(entries, newIds):
+            if data.get('id') is not None:
+                key = six.text_type(data['id'])
+                CollectionImport.check(number, key not in self.ids[kind], 'duplicate %s id %r' % (kind, data['id']))
+                self.ids[kind][key] = newId
+        self.counts[kind] += len(newIds)
+
+    def flush(self):
+        if self.pending:
+            getattr(self, 'flush' + self.pendingKind[0].upper() + self.pendingKind[1:])(self.pending)
+        self.pending = []
+
+    def flushShop(self, entries):
+        shops = [Shop(name=CollectionImport.text(number, data, 'name', 32), user=self.user) for number, data in entries]
+        newIds = self.created(Shop, self.lastId(Shop), shops)
+        self.register('shop', entries, newIds)
+        Changes.recordMany(self.user.id, Changes.SHOP, newIds)
+
+    def flushLocation(self, entries):
+        locations = [Location(name=CollectionImport.text(number, data, 'name', 32), user=self.user,
+                              shop_id=self.reference(number, 'shop', data.get('shop'))) for number, data in entries]
+        newIds = self.created(Location, self.lastId(Location), locations)
+        self.register('location', entries, newIds)
+        Changes.recordMany(self.user.id, Changes.LOCATION, newIds)
+
+    def flushIngredient(self, entries):
+        if self.ingredientIds is None:
+            self.ingredientIds = dict(Ingredient.objects.filter(user=self.user).values_list('name', 'id'))
+
+        newNames = []
+        for number, data in entries:
+            name = CollectionImport.text(number, data, 'name', 32)
+            CollectionImport.check(number, name != '', 'invalid name')
+            CollectionImport.check(number, isinstance(data.get('locations', []), list), 'invalid locations')
+            if (name not in self.ingredientIds) and (name not in newNames):
+                newNames.append(name)
+        Ingredient.objects.bulk_create([Ingredient(name=name, user=self.user) for name in newNames])
+        createdIds = Ingredient.objects.filter(user=self.user, name__in=newNames).values_list('name', 'id')
+        self.ingredientIds.update(createdIds)
+
+        # Ingredients merged by name may be listed several times, or have the location already
+        pairs = set([])
+        for number, data in entries:
+            ingredientId = self.ingredientIds[data['name']]
+            for locationKey in data.get('locations', []):
+                pairs.add((ingredientId, self.reference(number, 'location', locationKey)))
+        if pairs:
+            pairs -= set(IngredientLocation.objects.filter(ingredient_id__in=set(ingredientId for ingredientId, locationId in pairs),
+                                                           location_id__in=set(locationId for ingredientId, locationId in pairs))
+                         .values_list('ingredient_id', 'location_id'))
+        IngredientLocation.objects.bulk_create([IngredientLocation(ingredient_id=ingredientId, location_id=locationId)
+                                                for ingredientId, locationId in sorted(pairs)])
+
+        self.register('ingredient', entries, [self.ingredientIds[data['name']] for number, data in entries])
+        self.counts['ingredient'] += len(newNames) - len(entries)
+        # Merged ingredients changed too when they got locations
+        Changes.recordMany(self.user.id, Changes.INGREDIENT, set(self.ingredientIds[data['name']] for number, data in entries
+                                                                   if (data['name'] in newNames) or data.get('locations')))
+
+    def flushRecipe(self, entries):
+        recipes = []
+        for number, data in entries:
+            recipes.append(Recipe(
+                name=CollectionImport.text(number, data, 'name', 128), category=CollectionImport.text(number, data, 'category', 32, ''),
+                duration=CollectionImport.number(number, data, 'duration', 30, six.integer_types),
+                serves=CollectionImport.number(number, data, 'serves', 2, six.integer_types),
+                description=CollectionImport.text(number, data, 'description', 2048, ''),
+                image=self.image(number, data.get('image')), user=self.user
+            ))
+            CollectionImport.check(number, isinstance(data.get('ingredients', []), list), 'invalid ingredients')
+            for recipeIngredient in data.get('ingredients', []):
+                CollectionImport.check(number, isinstance(recipeIngredient, dict), 'invalid recipe ingredient')
+                self.reference(number, 'ingredient', recipeIngredient.get('ingredient'))
+                CollectionImport.text(number, recipeIngredient, 'unit', 16, '')
+                CollectionImport.number(number, recipeIngredient, 'quantity', 0)
+        newIds = self.created(Recipe, self.lastId(Recipe), recipes)
+
+        recipeIngredients = []
+        for (number, data), recipeId in zip(entries, newIds):
+            for recipeIngredient in data.get('ingredients', []):
+                recipeIngredients.append(RecipeIngredient(
+                    unit=recipeIngredient.get('unit', ''), quantity=recipeIngredient.get('quantity', 0), recipe_id=recipeId,
+                    ingredient_id=self.reference(number, 'ingredient', recipeIngredient['ingredient'])
+                ))
+        RecipeIngredient.objects.bulk_create(recipeIngredients)
+
+        self.register('recipe', entries, newIds)
+        SearchIndex.indexRecipes(self.user.id, newIds)
+        Changes.recordMany(self.user.id, Changes.RECIPE, newIds)
+
+    def flushShoppingList(self, entries):
+        shoppingLists = []
+        dates = []
+        for number, data in entries:
+            shoppingLists.append(ShoppingList(name=CollectionImport.text(number, data, 'name', 64, ''), user=self.user))
+            dates.append(CollectionImport.date(number, data, 'date'))
+            CollectionImport.check(number, isinstance(data.get('items', []), list), 'invalid items')
+            for item in data.get('items', []):
+                CollectionImport.check(number, isinstance(item, dict) and ((item.get('recipe') is None) != (item.get('ingredient') is None)),
+                                       'an item references either a recipe or an ingredient')
+                CollectionImport.text(number, item, 'unit', 16, '')
+                CollectionImport.number(number, item, 'quantity', 0)
+        newIds = self.created(ShoppingList, self.lastId(ShoppingList), shoppingLists)
+        # The date is set on creation (auto_now_add), the exported one is written afterwards
+        Utils.bulkUpdate(ShoppingList, [ShoppingList(id=shoppingListId, date=date) for shoppingListId, date in zip(newIds, dates)
+                                        if date is not None], ['date'])
+
+        items = []
+        for (number, data), shoppingListId in zip(entries, newIds):
+            for item in data.get('items', []):
+                if item.get('recipe') is not None:
+                    shoppingItem = ShoppingItem(recipe_id=self.reference(number, 'recipe', item['recipe']))
+                else:
+                    shoppingItem = ShoppingItem(ingredient_id=self.reference(number, 'ingredient', item['ingredient']))
+                shoppingItem.unit = item.get('unit', '')
+                shoppingItem.quantity = item.get('quantity', 0)
+                shoppingItem.shoppingList_id = shoppingListId
+                items.append(shoppingItem)
+        ShoppingItem.objects.bulk_create(items)
+
+        self.register('shoppingList', entries, newIds)
+        Changes.recordMany(self.user.id, Changes.SHOPPING_LIST, newIds)
+
+    def flushProfile(self, entries):
+        # The current shop and shopping list, saved normally (the signals update the caches)
+        number, data = entries[-1]
+        profile, created = UserProfile.objects.get_or_create(user=self.user)
+        if data.get('shop') is not None:
+            profile.shop_id = self.reference(number, 'shop', data['shop'])
+        if data.get('shoppingList') is not None:
+            profile.shoppingList_id = self.reference(number, 'shoppingList', data['shoppingList'])
+        profile.save()
+        self.counts['profile'] = 1
+
+    def finish(self):
+        Statistics.rebuild(self.user.id)
+        PantryIndex.invalidate(self.user.id)
+        IngredientIndex.invalidate(self.user.id)
@@ -0,0 +1,70 @@
+import zlib
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Compression():
+    """
+    Content encodings of response payloads: gzip, plus brotli and zstd when the brotli and
+    zstandard packages are installed. Payloads are meant to be compressed once (see
+    responses.py), so the compression levels favour size over speed.
+    """
+
+    # Server preference, used between encodings the client accepts equally
+    PREFERENCE = ('br', 'zstd', 'gzip')
+
+    @staticmethod
+    def available():
+        return [encoding for encoding in Compression.PREFERENCE
+                if (encoding == 'gzip') or (encoding == 'br' and brotli is not None) or (encoding == 'zstd' and zstandard is not None)]
+
+    @staticmethod
+    def minSize():
+        return getattr(settings, 'RESPONSE_COMPRESSION_MIN_SIZE', 1024)
+
+    @staticmethod
+    def negotiate(acceptEncoding):
+        # Best available encoding of an Accept-Encoding header, None for the identity
+        qualities = {}
+        for value in acceptEncoding.split(','):
+            parts = value.strip().split(';')
+            encoding = parts[0].strip().lower()
+            if not encoding:
+                continue
+            quality = 1.0
+            for parameter in parts[1:]:
+                name, _, number = parameter.strip().partition('=')
+                if name.strip() == 'q':
+                    try:
+                        quality = float(number)
+                    except ValueError:
+                        quality = 0.0
+            qualities[encoding] = quality
+
+        best = None
+        for encoding in Compression.available():
+            quality = qualities.get(encoding, qualities.get('*', 0.0))
+            if quality > 0 and (best is None or quality > best[0]):
+                best = (quality, encoding)
+        return None if best is None else best[1]
+
+    @staticmethod
+    def compress(content, encoding):
+        if encoding == 'gzip':
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            return compressor.compress(content) + compressor.flush()
+        if encoding == 'br':
+            return brotli.compress(content, quality=getattr(settings, 'RESPONSE_COMPRESSION_BROTLI_QUALITY', 9))
+        if encoding == 'zstd':
+            return zstandard.ZstdCompressor(level=getattr(settings, 'RESPONSE_COMPRESSION_ZSTD_LEVEL', 19)).compress(content)
+        raise ValueError('Unknown content encoding: %s' % encoding)
@@ -0,0 +1,69 @@
+from .models import ShoppingItem
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum, F, Case, When, FloatField
+
+
+class ConsolidatedShoppingList():
+    """
+    Ingredient totals of a shopping list: the ingredients of the recipe items, scaled
+    by the number of serves in the list, merged with the free ingredient items.
+    Results are cached per shopping list and invalidated by the signals in signals.py.
+    """
+
+    @staticmethod
+    def cacheKey(shoppingListId):
+        return 'consolidated-shopping-list:%s' % shoppingListId
+
+    @staticmethod
+    def get(shoppingListId):
+        key = ConsolidatedShoppingList.cacheKey(shoppingListId)
+        items = cache.get(key)
+        if items is None:
+            items = ConsolidatedShoppingList.compute(shoppingListId)
+            cache.set(key, items, getattr(settings, 'CONSOLIDATED_SHOPPING_LIST_TIMEOUT', 300))
+        return {'id': int(shoppingListId), 'items': items}
+
+    @staticmethod
+    def invalidate(shoppingListIds):
+        # Delayed until the transaction is committed, so that no reader can cache the old data again
+        keys = [ConsolidatedShoppingList.cacheKey(shoppingListId) for shoppingListId in shoppingListIds]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
+
+    @staticmethod
+    def invalidateRecipe(recipeId):
+        shoppingListIds = ShoppingItem.objects.filter(recipe_id = recipeId).values_list('shoppingList_id', flat=True)
+        ConsolidatedShoppingList.invalidate(set(shoppingListIds))
+
+    @staticmethod
+    def compute(shoppingListId):
+        items = ShoppingItem.objects.filter(shoppingList_id = shoppingListId)
+
+        # Recipe items: quantity = serves, recipe ingredients are given for recipe.serves
+        recipeQuantity = F('recipe__recipe_ingredients__quantity') * F('quantity')
+        recipeTotals = items.filter(recipe__recipe_ingredients__isnull = False).values(
+            'recipe__recipe_ingredients__ingredient_id', 'recipe__recipe_ingredients__unit'
+        ).annotate(total = Sum(Case(
+            When(recipe__serves__gt = 0, then = recipeQuantity / F('recipe__serves')),
+            default = recipeQuantity,
+            output_field = FloatField()
+        ))).order_by()
+
+        # Free items
+        ingredientTotals = items.filter(ingredient__isnull = False).values(
+            'ingredient_id', 'unit'
+        ).annotate(total = Sum('quantity')).order_by()
+
+        totals = {}
+        for row in recipeTotals:
+            key = (row['recipe__recipe_ingredients__ingredient_id'], row['recipe__recipe_ingredients__unit'])
+            totals[key] = totals.get(key, 0) + (row['total'] or 0)
+        for row in ingredientTotals:
+            key = (row['ingredient_id'], row['unit'])
+            totals[key] = totals.get(key, 0) + (row['total'] or 0)
+
+        return [{'ingredient': ingredientId, 'unit': unit, 'quantity': totals[(ingredientId, unit)]}
+                for (ingredientId, unit) in sorted(totals)]
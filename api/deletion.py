@@ -0,0 +1,131 @@
+import time
+import logging
+
+from .models import Recipe, RecipeIngredient, Ingredient, UserProfile, ShoppingList, ShoppingItem, Shop, Location, IngredientLocation, UserStatistic, UserDeletion, RecipeTerm, Change, UserImage
+from .utils import Utils
+from .profiles import UserProfiles
+from .authentications import TokenCache, BasicCredentialCache
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+logger = logging.getLogger(__name__)
+
+
+class UserDeletions():
+    """
+    Deferred deletion of user accounts.
+
+    schedule() only deactivates the user, revokes its credentials and records a UserDeletion,
+    the data is purged later by a DeletionWorker (see delete_user.py).
+    """
+
+    @staticmethod
+    def schedule(user):
+        with transaction.atomic():
+            user.is_active = False
+            user.save(update_fields=['is_active'])
+            TokenCache.revokeUser(user)
+            Token.objects.filter(user_id=user.id).delete()
+            deletion, created = UserDeletion.objects.get_or_create(userId=user.id, defaults={'username': user.username})
+        BasicCredentialCache.revoke(user.username)
+        return deletion
+
+    @staticmethod
+    def pending():
+        return UserDeletion.objects.filter(finished__isnull=True).order_by('id')
+
+
+class DeletionWorker(object):
+    """
+    Purges the data of the scheduled user deletions, table by table (children first) in
+    chunks of ACCOUNT_DELETION_CHUNK_SIZE rows. Each chunk is a short transaction of its own
+    and the progress is saved after each chunk, so an interrupted purge is resumed where it stopped.
+    A deletion that fails keeps its error and is retried by the next drain, the others go on.
+    """
+
+    # (model, lookup of the owning user), in an order that respects the foreign keys
+    STAGES = [
+        (UserProfile, 'user_id'),
+        (ShoppingItem, 'shoppingList__user'),
+        (ShoppingList, 'user_id'),
+        (RecipeIngredient, 'recipe__user'),
+        (IngredientLocation, 'ingredient__user'),
+        (RecipeTerm, 'user_id'),
+        (Recipe, 'user_id'),
+        (Location, 'user_id'),
+        (Ingredient, 'user_id'),
+        (Shop, 'user_id'),
+        (UserStatistic, 'user_id'),
+        (Token, 'user_id'),
+        (Change, 'user_id'),
+        (UserImage, 'user_id'),
+    ]
+
+    def __init__(self, chunkSize=None):
+        self.chunkSize = chunkSize or getattr(settings, 'ACCOUNT_DELETION_CHUNK_SIZE', 500)
+
+    def detach(self, model, ids):
+        # The chunks are deleted without cascading. The rows of the user referring to them are gone
+        # (earlier stages), rows of other users still referring to them are deleted, or set to null,
+        # through the ORM, which cascades further and sends the signals keeping their data up to date.
+        relations = [field for field in model._meta.get_fields(include_hidden=True)
+                     if field.auto_created and not field.concrete and (field.one_to_many or field.one_to_one)]
+        for relation in relations:
+            referring = relation.related_model._base_manager.filter(**{'%s__in' % relation.field.name: ids})
+            if relation.on_delete is models.SET_NULL:
+                for obj in referring:
+                    setattr(obj, relation.field.name, None)
+                    obj.save(update_fields=[relation.field.name])
+            else:
+                referring.delete()
+
+    def purgeChunk(self, model, lookup, userId):
+        ids = list(model.objects.filter(**{lookup: userId}).order_by().values_list('pk', flat=True)[:self.chunkSize])
+        if ids:
+            self.detach(model, ids)
+            Utils.bulkDelete(model.objects.filter(pk__in=ids))
+        return len(ids)
+
+    def purge(self, deletion):
+        userId = deletion.userId
+        while deletion.stage < len(DeletionWorker.STAGES):
+            model, lookup = DeletionWorker.STAGES[deletion.stage]
+            with transaction.atomic():
+                deleted = self.purgeChunk(model, lookup, userId)
+                deletion.rowsDeleted += deleted
+                if deleted < self.chunkSize:
+                    deletion.stage += 1
+                deletion.save(update_fields=['stage', 'rowsDeleted'])
+
+        # Only the user row is left, with nothing heavy to cascade to
+        with transaction.atomic():
+            User.objects.filter(id=userId).delete()
+            deletion.finished = timezone.now()
+            deletion.save(update_fields=['finished'])
+        UserProfiles.invalidate(userId)
+        logger.info('Deleted user %s (%s rows)', deletion.username, deletion.rowsDeleted)
+
+    def drain(self):
+        # Purge all the pending deletions, return the number of accounts deleted
+        deleted = 0
+        for deletion in list(UserDeletions.pending()):
+            try:
+                self.purge(deletion)
+            except Exception as e:
+                logger.exception('Cannot delete user %s', deletion.username)
+                deletion.lastError = repr(e)[:256]
+                deletion.save(update_fields=['lastError'])
+                continue
+            deleted += 1
+        return deleted
+
+    def run(self, interval=None):
+        interval = interval or getattr(settings, 'ACCOUNT_DELETION_POLL_INTERVAL', 30)
+        while True:
+            self.drain()
+            time.sleep(interval)
@@ -0,0 +1,194 @@
+import os
+import re
+import base64
+import binascii
+import hashlib
+import tempfile
+from io import BytesIO
+
+from .models import UserImage
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class ImageStore(object):
+    """
+    Disk-backed, content-addressed store for recipe images.
+
+    Images are identified by the sha256 of their content, so identical uploads
+    are stored only once. Thumbnails are created next to the original when an
+    image is first stored (requires Pillow, otherwise the original is served).
+    """
+
+    ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+    DATA_URL_PATTERN = re.compile(r'^data:[^;,]*(;base64)?,', re.IGNORECASE)
+    BASE64_PATTERN = re.compile(r'^[A-Za-z0-9+/]*={0,2}$')
+
+    CONTENT_TYPES = (
+        (b'\xff\xd8\xff', 'image/jpeg'),
+        (b'\x89PNG\r\n\x1a\n', 'image/png'),
+        (b'GIF87a', 'image/gif'),
+        (b'GIF89a', 'image/gif'),
+        (b'RIFF', 'image/webp'),
+    )
+
+    def __init__(self, root=None, thumbnailSizes=None, maxSize=None):
+        self.root = root or getattr(settings, 'IMAGE_STORE_ROOT', os.path.join(settings.BASE_DIR, 'images'))
+        self.thumbnailSizes = thumbnailSizes or getattr(settings, 'IMAGE_THUMBNAIL_SIZES', (128, 512))
+        self.maxSize = maxSize or getattr(settings, 'IMAGE_MAX_SIZE', 5 * 1024 * 1024)
+
+    @classmethod
+    def isImageId(cls, value):
+        return value is not None and cls.ID_PATTERN.match(value) is not None
+
+    def decode(self, encoded):
+        # Images are sent by the clients either as data URLs or as plain base64 strings.
+        # Only strict base64 is accepted, the size is checked before decoding.
+        match = self.DATA_URL_PATTERN.match(encoded)
+        if match is not None:
+            encoded = encoded[match.end():]
+        if (len(encoded) % 4 != 0) or (self.BASE64_PATTERN.match(encoded) is None):
+            raise ValueError('Unknown image encoding')
+        if len(encoded) // 4 * 3 > self.maxSize + 2:
+            raise ValueError('Image too large')
+        try:
+            return base64.b64decode(encoded)
+        except (TypeError, ValueError, binascii.Error):
+            raise ValueError('Unknown image encoding')
+
+    @classmethod
+    def contentType(cls, data):
+        for magic, contentType in cls.CONTENT_TYPES:
+            if data.startswith(magic):
+                return contentType
+        return 'application/octet-stream'
+
+    def path(self, imageId, size=None):
+        name = imageId if size is None else '%s.%d' % (imageId, size)
+        return os.path.join(self.root, imageId[0:2], imageId[2:4], name)
+
+    @staticmethod
+    def imageId(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def putEncoded(self, encoded):
+        return self.put(self.decode(encoded))
+
+    def put(self, data):
+        if len(data) > self.maxSize:
+            raise ValueError('Image too large')
+        imageId = self.imageId(data)
+        path = self.path(imageId)
+        if not os.path.exists(path):
+            self._write(path, data)
+            self._createThumbnails(imageId, data)
+        return imageId
+
+    def get(self, imageId, size=None):
+        """
+        Return the content of an image or of its closest thumbnail not smaller than size.
+        The original is returned when no such thumbnail exists, None when the image is unknown.
+        """
+        path = self.path(imageId)
+        if size is not None:
+            for thumbnailSize in sorted(self.thumbnailSizes):
+                if thumbnailSize >= size and os.path.exists(self.path(imageId, thumbnailSize)):
+                    path = self.path(imageId, thumbnailSize)
+                    break
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def _write(self, path, data):
+        # Write to a temporary file first so that concurrent readers never see partial images
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        fd, tmpPath = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmpPath, path)
+        except Exception:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+
+    def _createThumbnails(self, imageId, data):
+        if Image is None:
+            return
+        try:
+            original = Image.open(BytesIO(data))
+            original.load()
+        except Exception:
+            return
+        for size in self.thumbnailSizes:
+            if max(original.size) <= size:
+                continue
+            thumbnail = original.copy()
+            thumbnail.thumbnail((size, size), Image.LANCZOS)
+            if thumbnail.mode in ('RGBA', 'LA', 'P'):
+                thumbnailFormat = 'PNG'
+            else:
+                thumbnailFormat = 'JPEG'
+                thumbnail = thumbnail.convert('RGB')
+            output = BytesIO()
+            thumbnail.save(output, thumbnailFormat)
+            self._write(self.path(imageId, size), output.getvalue())
+
+
+class UserImages():
+    """
+    Owners of the images of the store. Images are shared by content, but a user can only
+    reference and read the images it uploaded itself.
+    """
+
+    @staticmethod
+    def owns(userId, imageId):
+        return UserImage.objects.filter(user_id=userId, imageId=imageId).exists()
+
+    @staticmethod
+    def prepare(userId, image):
+        # Check an image reference or an encoded image without storing anything (ValueError if invalid).
+        # Return the image store reference and the image to store, None for references.
+        if (image is None) or (image == ''):
+            return None, None
+        if imageStore.isImageId(image):
+            if not UserImages.owns(userId, image):
+                raise ValueError('Unknown image')
+            return image, None
+        data = imageStore.decode(image)
+        if len(data) > imageStore.maxSize:
+            raise ValueError('Image too large')
+        return imageStore.imageId(data), data
+
+    @staticmethod
+    def save(userId, data):
+        imageId = imageStore.put(data)
+        try:
+            with transaction.atomic():
+                UserImage.objects.get_or_create(user_id=userId, imageId=imageId)
+        except IntegrityError:
+            pass
+        return imageId
+
+    @staticmethod
+    def store(userId, image):
+        # Return the image store reference for an image reference or an encoded image (ValueError if invalid)
+        imageId, data = UserImages.prepare(userId, image)
+        return imageId if data is None else UserImages.save(userId, data)
+
+
+imageStore = ImageStore()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import re
+import base64
+import binascii
+import hashlib
+import tempfile
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# The part of the image store (see images.py) the migration needs, as it was when the store was
+# introduced. Images are moved whatever their size, thumbnails are not created: the store serves
+# the original until a thumbnail exists.
+
+ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+DATA_URL_PATTERN = re.compile(r'^data:[^;,]*(;base64)?,', re.IGNORECASE)
+
+CONTENT_TYPES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'RIFF', 'image/webp'),
+)
+
+
+def storeRoot():
+    return getattr(settings, 'IMAGE_STORE_ROOT', os.path.join(settings.BASE_DIR, 'images'))
+
+
+def storePath(imageId):
+    return os.path.join(storeRoot(), imageId[0:2], imageId[2:4], imageId)
+
+
+def decode(encoded):
+    # Lenient: whitespace (e.g. line wrapping) is ignored and missing padding is added
+    match = DATA_URL_PATTERN.match(encoded)
+    if match is not None:
+        encoded = encoded[match.end():]
+    encoded = ''.join(encoded.split())
+    encoded += '=' * (-len(encoded) % 4)
+    try:
+        data = base64.b64decode(encoded)
+    except (TypeError, ValueError, binascii.Error):
+        return None
+    return data or None
+
+
+def put(data):
+    imageId = hashlib.sha256(data).hexdigest()
+    path = storePath(imageId)
+    if not os.path.exists(path):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmpPath = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmpPath, path)
+    return imageId
+
+
+def contentType(data):
+    for magic, imageContentType in CONTENT_TYPES:
+        if data.startswith(magic):
+            return imageContentType
+    return 'application/octet-stream'
+
+
+def inlineImages(Recipe):
+    for recipe in Recipe.objects.exclude(image__isnull=True).only('id', 'image').iterator():
+        if ID_PATTERN.match(recipe.image) is None:
+            yield recipe
+
+
+def moveImagesToStore(apps, schema_editor):
+    Recipe = apps.get_model('api', 'Recipe')
+    # Nothing is written before every image is known to be movable: an image that cannot be
+    # decoded stops the migration, its recipe has to be fixed by hand (the column is shortened)
+    undecodable = [recipe.pk for recipe in inlineImages(Recipe) if recipe.image.strip() and decode(recipe.image) is None]
+    if undecodable:
+        raise RuntimeError('Cannot decode the images of the recipes %s, fix or clear them and migrate again'
+                           % ', '.join(str(recipeId) for recipeId in undecodable))
+
+    for recipe in inlineImages(Recipe):
+        imageId = put(decode(recipe.image)) if recipe.image.strip() else None
+        Recipe.objects.filter(pk=recipe.pk).update(image=imageId)
+
+
+def moveImagesToDatabase(apps, schema_editor):
+    Recipe = apps.get_model('api', 'Recipe')
+    for recipe in Recipe.objects.exclude(image__isnull=True).only('id', 'image').iterator():
+        try:
+            with open(storePath(recipe.image), 'rb') as f:
+                data = f.read()
+        except IOError:
+            continue
+        encoded = 'data:%s;base64,%s' % (contentType(data), base64.b64encode(data).decode('ascii'))
+        Recipe.objects.filter(pk=recipe.pk).update(image=encoded)
+
+
+def recordOwners(apps, schema_editor):
+    # The images referenced by the recipes of a user belong to that user
+    Recipe = apps.get_model('api', 'Recipe')
+    UserImage = apps.get_model('api', 'UserImage')
+    owners = Recipe.objects.exclude(image__isnull=True).values_list('user_id', 'image').distinct()
+    UserImage.objects.bulk_create([UserImage(user_id=userId, imageId=imageId) for userId, imageId in owners])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0010_auto_20170515_2216'),
+    ]
+
+    operations = [
+        migrations.RunPython(moveImagesToStore, moveImagesToDatabase),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.CharField(db_index=True, max_length=64, null=True),
+        ),
+        migrations.CreateModel(
+            name='UserImage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('imageId', models.CharField(max_length=64)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='userimage',
+            unique_together=set([('user', 'imageId')]),
+        ),
+        migrations.RunPython(recordOwners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def buildStatistics(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    Recipe = apps.get_model('api', 'Recipe')
+    Ingredient = apps.get_model('api', 'Ingredient')
+    ShoppingList = apps.get_model('api', 'ShoppingList')
+    UserStatistic = apps.get_model('api', 'UserStatistic')
+
+    for userId in User.objects.values_list('id', flat=True).iterator():
+        statistics = []
+        recipes = 0
+        for row in Recipe.objects.filter(user_id=userId).values('category').annotate(recipes=Count('id')).order_by():
+            statistics.append(UserStatistic(kind='category', key=row['category'], value=row['recipes'], user_id=userId))
+            recipes += row['recipes']
+        ingredients = 0
+        for ingredientId, recipeNumber in Ingredient.objects.filter(user_id=userId).annotate(recipes=Count('recipe_ingredients')).values_list('id', 'recipes'):
+            statistics.append(UserStatistic(kind='ingredient', key=str(ingredientId), value=recipeNumber, user_id=userId))
+            ingredients += 1
+        statistics.append(UserStatistic(kind='total', key='recipes', value=recipes, user_id=userId))
+        statistics.append(UserStatistic(kind='total', key='ingredients', value=ingredients, user_id=userId))
+        statistics.append(UserStatistic(kind='total', key='shoppingLists', value=ShoppingList.objects.filter(user_id=userId).count(), user_id=userId))
+        UserStatistic.objects.bulk_create(statistics)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0011_recipe_image_store'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStatistic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=16)),
+                ('key', models.CharField(max_length=64)),
+                ('value', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='userstatistic',
+            unique_together=set([('kind', 'key', 'user')]),
+        ),
+        migrations.RunPython(buildStatistics, migrations.RunPython.noop),
+    ]
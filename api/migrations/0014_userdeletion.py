@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 12:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDeletion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('userId', models.IntegerField(unique=True)),
+                ('username', models.CharField(max_length=150)),
+                ('requested', models.DateTimeField(auto_now_add=True)),
+                ('stage', models.IntegerField(default=0)),
+                ('rowsDeleted', models.IntegerField(default=0)),
+                ('finished', models.DateTimeField(db_index=True, null=True)),
+                ('lastError', models.CharField(default='', max_length=256)),
+            ],
+        ),
+    ]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 12:49
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def buildIndex(apps, schema_editor):
+    from api.search import SearchIndex
+    Recipe = apps.get_model('api', 'Recipe')
+    RecipeIngredient = apps.get_model('api', 'RecipeIngredient')
+    RecipeTerm = apps.get_model('api', 'RecipeTerm')
+
+    ingredientNames = {}
+    for recipeId, ingredientName in RecipeIngredient.objects.values_list('recipe_id', 'ingredient__name').iterator():
+        ingredientNames.setdefault(recipeId, []).append(ingredientName)
+
+    recipeTerms = []
+    for recipeId, userId, name, category, description in Recipe.objects.values_list('id', 'user_id', 'name', 'category', 'description').iterator():
+        terms = SearchIndex.recipeTerms(name, category, description, ingredientNames.get(recipeId, []))
+        recipeTerms.extend(RecipeTerm(term=term, weight=weight, recipe_id=recipeId, user_id=userId) for term, weight in terms.items())
+        if len(recipeTerms) >= 1000:
+            RecipeTerm.objects.bulk_create(recipeTerms)
+            recipeTerms = []
+    RecipeTerm.objects.bulk_create(recipeTerms)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0014_userdeletion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=32)),
+                ('weight', models.IntegerField(default=1)),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.Recipe')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='recipeterm',
+            index_together=set([('user', 'term')]),
+        ),
+        migrations.RunPython(buildIndex, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 from django.db import models
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 
 class UserProfile(models.Model):
@@ -17,7 +18,7 @@ class Recipe(models.Model):
     duration = models.IntegerField(default=30)
     serves = models.IntegerField(default=2)
     description = models.CharField(max_length=2048)
-    image = models.TextField(null = True)
+    image = models.CharField(max_length=64, null = True, db_index = True)   # reference in the image store
     created = models. DateTimeField(auto_now_add=True)
     #-- FK
     user = models.ForeignKey('auth.User', related_name='recipes', on_delete = models.CASCADE)
@@ -90,8 +91,71 @@ class IngredientLocation(models.Model):
     ingredient = models.ForeignKey('Ingredient', related_name='locations', on_delete = models.CASCADE)
     location = models.ForeignKey('Location', related_name='ingredients', on_delete = models.CASCADE)
 
+class UserStatistic(models.Model):
+    kind = models.CharField(max_length=16)      # 'total', 'category' or 'ingredient'
+    key = models.CharField(max_length=64)       # total name, recipe category or ingredient id
+    value = models.IntegerField(default=0)
+    #-- FK
+    user = models.ForeignKey('auth.User', related_name='statistics', on_delete = models.CASCADE)
 
+    class Meta:
+        unique_together = ('kind', 'key', 'user')
 
-    
-    
-   
+class OutgoingEmail(models.Model):
+    recipient = models.CharField(max_length=254)
+    subject = models.CharField(max_length=128)
+    body = models.TextField()
+    created = models. DateTimeField(auto_now_add=True)
+    attempts = models.IntegerField(default=0)
+    nextAttempt = models.DateTimeField(db_index=True)       # when the (next) sending attempt is due
+    sent = models.DateTimeField(null = True, db_index=True)  # null until sent
+    failed = models.BooleanField(default=False)               # given up after too many attempts
+    lastError = models.CharField(max_length=256, default='')
+
+
+class UserDeletion(models.Model):
+    userId = models.IntegerField(unique=True)                   # not a FK, the user row is deleted last
+    username = models.CharField(max_length=150)
+    requested = models. DateTimeField(auto_now_add=True)
+    stage = models.IntegerField(default=0)                      # index of the next table to purge
+    rowsDeleted = models.IntegerField(default=0)
+    finished = models.DateTimeField(null = True, db_index=True) # null until the account is purged
+    lastError = models.CharField(max_length=256, default='')    # of the last failed attempt
+
+class RecipeTerm(models.Model):
+    term = models.CharField(max_length=32)      # normalized token (see search.py)
+    weight = models.IntegerField(default=1)     # importance of the term in the recipe
+    #-- FK
+    recipe = models.ForeignKey('Recipe', related_name='+', on_delete = models.CASCADE)
+    user = models.ForeignKey('auth.User', related_name='+', on_delete = models.CASCADE)
+
+    class Meta:
+        index_together = [('user', 'term')]
+
+class ChangeSequence(models.Model):
+    value = models.BigIntegerField(default=0)   # last change number of the user
+    pruned = models.BigIntegerField(default=0)  # deletions up to this change number were pruned from the log
+    #-- FK
+    user = models.OneToOneField('auth.User', related_name='+', on_delete = models.CASCADE)
+
+class Change(models.Model):
+    kind = models.CharField(max_length=16)      # 'recipe', 'ingredient', 'shop', 'location', 'shoppingList' or 'profile'
+    objectId = models.IntegerField()
+    sequence = models.BigIntegerField()         # change number of the last change of the object
+    deleted = models.BooleanField(default=False)
+    changed = models.DateTimeField(default=timezone.now, db_index=True)
+    #-- FK
+    user = models.ForeignKey('auth.User', related_name='+', on_delete = models.CASCADE)
+
+    class Meta:
+        unique_together = ('user', 'kind', 'objectId')
+        index_together = [('user', 'sequence')]
+
+class UserImage(models.Model):
+    imageId = models.CharField(max_length=64)   # reference in the image store
+    created = models. DateTimeField(auto_now_add=True)
+    #-- FK
+    user = models.ForeignKey('auth.User', related_name='+', on_delete = models.CASCADE)
+
+    class Meta:
+        unique_together = ('user', 'imageId')
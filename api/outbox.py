@@ -0,0 +1,156 @@
+import time
+import socket
+import smtplib
+import logging
+from datetime import timedelta
+from email.mime.text import MIMEText
+from email.header import Header
+from email.utils import formataddr
+
+from .models import OutgoingEmail
+from .site import Site
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox():
+    """
+    Persistent queue of e-mails, sent asynchronously by an OutboxWorker (see send_emails.py).
+    """
+
+    @staticmethod
+    def enqueue(recipient, subject, body):
+        return OutgoingEmail.objects.create(recipient=recipient, subject=subject, body=body, nextAttempt=timezone.now())
+
+    @staticmethod
+    def due(batchSize):
+        return list(OutgoingEmail.objects.filter(
+            sent__isnull=True, failed=False, nextAttempt__lte=timezone.now()
+        ).order_by('nextAttempt', 'id')[:batchSize])
+
+    @staticmethod
+    def claim(email, timeout):
+        # Claimed with a conditional UPDATE moving the next attempt past the claim timeout: a concurrent
+        # worker that read the same e-mail finds it changed and skips it. E-mails claimed by a worker
+        # that stopped are due again once the timeout has passed.
+        claimedUntil = timezone.now() + timedelta(seconds=timeout)
+        claimed = OutgoingEmail.objects.filter(
+            id=email.id, nextAttempt=email.nextAttempt, sent__isnull=True, failed=False
+        ).update(nextAttempt=claimedUntil)
+        if claimed:
+            email.nextAttempt = claimedUntil
+        return claimed == 1
+
+
+class OutboxWorker(object):
+    """
+    Sends the queued e-mails in batches over a single, reused SMTP connection.
+
+    Each e-mail is claimed before it is sent (see Outbox.claim), so several workers can run
+    at once. Failed e-mails are retried with an exponential backoff (OUTBOX_RETRY_DELAY * 2^attempts,
+    at most OUTBOX_MAX_RETRY_DELAY seconds) and given up after OUTBOX_MAX_ATTEMPTS attempts,
+    or at once when the error is not a delivery error (e.g. the message cannot be built).
+    Use useTls=False and no password to send to a local debugging server (python -m smtpd -n -c DebuggingServer).
+    """
+
+    def __init__(self, host=None, port=None, username=None, password=None, useTls=True):
+        self.host = host or Site.serverSmtp
+        self.port = port or Site.serverPort
+        self.username = Site.serverFromEmail if username is None else username
+        self.password = Site.serverPass if password is None else password
+        self.useTls = useTls
+        self.batchSize = getattr(settings, 'OUTBOX_BATCH_SIZE', 50)
+        self.maxAttempts = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8)
+        self.retryDelay = getattr(settings, 'OUTBOX_RETRY_DELAY', 30)
+        self.maxRetryDelay = getattr(settings, 'OUTBOX_MAX_RETRY_DELAY', 3600)
+        self.claimTimeout = getattr(settings, 'OUTBOX_CLAIM_TIMEOUT', 300)
+        self.connection = None
+
+    def connect(self):
+        if self.connection is not None:
+            try:
+                if self.connection.noop()[0] == 250:
+                    return self.connection
+            except smtplib.SMTPException:
+                pass
+            except socket.error:
+                pass
+            self.close()
+        connection = smtplib.SMTP(self.host, self.port, timeout=getattr(settings, 'OUTBOX_SMTP_TIMEOUT', 30))
+        if self.useTls:
+            connection.starttls()
+        if self.password:
+            connection.login(self.username, self.password)
+        self.connection = connection
+        return connection
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except (smtplib.SMTPException, socket.error):
+                pass
+            self.connection = None
+
+    def message(self, email):
+        msg = MIMEText(email.body)
+        msg['Subject'] = email.subject
+        msg['From'] = formataddr((str(Header(Site.serverFromName, 'utf-8')), Site.serverFromEmail))
+        msg['To'] = email.recipient
+        return msg.as_string()
+
+    def attemptFailed(self, email, error, giveUp):
+        email.attempts += 1
+        email.lastError = repr(error)[:256]
+        if giveUp or (email.attempts >= self.maxAttempts):
+            email.failed = True
+            logger.error('Giving up e-mail %s to %s: %r', email.id, email.recipient, error)
+        else:
+            delay = min(self.retryDelay * (2 ** (email.attempts - 1)), self.maxRetryDelay)
+            email.nextAttempt = timezone.now() + timedelta(seconds=delay)
+        email.save(update_fields=['attempts', 'lastError', 'failed', 'nextAttempt'])
+
+    def send(self, email):
+        try:
+            self.connect().sendmail(Site.serverFromEmail, [email.recipient], self.message(email))
+        except (smtplib.SMTPException, socket.error) as e:
+            # The connection may be broken, it is opened again for the next e-mail
+            if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                self.close()
+            self.attemptFailed(email, e, False)
+            return False
+        except Exception as e:
+            # Not a delivery error, retrying would not help; the worker goes on with the next e-mail
+            logger.exception('Cannot send e-mail %s to %s', email.id, email.recipient)
+            self.close()
+            self.attemptFailed(email, e, True)
+            return False
+        email.attempts += 1
+        email.sent = timezone.now()
+        email.save(update_fields=['attempts', 'sent'])
+        return True
+
+    def drain(self):
+        # Send all the e-mails that are due, return the number of e-mails sent
+        sent = 0
+        while True:
+            emails = Outbox.due(self.batchSize)
+            for email in emails:
+                if Outbox.claim(email, self.claimTimeout) and self.send(email):
+                    sent += 1
+            if len(emails) < self.batchSize:
+                return sent
+
+    def run(self, interval=None):
+        interval = interval or getattr(settings, 'OUTBOX_POLL_INTERVAL', 5)
+        try:
+            while True:
+                if self.drain() == 0:
+                    # Nothing to do, do not keep an idle connection open
+                    self.close()
+                time.sleep(interval)
+        finally:
+            self.close()
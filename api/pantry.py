@@ -0,0 +1,136 @@
+import heapq
+
+from .models import Recipe, RecipeIngredient
+from .caches import LRUCache, SharedVersion
+
+from django.conf import settings
+from django.db import transaction
+
+
+class PantryIndex(object):
+    """
+    Per-user bitset index of the recipes by ingredient, answering "what can I cook".
+
+    Each ingredient of the user gets a bit, each recipe the bitset of its ingredients, so the
+    coverage of a recipe by a pantry is popcount(recipe & pantry). Indexes are kept per process
+    (PANTRY_INDEX_CACHE_SIZE users) with a version number kept in the shared cache: a process
+    changing a recipe replaces its own index by an updated copy and bumps the version, the other
+    processes rebuild theirs (one query) when they see a newer version.
+    """
+
+    local = LRUCache(getattr(settings, 'PANTRY_INDEX_CACHE_SIZE', 1000), getattr(settings, 'PANTRY_INDEX_TIMEOUT', 3600))
+    versions = SharedVersion('pantry-index-version')
+
+    def __init__(self, userId, version):
+        self.userId = userId
+        self.version = version
+        self.bits = {}              # ingredientId -> bit position
+        self.ingredientIds = []     # bit position -> ingredientId
+        self.recipes = {}           # recipeId -> (bitset, ingredientIds, name, category, duration)
+        self.entries = None         # [(bitset, number of ingredients, name, recipeId, recipe)], scanned by cook()
+
+    #--- Access
+
+    @staticmethod
+    def get(userId):
+        version = PantryIndex.versions.get(userId)
+        index = PantryIndex.local.get(userId)
+        if (index is None) or (index.version != version):
+            index = PantryIndex.build(userId, version)
+            PantryIndex.local.set(userId, index)
+        return index
+
+    @staticmethod
+    def build(userId, version):
+        index = PantryIndex(userId, version)
+        recipeIngredients = {}
+        for recipeId, ingredientId in RecipeIngredient.objects.filter(recipe__user_id=userId).values_list('recipe_id', 'ingredient_id'):
+            recipeIngredients.setdefault(recipeId, set()).add(ingredientId)
+        for recipeId, name, category, duration in Recipe.objects.filter(user_id=userId).values_list('id', 'name', 'category', 'duration'):
+            index.setRecipe(recipeId, recipeIngredients.get(recipeId, ()), (name, category, duration))
+        return index
+
+    def setRecipe(self, recipeId, ingredientIds, fields):
+        bitset = 0
+        for ingredientId in ingredientIds:
+            bitset |= self.bit(ingredientId)
+        self.recipes[recipeId] = (bitset, tuple(sorted(ingredientIds))) + tuple(fields)
+        self.entries = None
+
+    def bit(self, ingredientId):
+        position = self.bits.get(ingredientId)
+        if position is None:
+            position = len(self.ingredientIds)
+            self.bits[ingredientId] = position
+            self.ingredientIds.append(ingredientId)
+        return 1 << position
+
+    #--- Updates
+
+    @staticmethod
+    def recipeChanged(userId, recipeId):
+        # Applied once committed, so that other processes cannot rebuild from the old data
+        transaction.on_commit(lambda: PantryIndex.update(userId, recipeId))
+
+    @staticmethod
+    def invalidate(userId):
+        # Rebuilt by all processes, e.g. after recipes were written in bulk
+        def bump():
+            PantryIndex.versions.bump(userId)
+            PantryIndex.local.delete(userId)
+        transaction.on_commit(bump)
+
+    @staticmethod
+    def update(userId, recipeId):
+        index = PantryIndex.local.get(userId)
+        version = PantryIndex.versions.bump(userId)
+        # Without a version yet, nobody has an index to keep up to date
+        if (version is None) or (index is None) or (index.version != version - 1):
+            PantryIndex.local.delete(userId)
+            return
+
+        # A new index replaces the old one, which may still be in use by other threads (cook)
+        newIndex = PantryIndex(userId, version)
+        newIndex.bits = dict(index.bits)
+        newIndex.ingredientIds = list(index.ingredientIds)
+        newIndex.recipes = dict(index.recipes)
+        recipe = Recipe.objects.filter(id=recipeId, user_id=userId).values_list('name', 'category', 'duration').first()
+        if recipe is None:
+            newIndex.recipes.pop(recipeId, None)
+        else:
+            newIndex.setRecipe(recipeId, set(RecipeIngredient.objects.filter(recipe_id=recipeId).values_list('ingredient_id', flat=True)), recipe)
+        PantryIndex.local.set(userId, newIndex)
+
+    #--- Queries
+
+    def cook(self, ingredientIds, limit=None):
+        # Recipes using at least one of the given ingredients, with the ingredients they miss
+        pantry = 0
+        for ingredientId in ingredientIds:
+            position = self.bits.get(ingredientId)
+            if position is not None:
+                pantry |= 1 << position
+
+        entries = self.entries
+        if entries is None:
+            entries = [(recipe[0], len(recipe[1]), recipe[2], recipeId, recipe) for recipeId, recipe in self.recipes.items()]
+            self.entries = entries
+
+        results = []
+        for bitset, total, name, recipeId, recipe in entries:
+            covered = bitset & pantry
+            if covered:
+                covered = bin(covered).count('1')
+                results.append((-float(covered) / total, total - covered, name, recipeId, recipe))
+        # Highest share of covered ingredients first, then fewest missing ones
+        results = heapq.nsmallest(limit, results) if limit is not None else sorted(results)
+
+        cookable = []
+        for (share, missing, name, recipeId, recipe) in results:
+            bitset, recipeIngredientIds, name, category, duration = recipe
+            cookable.append({
+                'id': recipeId, 'name': name, 'category': category, 'duration': duration,
+                'covered': len(recipeIngredientIds) - missing, 'total': len(recipeIngredientIds),
+                'missing': [ingredientId for ingredientId in recipeIngredientIds if ingredientId not in ingredientIds]
+            })
+        return cookable
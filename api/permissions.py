@@ -9,4 +9,4 @@ class IsOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
 
         # Write permissions are only allowed to the owner of the snippet.
-        return obj.user == request.user
\ No newline at end of file
+        return obj.user_id == request.user.id
\ No newline at end of file
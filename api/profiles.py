@@ -0,0 +1,42 @@
+from .models import UserProfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+
+
+class UserProfiles():
+    """
+    Access to the profile of the authenticated user, with its current shop and shopping list.
+
+    The profile is loaded at most once per request and is kept in the shared cache between
+    requests. Cached profiles are invalidated by the signals in signals.py when the profile,
+    or the shop or shopping lists of the user change.
+    """
+
+    @staticmethod
+    def cacheKey(userId):
+        return 'user-profile:%s' % userId
+
+    @staticmethod
+    def get(request):
+        userProfile = getattr(request, '_userProfile', None)
+        if userProfile is None:
+            userProfile = UserProfiles.load(request.user.id)
+            request._userProfile = userProfile
+        return userProfile
+
+    @staticmethod
+    def load(userId):
+        key = UserProfiles.cacheKey(userId)
+        userProfile = cache.get(key)
+        if userProfile is None:
+            userProfile = get_object_or_404(UserProfile.objects.select_related('shop', 'shoppingList'), user_id=userId)
+            cache.set(key, userProfile, getattr(settings, 'USER_PROFILE_CACHE_TIMEOUT', 600))
+        return userProfile
+
+    @staticmethod
+    def invalidate(userId):
+        key = UserProfiles.cacheKey(userId)
+        transaction.on_commit(lambda: cache.delete(key))
@@ -0,0 +1,267 @@
+import os
+import time
+import errno
+import hashlib
+import tempfile
+import threading
+import functools
+
+from .caches import LRUCache
+from .compression import Compression
+from .versions import Versions
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+
+class MemoryResponseStore(object):
+    """
+    Rendered responses kept in the memory of the process, least recently used ones
+    are evicted when their total size exceeds maxSize bytes.
+    """
+
+    def __init__(self, maxSize, timeout):
+        self.local = LRUCache(maxSize, timeout, sizeOf=len)
+
+    def get(self, key):
+        return self.local.get(key)
+
+    def set(self, key, content):
+        self.local.set(key, content)
+
+    def stats(self):
+        stats = self.local.stats()
+        return {'size': stats['size'], 'entries': stats['entries'], 'evictions': stats['evictions']}
+
+
+class FileResponseStore(object):
+    """
+    Rendered responses kept as files in a directory, which can be shared by the processes
+    of a host. Expired files and, beyond maxSize bytes, the least recently written ones are
+    removed every PRUNE_INTERVAL writes.
+    """
+
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, root, maxSize, timeout):
+        self.root = root
+        self.maxSize = maxSize
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.evictions = 0
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            if os.path.getmtime(path) + self.timeout < time.time():
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, key, content):
+        if not os.path.isdir(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        # Written to a temporary file first, readers never see a partial response
+        fd, tmpPath = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.rename(tmpPath, self.path(key))
+
+        with self.lock:
+            self.writes += 1
+            prune = (self.writes % self.PRUNE_INTERVAL == 0)
+        if prune:
+            self.prune()
+
+    def prune(self):
+        files = []
+        for name in os.listdir(self.root):
+            if name.startswith('.tmp-'):
+                continue
+            try:
+                info = os.stat(self.path(name))
+            except OSError:
+                continue
+            files.append((info.st_mtime, info.st_size, name))
+        files.sort()
+
+        expiresBefore = time.time() - self.timeout
+        size = sum(fileSize for mtime, fileSize, name in files)
+        for mtime, fileSize, name in files:
+            if (mtime >= expiresBefore) and (size <= self.maxSize):
+                break
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                continue
+            size -= fileSize
+            with self.lock:
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {'evictions': self.evictions}
+
+
+class SharedResponseStore(object):
+    """
+    Rendered responses kept in a Django cache (e.g. memcached), shared by all processes.
+    The cache evicts entries on its own, evictions are not reported.
+    """
+
+    def __init__(self, alias, timeout):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get('response:%s' % key)
+
+    def set(self, key, content):
+        self.cache.set('response:%s' % key, content, self.timeout)
+
+    def stats(self):
+        return {}
+
+
+class ResponseCache():
+    """
+    Cache of the rendered JSON of read endpoints.
+
+    Responses are cached per user and url, together with the version of the kinds of objects the
+    endpoint shows: the number of their last change, read from the database (see versions.py).
+    Every write to such an object takes a new number, so a changed response is never found again,
+    by any process, without invalidating anything, while writes to other kinds of objects keep it.
+    Compressed payloads are kept in the store too, under the key of their version and their
+    encoding. The store is chosen with RESPONSE_CACHE_BACKEND: 'memory' (per process), 'file' or
+    'shared'.
+    """
+
+    lock = threading.Lock()
+    hits = 0
+    misses = 0
+    compressions = 0
+    store = None
+
+    @staticmethod
+    def createStore():
+        backend = getattr(settings, 'RESPONSE_CACHE_BACKEND', 'memory')
+        maxSize = getattr(settings, 'RESPONSE_CACHE_SIZE', 64 * 1024 * 1024)
+        timeout = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 3600)
+        if backend == 'memory':
+            return MemoryResponseStore(maxSize, timeout)
+        if backend == 'file':
+            root = getattr(settings, 'RESPONSE_CACHE_ROOT', os.path.join(settings.BASE_DIR, 'responses'))
+            return FileResponseStore(root, maxSize, timeout)
+        if backend == 'shared':
+            return SharedResponseStore(getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default'), timeout)
+        raise ValueError('Unknown response cache backend: %s' % backend)
+
+    @staticmethod
+    def getStore():
+        if ResponseCache.store is None:
+            with ResponseCache.lock:
+                if ResponseCache.store is None:
+                    ResponseCache.store = ResponseCache.createStore()
+        return ResponseCache.store
+
+    @staticmethod
+    def key(userId, url, version):
+        # The version is read before the data, a concurrent change gives a newer version
+        return hashlib.sha1(('%s|%s|%s' % (userId, url, version)).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def inTransaction():
+        # Within a transaction (e.g. a batch) the version may come from changes that are not
+        # committed yet, and may still be rolled back: the data is read and not cached
+        return transaction.get_connection().in_atomic_block
+
+    @staticmethod
+    def count(hit):
+        with ResponseCache.lock:
+            if hit:
+                ResponseCache.hits += 1
+            else:
+                ResponseCache.misses += 1
+
+    @staticmethod
+    def stats():
+        stats = ResponseCache.getStore().stats()
+        with ResponseCache.lock:
+            requests = ResponseCache.hits + ResponseCache.misses
+            stats['hits'] = ResponseCache.hits
+            stats['misses'] = ResponseCache.misses
+            stats['hitRatio'] = (float(ResponseCache.hits) / requests) if requests else 0.0
+            stats['compressions'] = ResponseCache.compressions
+        stats['encodings'] = Compression.available()
+        stats['backend'] = getattr(settings, 'RESPONSE_CACHE_BACKEND', 'memory')
+        return stats
+
+    @staticmethod
+    def jsonResponse(content, encoding=None):
+        response = HttpResponse(content, content_type='application/json')
+        if encoding is not None:
+            response['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def compressed(store, key, content, encoding):
+        # Payloads are compressed once per version and encoding, the result is cached next to them
+        compressedKey = '%s.%s' % (key, encoding)
+        compressedContent = store.get(compressedKey)
+        if compressedContent is None:
+            compressedContent = Compression.compress(content, encoding)
+            store.set(compressedKey, compressedContent)
+            with ResponseCache.lock:
+                ResponseCache.compressions += 1
+        return compressedContent
+
+    @staticmethod
+    def cached(*kinds):
+        """
+        Decorator of APIView.get methods returning data of the user, made of objects of the given
+        kinds (see changes.py), including those whose deletion cascades to the returned rows.
+        Only successful JSON responses are cached (the browsable API is always rendered).
+        Payloads of RESPONSE_COMPRESSION_MIN_SIZE bytes or more are compressed as negotiated with Accept-Encoding.
+        """
+        def decorator(get):
+            @functools.wraps(get)
+            def cachedGet(self, request, *args, **kwargs):
+                if (request.accepted_renderer.format != 'json') or ResponseCache.inTransaction():
+                    return get(self, request, *args, **kwargs)
+
+                # The same url is served compressed or not (the view headers are set on the response by DRF)
+                self.headers['Vary'] = ', '.join([value for value in (self.headers.get('Vary'), 'Accept-Encoding') if value])
+
+                store = ResponseCache.getStore()
+                key = ResponseCache.key(request.user.id, request.get_full_path(), Versions.kinds(request, kinds))
+                content = store.get(key)
+                ResponseCache.count(content is not None)
+                if content is None:
+                    response = get(self, request, *args, **kwargs)
+                    if response.status_code != status.HTTP_200_OK:
+                        return response
+                    content = JSONRenderer().render(response.data)
+                    store.set(key, content)
+
+                if len(content) >= Compression.minSize():
+                    encoding = Compression.negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+                    if encoding is not None:
+                        return ResponseCache.jsonResponse(ResponseCache.compressed(store, key, content, encoding), encoding)
+                return ResponseCache.jsonResponse(content)
+            return cachedGet
+        return decorator
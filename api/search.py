@@ -0,0 +1,156 @@
+import re
+import unicodedata
+
+from .models import Recipe, RecipeIngredient, RecipeTerm
+from .utils import Utils
+
+from django.db.models import Q
+from django.utils import six
+
+
+class SearchIndex():
+    """
+    Per-user inverted index of the recipes: term -> (recipe, weight), kept in the RecipeTerm table.
+
+    Terms are the normalized words of the name, category, description and ingredient names of
+    a recipe. The index is updated explicitly wherever these change (indexRecipes, indexIngredient).
+    Queries match whole terms, prefixes and, for words without any match, terms within a small
+    edit distance. Results are ranked by the number of query words matched and then by weight.
+    """
+
+    NAME_WEIGHT = 8
+    CATEGORY_WEIGHT = 4
+    INGREDIENT_WEIGHT = 4
+    DESCRIPTION_WEIGHT = 1
+
+    EXACT_SCORE = 1.0
+    PREFIX_SCORE = 0.6
+    FUZZY_SCORE = 0.4
+
+    MAX_QUERY_WORDS = 8
+    TOKEN = re.compile(r'\w+', re.UNICODE)
+
+    #--- Indexing
+
+    @staticmethod
+    def normalize(text):
+        # Lowercase, without accents
+        text = unicodedata.normalize('NFKD', six.text_type(text or ''))
+        return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+    @staticmethod
+    def tokens(text):
+        # Normalized words, at most as long as RecipeTerm.term
+        return [token[:32] for token in SearchIndex.TOKEN.findall(SearchIndex.normalize(text)) if len(token) > 1 or token.isdigit()]
+
+    @staticmethod
+    def recipeTerms(name, category, description, ingredientNames):
+        terms = {}
+        fields = [(name, SearchIndex.NAME_WEIGHT), (category, SearchIndex.CATEGORY_WEIGHT), (description, SearchIndex.DESCRIPTION_WEIGHT)]
+        fields += [(ingredientName, SearchIndex.INGREDIENT_WEIGHT) for ingredientName in ingredientNames]
+        for text, weight in fields:
+            for token in SearchIndex.tokens(text):
+                terms[token] = terms.get(token, 0) + weight
+        return terms
+
+    @staticmethod
+    def indexRecipes(userId, recipeIds):
+        # (Re)index the given recipes of a user in a constant number of queries
+        recipeIds = list(recipeIds)
+        if not recipeIds:
+            return
+        ingredientNames = {}
+        for recipeId, ingredientName in RecipeIngredient.objects.filter(recipe_id__in=recipeIds).values_list('recipe_id', 'ingredient__name'):
+            ingredientNames.setdefault(recipeId, []).append(ingredientName)
+
+        recipeTerms = []
+        for recipeId, name, category, description in Recipe.objects.filter(id__in=recipeIds, user_id=userId).values_list('id', 'name', 'category', 'description'):
+            terms = SearchIndex.recipeTerms(name, category, description, ingredientNames.get(recipeId, []))
+            recipeTerms.extend(RecipeTerm(term=term, weight=weight, recipe_id=recipeId, user_id=userId) for term, weight in terms.items())
+
+        Utils.bulkDelete(RecipeTerm.objects.filter(recipe_id__in=recipeIds))
+        RecipeTerm.objects.bulk_create(recipeTerms)
+
+    @staticmethod
+    def indexUser(userId):
+        SearchIndex.indexRecipes(userId, Recipe.objects.filter(user_id=userId).values_list('id', flat=True))
+
+    @staticmethod
+    def indexIngredient(ingredient):
+        # The ingredient was renamed, the recipes using it are indexed again
+        recipeIds = set(RecipeIngredient.objects.filter(ingredient_id=ingredient.id).values_list('recipe_id', flat=True))
+        SearchIndex.indexRecipes(ingredient.user_id, recipeIds)
+
+    #--- Searching
+
+    @staticmethod
+    def search(userId, query, offset=0, limit=20):
+        # Returns (number of matching recipes, ids of the recipes in the requested page)
+        words = []
+        for token in SearchIndex.tokens(query):
+            if token not in words:
+                words.append(token)
+        words = words[:SearchIndex.MAX_QUERY_WORDS]
+        if not words:
+            return (0, [])
+
+        terms = RecipeTerm.objects.filter(user_id=userId)
+        matches = {}   # recipeId -> {word: score}
+
+        def addMatches(rows, scoreOf):
+            for recipeId, term, weight in rows:
+                for word in words:
+                    score = scoreOf(word, term)
+                    if score:
+                        recipeMatches = matches.setdefault(recipeId, {})
+                        recipeMatches[word] = max(recipeMatches.get(word, 0), score * weight)
+
+        def prefixScore(word, term):
+            if term == word:
+                return SearchIndex.EXACT_SCORE
+            if term.startswith(word):
+                return SearchIndex.PREFIX_SCORE
+            return 0
+
+        prefixes = Q()
+        for word in words:
+            prefixes |= Q(term__startswith=word)
+        rows = list(terms.filter(prefixes).values_list('recipe_id', 'term', 'weight'))
+        addMatches(rows, prefixScore)
+
+        # Typo tolerance, only for the words without any match
+        matchedWords = set(word for recipeMatches in matches.values() for word in recipeMatches)
+        unmatchedWords = [word for word in words if word not in matchedWords and len(word) > 3]
+        if unmatchedWords:
+            vocabulary = terms.values_list('term', flat=True).distinct()
+            similar = {}
+            for term in vocabulary:
+                for word in unmatchedWords:
+                    if SearchIndex.isSimilar(word, term):
+                        similar.setdefault(term, set()).add(word)
+            if similar:
+                rows = terms.filter(term__in=list(similar)).values_list('recipe_id', 'term', 'weight')
+                addMatches(rows, lambda word, term: SearchIndex.FUZZY_SCORE if word in similar.get(term, ()) else 0)
+
+        ranking = sorted(matches.items(), key=lambda item: (-len(item[1]), -sum(item[1].values()), item[0]))
+        return (len(ranking), [recipeId for recipeId, recipeMatches in ranking[offset:offset + limit]])
+
+    @staticmethod
+    def isSimilar(word, term):
+        # Edit distance (with transpositions) of at most 1, or 2 for long words
+        maxDistance = 2 if len(word) > 7 else 1
+        if abs(len(word) - len(term)) > maxDistance:
+            return False
+        previous2 = None
+        previous = list(range(len(term) + 1))
+        for i in range(1, len(word) + 1):
+            current = [i] + [0] * len(term)
+            for j in range(1, len(term) + 1):
+                cost = 0 if word[i - 1] == term[j - 1] else 1
+                current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+                if i > 1 and j > 1 and word[i - 1] == term[j - 2] and word[i - 2] == term[j - 1]:
+                    current[j] = min(current[j], previous2[j - 2] + 1)
+            if min(current) > maxDistance:
+                return False
+            previous2, previous = previous, current
+        return previous[-1] <= maxDistance
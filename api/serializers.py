@@ -8,12 +8,14 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
     
+    in_shopping_list = serializers.BooleanField(read_only=True)
+
     class Meta:
         model = Recipe
         fields = ('id','name', 'category', 'duration', 'in_shopping_list')
 
 class RecipeIngredientSerializer(serializers.ModelSerializer):
-    ingredient = serializers.ReadOnlyField(source='ingredient.id')
+    ingredient = serializers.ReadOnlyField(source='ingredient_id')
     
     class Meta:
         model = RecipeIngredient
@@ -48,7 +50,7 @@ class FullRecipeSerializer(serializers.ModelSerializer):
 
 class ShoppingItemSerializer(serializers.ModelSerializer):
 
-    ingredient = serializers.ReadOnlyField(source='ingredient.id')
+    ingredient = serializers.ReadOnlyField(source='ingredient_id')
     recipe = RecipeSerializer(read_only=True)
 
     class Meta:
@@ -63,6 +65,62 @@ class ShoppingListSerializer(serializers.ModelSerializer):
         model = ShoppingList
         fields = ('id', 'name', 'date', 'items')
  
+class CompactRecipeIngredientSerializer(serializers.ModelSerializer):
+    ingredient = serializers.ReadOnlyField(source='ingredient_id')
+
+    class Meta:
+        model = RecipeIngredient
+        fields = ('id','ingredient','unit','quantity')
+
+class CompactRecipeSerializer(serializers.ModelSerializer):
+
+    recipe_ingredients = CompactRecipeIngredientSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Recipe
+        fields = ('id','name', 'category', 'duration', 'serves', 'description','recipe_ingredients')
+
+class CompactShoppingItemSerializer(serializers.ModelSerializer):
+
+    ingredient = serializers.ReadOnlyField(source='ingredient_id')
+    recipe = serializers.ReadOnlyField(source='recipe_id')
+
+    class Meta:
+        model = ShoppingItem
+        fields = ('id', 'unit', 'quantity', 'ingredient', 'recipe')
+
+class CompactShoppingListSerializer(serializers.ModelSerializer):
+    """
+    Shopping list whose items only reference recipes and ingredients by id.
+    The referenced recipes and ingredients are listed once, next to the items.
+    Expects the items to be prefetched together with their recipes and recipe ingredients.
+    """
+
+    items = CompactShoppingItemSerializer(many=True, read_only=True)
+    recipes = serializers.SerializerMethodField()
+    ingredients = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ShoppingList
+        fields = ('id', 'name', 'date', 'items', 'recipes', 'ingredients')
+
+    def get_recipes(self, shoppingList):
+        recipes = {}
+        for item in shoppingList.items.all():
+            if item.recipe_id is not None:
+                recipes[item.recipe_id] = item.recipe
+        return CompactRecipeSerializer([recipes[k] for k in sorted(recipes)], many=True).data
+
+    def get_ingredients(self, shoppingList):
+        ingredientIds = set([])
+        for item in shoppingList.items.all():
+            if item.ingredient_id is not None:
+                ingredientIds.add(item.ingredient_id)
+            if item.recipe_id is not None:
+                ingredientIds.update(recipeIngredient.ingredient_id for recipeIngredient in item.recipe.recipe_ingredients.all())
+        ingredients = Ingredient.objects.filter(id__in = ingredientIds).order_by('id').values('id', 'name')
+        return IngredientSerializer(ingredients, many=True).data
+
 class ShopSerializer(serializers.ModelSerializer):
     class Meta:
         model = Shop
@@ -79,7 +137,7 @@ class LocationSerializer(serializers.ModelSerializer):
 
 class LocationField(serializers.RelatedField):
     def to_representation(self, value):        
-        return value.location.id
+        return value.location_id
         
 class IngredientLocationSerializer(serializers.ModelSerializer):
 
@@ -90,6 +148,13 @@ class IngredientLocationSerializer(serializers.ModelSerializer):
         model = Ingredient
         fields = ('id','name','locations')
  
+class IngredientCatalogueSerializer(serializers.Serializer):
+    # Same representation as IngredientLocationSerializer, built from rows with the location ids already grouped
+
+    id = serializers.IntegerField(read_only=True)
+    name = serializers.CharField(read_only=True)
+    locations = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+ 
 class UserProfileSerializer(serializers.ModelSerializer):
 
     user = serializers.ReadOnlyField(source='user.username')
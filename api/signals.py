@@ -0,0 +1,161 @@
+from .models import Recipe, RecipeIngredient, ShoppingItem, ShoppingList, Ingredient, UserProfile, Shop, Location, IngredientLocation
+from .consolidation import ConsolidatedShoppingList
+from .statistics import Statistics
+from .profiles import UserProfiles
+from .authentications import TokenCache, BasicCredentialCache, AccessTokens
+from .autocomplete import IngredientIndex
+from .changes import Changes
+
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from django.contrib.auth.models import User
+
+from rest_framework.authtoken.models import Token
+
+#--- Consolidated shopping lists
+
+@receiver([post_save, post_delete], sender=ShoppingItem)
+def shoppingItemChanged(sender, instance, **kwargs):
+    ConsolidatedShoppingList.invalidate([instance.shoppingList_id])
+
+@receiver(post_save, sender=Recipe)
+def recipeSaved(sender, instance, created, **kwargs):
+    if not created:
+        ConsolidatedShoppingList.invalidateRecipe(instance.id)
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def recipeIngredientChanged(sender, instance, **kwargs):
+    ConsolidatedShoppingList.invalidateRecipe(instance.recipe_id)
+
+#--- Statistics
+# The loaded category/ingredient are remembered (without triggering deferred loads)
+# so that counters can be moved when they change.
+
+@receiver(post_init, sender=Recipe)
+def recipeStatsInit(sender, instance, **kwargs):
+    instance._statsCategory = instance.__dict__.get('category')
+
+@receiver(post_save, sender=Recipe)
+def recipeStatsSaved(sender, instance, created, **kwargs):
+    if created:
+        Statistics.add(instance.user_id, Statistics.TOTAL, 'recipes', 1)
+        Statistics.add(instance.user_id, Statistics.CATEGORY, instance.category, 1)
+    elif (instance._statsCategory is not None) and (instance._statsCategory != instance.category):
+        Statistics.add(instance.user_id, Statistics.CATEGORY, instance._statsCategory, -1)
+        Statistics.add(instance.user_id, Statistics.CATEGORY, instance.category, 1)
+    instance._statsCategory = instance.category
+
+@receiver(post_delete, sender=Recipe)
+def recipeStatsDeleted(sender, instance, **kwargs):
+    Statistics.add(instance.user_id, Statistics.TOTAL, 'recipes', -1)
+    Statistics.add(instance.user_id, Statistics.CATEGORY, instance.category, -1)
+
+@receiver(post_init, sender=RecipeIngredient)
+def recipeIngredientStatsInit(sender, instance, **kwargs):
+    instance._statsIngredientId = instance.__dict__.get('ingredient_id')
+
+@receiver(post_save, sender=RecipeIngredient)
+def recipeIngredientStatsSaved(sender, instance, created, **kwargs):
+    if created:
+        Statistics.addIngredient(instance.ingredient_id, 1)
+    elif (instance._statsIngredientId is not None) and (instance._statsIngredientId != instance.ingredient_id):
+        Statistics.addIngredient(instance._statsIngredientId, -1)
+        Statistics.addIngredient(instance.ingredient_id, 1)
+    instance._statsIngredientId = instance.ingredient_id
+
+@receiver(post_delete, sender=RecipeIngredient)
+def recipeIngredientStatsDeleted(sender, instance, **kwargs):
+    Statistics.addIngredient(instance.ingredient_id, -1)
+
+@receiver(post_save, sender=Ingredient)
+def ingredientStatsSaved(sender, instance, created, **kwargs):
+    if created:
+        Statistics.add(instance.user_id, Statistics.TOTAL, 'ingredients', 1)
+
+@receiver(post_delete, sender=Ingredient)
+def ingredientStatsDeleted(sender, instance, **kwargs):
+    Statistics.add(instance.user_id, Statistics.TOTAL, 'ingredients', -1)
+    Statistics.removeIngredient(instance.id)
+
+@receiver(post_save, sender=ShoppingList)
+def shoppingListStatsSaved(sender, instance, created, **kwargs):
+    if created:
+        Statistics.add(instance.user_id, Statistics.TOTAL, 'shoppingLists', 1)
+
+@receiver(post_delete, sender=ShoppingList)
+def shoppingListStatsDeleted(sender, instance, **kwargs):
+    Statistics.add(instance.user_id, Statistics.TOTAL, 'shoppingLists', -1)
+
+#--- User profiles (the cached profile includes the current shop and shopping list)
+
+@receiver([post_save, post_delete], sender=UserProfile)
+@receiver([post_save, post_delete], sender=Shop)
+@receiver([post_save, post_delete], sender=ShoppingList)
+def userProfileChanged(sender, instance, **kwargs):
+    UserProfiles.invalidate(instance.user_id)
+
+#--- Ingredient autocompletion (deleting a location or shop removes it from the ingredients)
+
+@receiver(post_delete, sender=Location)
+def locationDeleted(sender, instance, **kwargs):
+    IngredientIndex.invalidate(instance.user_id)
+
+#--- Change log (delta synchronization)
+# Changes of the recipe ingredients, ingredient locations and shopping items made in bulk are
+# covered by the save of their recipe, ingredient or shopping list in the same transaction.
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Shop)
+@receiver(post_save, sender=Location)
+@receiver(post_save, sender=ShoppingList)
+def objectChanged(sender, instance, **kwargs):
+    Changes.record(instance.user_id, changeKinds[sender], instance.id)
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Shop)
+@receiver(post_delete, sender=Location)
+@receiver(post_delete, sender=ShoppingList)
+def objectDeleted(sender, instance, **kwargs):
+    Changes.record(instance.user_id, changeKinds[sender], instance.id, deleted=True)
+    if sender in (Shop, ShoppingList):
+        # The profile may refer to it (set to null)
+        Changes.record(instance.user_id, Changes.PROFILE, instance.user_id)
+
+@receiver([post_save, post_delete], sender=ShoppingItem)
+def shoppingItemChangeRecorded(sender, instance, **kwargs):
+    userId = ShoppingList.objects.filter(id=instance.shoppingList_id).values_list('user_id', flat=True).first()
+    if userId is not None:
+        Changes.record(userId, Changes.SHOPPING_LIST, instance.shoppingList_id)
+
+@receiver(pre_delete, sender=Location)
+def locationChangeRecorded(sender, instance, **kwargs):
+    # The location is removed from its ingredients
+    for ingredientId in IngredientLocation.objects.filter(location_id=instance.id).values_list('ingredient_id', flat=True):
+        Changes.record(instance.user_id, Changes.INGREDIENT, ingredientId)
+
+@receiver(post_save, sender=UserProfile)
+def userProfileChangeRecorded(sender, instance, **kwargs):
+    Changes.record(instance.user_id, Changes.PROFILE, instance.user_id)
+
+changeKinds = {
+    Recipe: Changes.RECIPE,
+    Ingredient: Changes.INGREDIENT,
+    Shop: Changes.SHOP,
+    Location: Changes.LOCATION,
+    ShoppingList: Changes.SHOPPING_LIST,
+}
+
+#--- Authentication (cached tokens and credentials carry the user, e.g. its is_active flag)
+
+@receiver(post_save, sender=User)
+def userSaved(sender, instance, created, update_fields=None, **kwargs):
+    if not created and not (update_fields and set(update_fields) == set(['last_login'])):
+        TokenCache.revokeUser(instance)
+        BasicCredentialCache.revoke(instance.username)
+
+@receiver([post_save, post_delete], sender=Token)
+def tokenChanged(sender, instance, **kwargs):
+    # Access tokens are checked against the refresh tokens of the user
+    AccessTokens.revoke(instance.user_id)
@@ -0,0 +1,131 @@
+import io
+import json
+import numbers
+
+from .models import Recipe, RecipeIngredient, Ingredient, UserProfile, ShoppingList, Shop
+from .statistics import Statistics
+from .search import SearchIndex
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
+
+
+class StarterKit():
+    """
+    Starter data of new users (ingredients, recipes, shop and shopping list), read from the
+    STARTER_KIT template. The template is loaded and validated once, at startup (see apps.py),
+    and is materialized for each new user with bulk inserts, so the number of queries does not
+    depend on the size of the template.
+    """
+
+    template = None
+
+    @staticmethod
+    def load(path=None):
+        path = path or getattr(settings, 'STARTER_KIT', None)
+        if path is None:
+            template = {'ingredients': [], 'recipes': [], 'shop': 'My shop', 'shoppingList': ''}
+        else:
+            try:
+                with io.open(path, encoding='utf-8') as templateFile:
+                    template = json.load(templateFile)
+            except (IOError, ValueError) as e:
+                raise ImproperlyConfigured('Cannot read the starter kit %s: %s' % (path, e))
+        StarterKit.validate(template)
+        StarterKit.template = template
+        return template
+
+    @staticmethod
+    def get():
+        if StarterKit.template is None:
+            StarterKit.load()
+        return StarterKit.template
+
+    @staticmethod
+    def validate(template):
+        def check(condition, message):
+            if not condition:
+                raise ImproperlyConfigured('Invalid starter kit: %s' % message)
+
+        def isText(value, maxLength):
+            return isinstance(value, six.string_types) and len(value) <= maxLength
+
+        def isNumber(value):
+            return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+        check(isinstance(template, dict), 'the template has to be an object')
+        ingredients = template.get('ingredients', [])
+        recipes = template.get('recipes', [])
+        check(isinstance(ingredients, list) and isinstance(recipes, list), 'ingredients and recipes have to be lists')
+        check(isText(template.get('shop', ''), 32), 'invalid shop name')
+        check(isText(template.get('shoppingList', ''), 64), 'invalid shopping list name')
+
+        # Names are unique, they identify the rows created in bulk
+        for name in ingredients:
+            check(isText(name, 32) and name != '', 'invalid ingredient name %r' % (name,))
+        check(len(set(ingredients)) == len(ingredients), 'duplicate ingredient names')
+
+        for recipe in recipes:
+            check(isinstance(recipe, dict) and isText(recipe.get('name'), 128), 'invalid recipe %r' % (recipe,))
+            name = recipe['name']
+            check(isText(recipe.get('category', ''), 32), 'invalid category of recipe %s' % name)
+            check(isText(recipe.get('description', ''), 2048), 'invalid description of recipe %s' % name)
+            check(isinstance(recipe.get('duration', 30), int) and isinstance(recipe.get('serves', 2), int),
+                  'invalid duration or serves of recipe %s' % name)
+            check(isinstance(recipe.get('ingredients', []), list), 'invalid ingredients of recipe %s' % name)
+            for recipeIngredient in recipe.get('ingredients', []):
+                check(isinstance(recipeIngredient, dict) and recipeIngredient.get('ingredient') in ingredients,
+                      'unknown ingredient %r in recipe %s' % (recipeIngredient, name))
+                check(isText(recipeIngredient.get('unit', ''), 16) and isNumber(recipeIngredient.get('quantity', 0)),
+                      'invalid unit or quantity in recipe %s' % name)
+        check(len(set(recipe['name'] for recipe in recipes)) == len(recipes), 'duplicate recipe names')
+
+    @staticmethod
+    def create(user):
+        # To be called in the transaction creating the user.
+        # bulk_create does not set the ids (MySQL, SQLite), they are read back by name.
+        template = StarterKit.get()
+        counters = Statistics.empty()
+
+        #--- Ingredients
+        Ingredient.objects.bulk_create([Ingredient(name=name, user=user) for name in template['ingredients']])
+        ingredientIds = dict(Ingredient.objects.filter(user=user).values_list('name', 'id'))
+
+        #--- Recipes and their ingredients
+        Recipe.objects.bulk_create([
+            Recipe(name=recipe['name'], category=recipe.get('category', ''), duration=recipe.get('duration', 30),
+                   serves=recipe.get('serves', 2), description=recipe.get('description', ''), user=user)
+            for recipe in template['recipes']
+        ])
+        recipeIds = dict(Recipe.objects.filter(user=user).values_list('name', 'id'))
+
+        recipeIngredients = []
+        for recipe in template['recipes']:
+            category = recipe.get('category', '')
+            counters[Statistics.CATEGORY][category] = counters[Statistics.CATEGORY].get(category, 0) + 1
+            for recipeIngredient in recipe.get('ingredients', []):
+                ingredientId = ingredientIds[recipeIngredient['ingredient']]
+                recipeIngredients.append(RecipeIngredient(
+                    unit=recipeIngredient.get('unit', ''), quantity=recipeIngredient.get('quantity', 0),
+                    recipe_id=recipeIds[recipe['name']], ingredient_id=ingredientId
+                ))
+                key = six.text_type(ingredientId)
+                counters[Statistics.INGREDIENT][key] = counters[Statistics.INGREDIENT].get(key, 0) + 1
+        RecipeIngredient.objects.bulk_create(recipeIngredients)
+        SearchIndex.indexRecipes(user.id, recipeIds.values())
+
+        #--- Shopping list, shop and profile
+        ShoppingList.objects.bulk_create([ShoppingList(name=template.get('shoppingList', ''), user=user)])
+        Shop.objects.bulk_create([Shop(name=template.get('shop', ''), user=user)])
+        shoppingListId = ShoppingList.objects.filter(user=user).values_list('id', flat=True).get()
+        shopId = Shop.objects.filter(user=user).values_list('id', flat=True).get()
+        UserProfile.objects.bulk_create([UserProfile(user=user, shoppingList_id=shoppingListId, shop_id=shopId)])
+
+        #--- Statistics (the signals maintaining them are not sent by bulk_create)
+        for ingredientId in ingredientIds.values():
+            counters[Statistics.INGREDIENT].setdefault(six.text_type(ingredientId), 0)
+        counters[Statistics.TOTAL]['recipes'] = len(recipeIds)
+        counters[Statistics.TOTAL]['ingredients'] = len(ingredientIds)
+        counters[Statistics.TOTAL]['shoppingLists'] = 1
+        Statistics.store(user.id, counters)
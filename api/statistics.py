@@ -0,0 +1,141 @@
+from .models import Recipe, Ingredient, ShoppingList, UserStatistic
+
+from django.db import transaction, IntegrityError
+from django.utils import six
+from django.db.models import Count, F, Case, When, Value, IntegerField
+
+
+class Statistics():
+    """
+    Per-user statistics, kept as counters in the UserStatistic table.
+
+    The counters are maintained incrementally by the signals in signals.py, so that
+    reading them is a constant number of queries. compute() derives the same counters
+    from the data with aggregate queries (live path) and rebuild() resets the table from it.
+    """
+
+    TOTAL = 'total'
+    CATEGORY = 'category'
+    INGREDIENT = 'ingredient'
+
+    @staticmethod
+    def add(userId, kind, key, delta):
+        key = six.text_type(key)
+        counters = UserStatistic.objects.filter(kind=kind, key=key, user_id=userId)
+        if counters.update(value=F('value') + delta) == 0 and delta > 0:
+            # Missing counters are 0, they only have to be created when incremented
+            try:
+                with transaction.atomic():
+                    UserStatistic.objects.create(kind=kind, key=key, user_id=userId, value=delta)
+            except IntegrityError:
+                counters.update(value=F('value') + delta)
+
+    @staticmethod
+    def addIngredient(ingredientId, delta):
+        # Ingredient ids are unique, the user is only needed to create a missing counter
+        key = six.text_type(ingredientId)
+        counters = UserStatistic.objects.filter(kind=Statistics.INGREDIENT, key=key)
+        if counters.update(value=F('value') + delta) == 0 and delta > 0:
+            userId = Ingredient.objects.filter(id=ingredientId).values_list('user_id', flat=True).first()
+            if userId is not None:
+                Statistics.add(userId, Statistics.INGREDIENT, key, delta)
+
+    @staticmethod
+    def addIngredients(userId, deltas):
+        # Apply {ingredientId: delta} for ingredients of the same user in a constant number of queries
+        deltas = dict((six.text_type(ingredientId), delta) for ingredientId, delta in deltas.items() if delta != 0)
+        if not deltas:
+            return
+        counters = UserStatistic.objects.filter(kind=Statistics.INGREDIENT, key__in=list(deltas))
+        existing = set(counters.values_list('key', flat=True))
+        if existing:
+            counters.update(value=F('value') + Case(
+                *[When(key=key, then=Value(deltas[key])) for key in existing],
+                default=Value(0), output_field=IntegerField()
+            ))
+        missing = [key for key in deltas if (key not in existing) and (deltas[key] > 0)]
+        try:
+            with transaction.atomic():
+                UserStatistic.objects.bulk_create([
+                    UserStatistic(kind=Statistics.INGREDIENT, key=key, value=deltas[key], user_id=userId) for key in missing
+                ])
+        except IntegrityError:
+            for key in missing:
+                Statistics.add(userId, Statistics.INGREDIENT, key, deltas[key])
+
+    @staticmethod
+    def removeIngredient(ingredientId):
+        UserStatistic.objects.filter(kind=Statistics.INGREDIENT, key=six.text_type(ingredientId)).delete()
+
+    @staticmethod
+    def read(userId):
+        counters = Statistics.empty()
+        rows = UserStatistic.objects.filter(user_id=userId).values_list('kind', 'key', 'value')
+        for kind, key, value in rows:
+            counters[kind][key] = value
+        if not counters[Statistics.TOTAL]:
+            # Counters are missing for this user, initialize them from the data
+            counters = Statistics.rebuild(userId)
+        return counters
+
+    @staticmethod
+    def compute(userId):
+        counters = Statistics.empty()
+
+        categories = Recipe.objects.filter(user_id=userId).values('category').annotate(recipes=Count('id')).order_by()
+        for row in categories:
+            counters[Statistics.CATEGORY][row['category']] = row['recipes']
+
+        ingredients = Ingredient.objects.filter(user_id=userId).annotate(recipes=Count('recipe_ingredients')).values_list('id', 'recipes')
+        for ingredientId, recipes in ingredients:
+            counters[Statistics.INGREDIENT][six.text_type(ingredientId)] = recipes
+
+        counters[Statistics.TOTAL]['recipes'] = sum(counters[Statistics.CATEGORY].values())
+        counters[Statistics.TOTAL]['ingredients'] = len(counters[Statistics.INGREDIENT])
+        counters[Statistics.TOTAL]['shoppingLists'] = ShoppingList.objects.filter(user_id=userId).count()
+        return counters
+
+    @staticmethod
+    def rebuild(userId):
+        counters = Statistics.compute(userId)
+        with transaction.atomic():
+            UserStatistic.objects.filter(user_id=userId).delete()
+            Statistics.store(userId, counters)
+        return counters
+
+    @staticmethod
+    def store(userId, counters):
+        # Insert the counters of a user that has none
+        UserStatistic.objects.bulk_create([
+            UserStatistic(kind=kind, key=six.text_type(key), value=value, user_id=userId)
+            for kind in counters for key, value in counters[kind].items()
+        ])
+
+    @staticmethod
+    def empty():
+        return {Statistics.TOTAL: {}, Statistics.CATEGORY: {}, Statistics.INGREDIENT: {}}
+
+    @staticmethod
+    def format(userId, counters):
+        #--- Recipes (recipes without category are counted as 'other')
+        categories = {}
+        for category, recipes in counters[Statistics.CATEGORY].items():
+            if (category == ''):
+                category = 'other'
+            categories[category] = categories.get(category, 0) + recipes
+        statsRecipes = [{'category': k, 'recipes': v} for k, v in categories.items() if v > 0]
+
+        #--- Ingredients
+        _stats = {}
+        ingredients = Ingredient.objects.filter(user_id=userId).values_list('id', 'name')
+        for ingredientId, name in ingredients:
+            _stats[name] = counters[Statistics.INGREDIENT].get(six.text_type(ingredientId), 0)
+        statsIngredients = [{'ingredient': k, 'recipes': v} for k, v in _stats.items()]
+
+        stats = {}
+        stats['recipes'] = statsRecipes
+        stats['recipe_number'] = counters[Statistics.TOTAL].get('recipes', 0)
+        stats['shoppingList_number'] = counters[Statistics.TOTAL].get('shoppingLists', 0)
+        stats['ingredients'] = statsIngredients
+        stats['ingredient_number'] = counters[Statistics.TOTAL].get('ingredients', 0)
+        return stats
@@ -0,0 +1,102 @@
+from .models import Recipe, RecipeIngredient, Ingredient, IngredientLocation, Shop, Location, ShoppingList, ShoppingItem, UserProfile
+from .changes import Changes
+
+
+class Sync():
+    """
+    Delta synchronization: the objects of a user changed or deleted since a cursor.
+
+    The cursor is the user's last change number (see changes.py), 0 before the first change.
+    Without a cursor, with an unknown one or with one older than the pruned deletions, all the
+    objects are returned (full resync). Each kind of object is read with one or two
+    queries, whatever the number of changes; rows are built from values(), without model instances.
+    """
+
+    KINDS = [
+        (Changes.RECIPE, 'recipes'),
+        (Changes.INGREDIENT, 'ingredients'),
+        (Changes.SHOP, 'shops'),
+        (Changes.LOCATION, 'locations'),
+        (Changes.SHOPPING_LIST, 'shoppingLists'),
+    ]
+
+    @staticmethod
+    def delta(userId, since=None):
+        cursor, pruned = Changes.state(userId)
+        full = (since is None) or (since < pruned) or (since > cursor)
+
+        if full:
+            changes = dict((kind, (None, [])) for kind, name in Sync.KINDS)
+            changes[Changes.PROFILE] = (None, [])
+        else:
+            changes = Changes.since(userId, since, cursor)
+
+        delta = {'cursor': cursor, 'full': full, 'deleted': {}}
+        loaders = {
+            Changes.RECIPE: Sync.recipes,
+            Changes.INGREDIENT: Sync.ingredients,
+            Changes.SHOP: Sync.shops,
+            Changes.LOCATION: Sync.locations,
+            Changes.SHOPPING_LIST: Sync.shoppingLists,
+        }
+        for kind, name in Sync.KINDS:
+            changedIds, deletedIds = changes.get(kind, ([], []))
+            # None stands for all the objects of the user
+            delta[name] = loaders[kind](userId, changedIds) if (changedIds is None or changedIds) else []
+            delta['deleted'][name] = deletedIds
+        if Changes.PROFILE in changes:
+            delta['profile'] = UserProfile.objects.filter(user_id=userId).values('shop', 'shoppingList').first()
+        return delta
+
+    @staticmethod
+    def filter(queryset, userId, ids):
+        queryset = queryset.filter(user_id=userId)
+        return queryset if ids is None else queryset.filter(id__in=ids)
+
+    @staticmethod
+    def groupBy(rows, key):
+        groups = {}
+        for row in rows:
+            groups.setdefault(row.pop(key), []).append(row)
+        return groups
+
+    @staticmethod
+    def recipes(userId, ids):
+        recipes = list(Sync.filter(Recipe.objects, userId, ids).order_by('id').values(
+            'id', 'name', 'category', 'duration', 'serves', 'description', 'image'))
+        recipeIngredients = RecipeIngredient.objects.filter(recipe_id__in=[recipe['id'] for recipe in recipes]) if ids is not None \
+            else RecipeIngredient.objects.filter(recipe__user_id=userId)
+        recipeIngredients = Sync.groupBy(recipeIngredients.order_by('id').values('id', 'recipe_id', 'ingredient', 'unit', 'quantity'), 'recipe_id')
+        for recipe in recipes:
+            recipe['recipe_ingredients'] = recipeIngredients.get(recipe['id'], [])
+        return recipes
+
+    @staticmethod
+    def ingredients(userId, ids):
+        ingredients = list(Sync.filter(Ingredient.objects, userId, ids).order_by('id').values('id', 'name'))
+        ingredientLocations = IngredientLocation.objects.filter(ingredient_id__in=[ingredient['id'] for ingredient in ingredients]) if ids is not None \
+            else IngredientLocation.objects.filter(ingredient__user_id=userId)
+        locationIds = {}
+        for ingredientId, locationId in ingredientLocations.values_list('ingredient_id', 'location_id'):
+            locationIds.setdefault(ingredientId, []).append(locationId)
+        for ingredient in ingredients:
+            ingredient['locations'] = locationIds.get(ingredient['id'], [])
+        return ingredients
+
+    @staticmethod
+    def shops(userId, ids):
+        return list(Sync.filter(Shop.objects, userId, ids).order_by('id').values('id', 'name'))
+
+    @staticmethod
+    def locations(userId, ids):
+        return list(Sync.filter(Location.objects, userId, ids).order_by('id').values('id', 'name', 'shop'))
+
+    @staticmethod
+    def shoppingLists(userId, ids):
+        shoppingLists = list(Sync.filter(ShoppingList.objects, userId, ids).order_by('id').values('id', 'name', 'date'))
+        items = ShoppingItem.objects.filter(shoppingList_id__in=[shoppingList['id'] for shoppingList in shoppingLists]) if ids is not None \
+            else ShoppingItem.objects.filter(shoppingList__user_id=userId)
+        items = Sync.groupBy(items.order_by('id').values('id', 'shoppingList_id', 'unit', 'quantity', 'ingredient', 'recipe'), 'shoppingList_id')
+        for shoppingList in shoppingLists:
+            shoppingList['items'] = items.get(shoppingList['id'], [])
+        return shoppingLists
@@ -1,3 +1,1825 @@
-from django.test import TestCase
+from .models import Recipe, RecipeIngredient, Ingredient, ShoppingList, ShoppingItem, UserProfile, Shop, Location, IngredientLocation, UserStatistic, OutgoingEmail, UserDeletion, Change, UserImage
+from .utils import Utils
+from .images import imageStore, Image
+from .authentications import TokenCache, BasicCredentialCache
+from .pantry import PantryIndex
+from .autocomplete import IngredientIndex
+from .responses import ResponseCache
+from .caches import SharedCache
+from .compression import Compression
+from .collection import CollectionImport
+from .outbox import Outbox, OutboxWorker
+from .deletion import DeletionWorker
+from .starterkit import StarterKit
+from .changes import Changes
+from .statistics import Statistics
 
-# Create your tests here.
+import io
+import os
+import json
+import zlib
+import smtplib
+import base64
+import shutil
+import tempfile
+from datetime import date, timedelta
+from importlib import import_module
+from unittest import skipIf
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.utils import timezone
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+
+def recipeData(name, recipeIngredients=(), **fields):
+    # Body of RecipeEp.post for a new recipe, recipe ingredients given as (ingredient id, unit, quantity)
+    recipe = {'id': '_', 'name': name, 'category': 'c', 'description': '', 'serves': 2, 'duration': 10,
+              'recipe_ingredients': [{'id': '_%d' % i, 'ingredient': ingredientId, 'unit': unit, 'quantity': quantity}
+                                     for i, (ingredientId, unit, quantity) in enumerate(recipeIngredients)]}
+    recipe.update(fields)
+    return recipe
+
+
+class ApiTestMixin(object):
+    """
+    Users with their starter data and API clients authenticated as them.
+    The caches of the process are emptied before each test: the ids of the rows of a test
+    are reused by the next one.
+    """
+
+    def setUp(self):
+        cache.clear()
+        for local in (PantryIndex.local, IngredientIndex.local, TokenCache.local, BasicCredentialCache.local, BasicCredentialCache.failures):
+            local.clear()
+        ResponseCache.store = None
+
+    def createUser(self, username):
+        return Utils.createUser(username, username + '@example.com', 'secret-' + username)
+
+    def createClient(self, username):
+        user = self.createUser(username)
+        client = APIClient()
+        client.force_authenticate(user)
+        return user, client
+
+    def login(self, username, **data):
+        # Response of a login with the password of createUser, by a client without session
+        data.update({'username': username, 'password': 'secret-' + username})
+        return APIClient().post('/api/auth/login', data, format='json')
+
+    def authorizedClient(self, authorization):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=authorization)
+        return client
+
+    def content(self, response):
+        # Data of a response, also of the responses rendered by the response cache (see responses.py)
+        return json.loads(response.content.decode('utf-8'))
+
+    def countQueries(self, call):
+        with CaptureQueriesContext(connection) as queries:
+            response = call()
+        return len(queries.captured_queries), response
+
+    def inOtherProcess(self, localCache, call):
+        # Runs call as another process would: the local cache of this process keeps its entries
+        entries = [(key, entry[1]) for key, entry in localCache.entries.items()]
+        response = call()
+        for key, value in entries:
+            localCache.set(key, value)
+        return response
+
+
+class ApiTestCase(ApiTestMixin, TestCase):
+    pass
+
+
+class ApiTransactionTestCase(ApiTestMixin, TransactionTestCase):
+    # For the caches invalidated on commit (transaction.on_commit never runs in a TestCase)
+    pass
+
+#---------------------------------------------------------------------------------------- Recipes
+
+class RecipeListTests(ApiTestCase):
+
+    def setUp(self):
+        super(RecipeListTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+
+    def test_marks_recipes_in_current_shopping_list(self):
+        recipes = [Recipe.objects.create(name='r%d' % i, category='c', description='', user=self.user) for i in range(3)]
+        shoppingList = self.user.profile.shoppingList
+        ShoppingItem.objects.create(recipe=recipes[1], shoppingList=shoppingList, unit='serve', quantity=2)
+        # Items of other shopping lists do not count
+        ShoppingItem.objects.create(recipe=recipes[2], shoppingList=ShoppingList.objects.create(name='old', user=self.user), unit='serve', quantity=2)
+
+        response = self.client.get('/api/recipes')
+
+        self.assertEqual(response.status_code, 200)
+        marks = dict((recipe['id'], recipe['in_shopping_list']) for recipe in response.data)
+        self.assertEqual(marks[recipes[0].id], False)
+        self.assertEqual(marks[recipes[1].id], True)
+        self.assertEqual(marks[recipes[2].id], False)
+
+    def test_number_of_queries_does_not_depend_on_the_recipes(self):
+        few, response = self.countQueries(lambda: self.client.get('/api/recipes'))
+        self.assertEqual(len(response.data), 1)
+
+        shoppingList = self.user.profile.shoppingList
+        for i in range(20):
+            recipe = Recipe.objects.create(name='r%d' % i, category='c', description='', user=self.user)
+            ShoppingItem.objects.create(recipe=recipe, shoppingList=shoppingList, unit='serve', quantity=1)
+
+        many, response = self.countQueries(lambda: self.client.get('/api/recipes'))
+        self.assertEqual(len(response.data), 21)
+        self.assertEqual(many, few)
+
+    def test_lists_only_own_recipes(self):
+        otherUser, otherClient = self.createClient('other')
+        Recipe.objects.create(name='theirs', category='c', description='', user=otherUser)
+
+        names = [recipe['name'] for recipe in self.client.get('/api/recipes').data]
+
+        self.assertEqual(names, ['cappuccino'])
+
+class RecipeImageTests(ApiTestCase):
+
+    IMAGE = b'\x89PNG\r\n\x1a\n' + b'not really an image'
+
+    def setUp(self):
+        super(RecipeImageTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.storeRoot = imageStore.root
+        imageStore.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(imageStore.root)
+        imageStore.root = self.storeRoot
+
+    def postRecipe(self, client, image):
+        return client.post('/api/recipe/_', recipeData('soup', image=image), format='json')
+
+    def test_recipe_references_stored_image(self):
+        response = self.postRecipe(self.client, base64.b64encode(self.IMAGE).decode('ascii'))
+
+        self.assertEqual(response.status_code, 201)
+        imageId = response.data['image']
+        self.assertTrue(imageStore.isImageId(imageId))
+        self.assertEqual(Recipe.objects.get(pk=response.data['id']).image, imageId)
+
+        image = self.client.get('/api/image/%s' % imageId)
+        self.assertEqual(image.status_code, 200)
+        self.assertEqual(image.content, self.IMAGE)
+        self.assertEqual(image['Content-Type'], 'image/png')
+
+    def test_identical_images_are_stored_once(self):
+        encoded = 'data:image/png;base64,' + base64.b64encode(self.IMAGE).decode('ascii')
+        first = self.postRecipe(self.client, encoded).data['image']
+        second = self.client.post('/api/image/_', {'image': encoded}, format='json')
+
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data, first)
+
+    def test_conditional_and_range_requests(self):
+        imageId = self.client.post('/api/image/_', {'image': base64.b64encode(self.IMAGE).decode('ascii')}, format='json').data
+        etag = self.client.get('/api/image/%s' % imageId)['ETag']
+
+        self.assertEqual(self.client.get('/api/image/%s' % imageId, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        part = self.client.get('/api/image/%s' % imageId, HTTP_RANGE='bytes=0-3')
+        self.assertEqual(part.status_code, 206)
+        self.assertEqual(part.content, self.IMAGE[0:4])
+        self.assertEqual(part['Content-Range'], 'bytes 0-3/%d' % len(self.IMAGE))
+
+    def test_images_of_other_users_cannot_be_read_or_referenced(self):
+        imageId = self.client.post('/api/image/_', {'image': base64.b64encode(self.IMAGE).decode('ascii')}, format='json').data
+        otherUser, otherClient = self.createClient('other')
+
+        self.assertEqual(otherClient.get('/api/image/%s' % imageId).status_code, 404)
+        self.assertEqual(self.postRecipe(otherClient, imageId).status_code, 400)
+
+    def test_invalid_image_data_is_rejected(self):
+        response = self.postRecipe(self.client, '!!not base64')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Recipe.objects.filter(name='soup').count(), 0)
+
+    def test_images_of_rejected_recipes_are_not_stored(self):
+        encoded = base64.b64encode(self.IMAGE).decode('ascii')
+        recipe = Recipe.objects.get(user=self.user, name='cappuccino')
+        data = dict(self.client.get('/api/recipe/%d' % recipe.id).data, image=encoded)
+
+        self.assertEqual(self.client.post('/api/recipe/_', recipeData('soup', [(0, 'g', 1)], image=encoded), format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/recipe/%d' % recipe.id, data, format='json', HTTP_IF_MATCH='"stale"').status_code, 412)
+
+        self.assertFalse(UserImage.objects.filter(user=self.user).exists())
+        self.assertEqual(os.listdir(imageStore.root), [])
+
+    def migrateImages(self, *images):
+        # Recipes with inline images, moved to the store by the migration
+        migration = import_module('api.migrations.0011_recipe_image_store')
+        recipes = [Recipe.objects.create(name='r%d' % i, user=self.user, category='c', serves=1, image=image) for i, image in enumerate(images)]
+        with override_settings(IMAGE_STORE_ROOT=imageStore.root):
+            migration.moveImagesToStore(apps, None)
+        return [Recipe.objects.get(pk=recipe.pk).image for recipe in recipes]
+
+    def test_migration_moves_large_and_loosely_encoded_images(self):
+        large = self.IMAGE + b'x' * imageStore.maxSize
+        wrapped = base64.encodestring(self.IMAGE + b'1').decode('ascii')
+        unpadded = base64.b64encode(self.IMAGE + b'12').decode('ascii').rstrip('=')
+
+        imageIds = self.migrateImages(base64.b64encode(large).decode('ascii'), wrapped, unpadded, '')
+
+        self.assertEqual([imageStore.get(imageId) for imageId in imageIds[:3]], [large, self.IMAGE + b'1', self.IMAGE + b'12'])
+        self.assertEqual(imageIds[3], None)
+
+    def test_migration_stops_on_undecodable_images(self):
+        encoded = base64.b64encode(self.IMAGE).decode('ascii')
+
+        with self.assertRaises(RuntimeError):
+            self.migrateImages(encoded, 'data:image/png;base64,!!not base64')
+
+        self.assertEqual(sorted(Recipe.objects.filter(name__in=['r0', 'r1']).values_list('image', flat=True)), ['data:image/png;base64,!!not base64', encoded])
+
+    @skipIf(Image is None, 'Pillow is not installed')
+    def test_thumbnails_are_served_for_smaller_sizes(self):
+        output = io.BytesIO()
+        Image.new('RGB', (800, 600), (200, 10, 10)).save(output, 'JPEG')
+        imageId = self.client.post('/api/image/_', {'image': base64.b64encode(output.getvalue()).decode('ascii')}, format='json').data
+
+        thumbnail = self.client.get('/api/image/%s/100' % imageId)
+
+        self.assertEqual(thumbnail.status_code, 200)
+        self.assertEqual(Image.open(io.BytesIO(thumbnail.content)).size, (128, 96))
+        self.assertEqual(self.client.get('/api/image/%s' % imageId).content, output.getvalue())
+
+class RecipeSaveTests(ApiTestCase):
+
+    def setUp(self):
+        super(RecipeSaveTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+
+    def createIngredients(self, count):
+        return [Ingredient.objects.create(name='i%d' % i, user=self.user).id for i in range(count)]
+
+    def saveAndUpdate(self, ingredientCount):
+        # Queries of the creation and of an update changing, removing and adding recipe ingredients
+        ingredientIds = self.createIngredients(ingredientCount + 1)
+        created, response = self.countQueries(lambda: self.client.post('/api/recipe/_', recipeData('r', [(ingredientId, 'g', 1) for ingredientId in ingredientIds[:-1]]), format='json'))
+        self.assertEqual(response.status_code, 201)
+
+        recipe = response.data
+        recipe['recipe_ingredients'] = [dict(recipeIngredient, quantity=2) for recipeIngredient in recipe['recipe_ingredients'][1:]]
+        recipe['recipe_ingredients'].append({'id': '_new', 'ingredient': ingredientIds[-1], 'unit': 'kg', 'quantity': 3})
+        updated, response = self.countQueries(lambda: self.client.post('/api/recipe/%d' % recipe['id'], recipe, format='json'))
+        self.assertEqual(response.status_code, 201)
+
+        recipeIngredients = RecipeIngredient.objects.filter(recipe_id=recipe['id'])
+        self.assertEqual(sorted(recipeIngredients.values_list('ingredient_id', flat=True)), ingredientIds[1:])
+        self.assertEqual(set(recipeIngredients.exclude(ingredient_id=ingredientIds[-1]).values_list('quantity', flat=True)), set([2]))
+        return created, updated
+
+    def test_number_of_queries_does_not_depend_on_the_ingredients(self):
+        # The first save also loads the profile and creates the counters of the category
+        self.saveAndUpdate(2)
+        self.assertEqual(self.saveAndUpdate(3), self.saveAndUpdate(20))
+
+    def test_ingredients_of_other_users_are_rejected(self):
+        otherUser, otherClient = self.createClient('other')
+        theirs = Ingredient.objects.get(user=otherUser, name='milk')
+        recipe = Recipe.objects.get(user=self.user, name='cappuccino')
+        data = self.client.get('/api/recipe/%d' % recipe.id).data
+        data['name'] = 'changed'
+        data['recipe_ingredients'] = [dict(recipeIngredient) for recipeIngredient in data['recipe_ingredients']]
+        data['recipe_ingredients'][0]['ingredient'] = theirs.id
+
+        response = self.client.post('/api/recipe/%d' % recipe.id, data, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Recipe.objects.get(pk=recipe.id).name, 'cappuccino')
+        self.assertFalse(RecipeIngredient.objects.filter(recipe=recipe, ingredient=theirs).exists())
+
+    def test_unknown_recipe_ingredients_are_rejected_before_writing(self):
+        milk = Ingredient.objects.get(user=self.user, name='milk')
+        data = recipeData('new', [(milk.id, 'ml', 1)])
+        data['recipe_ingredients'][0]['id'] = 12345
+
+        response = self.client.post('/api/recipe/_', data, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Recipe.objects.filter(name='new').exists())
+
+    def test_recipes_of_other_users_cannot_be_changed(self):
+        otherUser, otherClient = self.createClient('other')
+        recipe = Recipe.objects.get(user=self.user, name='cappuccino')
+        data = self.client.get('/api/recipe/%d' % recipe.id).data
+        data['recipe_ingredients'] = []
+
+        self.assertEqual(otherClient.post('/api/recipe/%d' % recipe.id, data, format='json').status_code, 403)
+        self.assertEqual(RecipeIngredient.objects.filter(recipe=recipe).count(), 3)
+
+class RecipeSearchTests(ApiTestCase):
+
+    def setUp(self):
+        super(RecipeSearchTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.milk = Ingredient.objects.get(user=self.user, name='milk')
+
+    def createRecipe(self, name, description='', category='c', ingredientIds=()):
+        response = self.client.post('/api/recipe/_', recipeData(name, [(ingredientId, 'g', 1) for ingredientId in ingredientIds],
+                                                                description=description, category=category), format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def search(self, query, client=None):
+        response = (client or self.client).get('/api/recipes/search', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def test_recipes_are_ranked_by_matched_words_and_fields(self):
+        self.createRecipe('tomato soup', description='with basil')
+        self.createRecipe('basil pesto')
+        self.createRecipe('bread', description='serve with a tomato soup')
+
+        self.assertEqual(self.search('tomato soup'), ['tomato soup', 'bread'])
+        self.assertEqual(self.search('basil'), ['basil pesto', 'tomato soup'])
+
+    def test_prefixes_accents_and_typos_match(self):
+        self.createRecipe(u'cr\xe8me br\xfbl\xe9e')
+
+        self.assertEqual(self.search('creme'), [u'cr\xe8me br\xfbl\xe9e'])
+        self.assertEqual(self.search('brul'), [u'cr\xe8me br\xfbl\xe9e'])
+        self.assertEqual(self.search('capucino'), ['cappuccino'])
+        self.assertEqual(self.search('unknown'), [])
+
+    def test_index_follows_recipe_and_ingredient_changes(self):
+        recipeId = self.createRecipe('porridge', ingredientIds=[self.milk.id])
+        self.assertEqual(sorted(self.search('milk')), ['cappuccino', 'porridge'])
+
+        recipe = self.client.get('/api/recipe/%d' % recipeId).data
+        recipe['name'] = 'oatmeal'
+        self.client.post('/api/recipe/%d' % recipeId, recipe, format='json')
+        self.client.post('/api/ingredient/%d' % self.milk.id, {'id': self.milk.id, 'name': 'cream', 'locations': []}, format='json')
+
+        self.assertEqual(self.search('porridge'), [])
+        self.assertEqual(self.search('oatmeal'), ['oatmeal'])
+        # Still in the description of the cappuccino
+        self.assertEqual(self.search('milk'), ['cappuccino'])
+        self.assertEqual(sorted(self.search('cream')), ['cappuccino', 'oatmeal'])
+
+    def test_results_are_paged_and_private(self):
+        for i in range(5):
+            self.createRecipe('pancake %d' % i)
+        otherUser, otherClient = self.createClient('other')
+
+        response = self.client.get('/api/recipes/search', {'q': 'pancake', 'offset': 3, 'limit': 10})
+
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(self.search('pancake', otherClient), [])
+        self.assertEqual(self.client.get('/api/recipes/search', {'q': 'pancake', 'limit': 'x'}).status_code, 400)
+
+class CookableRecipesTests(ApiTransactionTestCase):
+
+    def setUp(self):
+        super(CookableRecipesTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.ingredients = dict((ingredient.name, ingredient.id) for ingredient in Ingredient.objects.filter(user=self.user))
+        self.tea = self.client.post('/api/recipe/_', recipeData('tea', [(self.ingredients['milk'], 'ml', 10), (self.ingredients['sugar'], 'tl', 1)]), format='json').data
+
+    def cook(self, *names):
+        response = self.client.get('/api/recipes/cook', {'ingredients': ','.join(str(self.ingredients[name]) for name in names)})
+        self.assertEqual(response.status_code, 200)
+        return [(recipe['name'], recipe['covered'], recipe['total']) for recipe in response.data]
+
+    def test_recipes_are_ranked_by_coverage(self):
+        self.assertEqual(self.cook('milk', 'sugar'), [('tea', 2, 2), ('cappuccino', 2, 3)])
+        self.assertEqual(self.cook('coffee'), [('cappuccino', 1, 3)])
+        self.assertEqual(self.cook(), [])
+
+        cappuccino = self.client.get('/api/recipes/cook', {'ingredients': self.ingredients['coffee']}).data[0]
+        self.assertEqual(sorted(cappuccino['missing']), sorted([self.ingredients['milk'], self.ingredients['sugar']]))
+        self.assertEqual(self.client.get('/api/recipes/cook', {'ingredients': 'x'}).status_code, 400)
+
+    def test_index_is_updated_in_place_of_the_old_one(self):
+        self.cook('milk')
+        oldIndex = PantryIndex.local.get(self.user.id)
+
+        self.tea['recipe_ingredients'] = [dict(recipeIngredient) for recipeIngredient in self.tea['recipe_ingredients']
+                                          if recipeIngredient['ingredient'] == self.ingredients['sugar']]
+        self.client.post('/api/recipe/%d' % self.tea['id'], self.tea, format='json')
+
+        self.assertEqual(self.cook('milk'), [('cappuccino', 1, 3)])
+        self.assertEqual(self.cook('sugar'), [('tea', 1, 1), ('cappuccino', 1, 3)])
+        # Readers of the old index are not affected
+        self.assertEqual(len(oldIndex.cook([self.ingredients['milk']])), 2)
+        self.assertEqual(PantryIndex.local.get(self.user.id).version, oldIndex.version + 1)
+
+    def test_other_processes_rebuild_their_index(self):
+        self.cook('milk')
+        otherProcessIndex = PantryIndex.local.get(self.user.id)
+
+        self.client.delete('/api/recipe/%d' % self.tea['id'])
+        PantryIndex.local.set(self.user.id, otherProcessIndex)
+
+        self.assertEqual(self.cook('milk', 'sugar'), [('cappuccino', 2, 3)])
+
+#---------------------------------------------------------------------------------------- Ingredients
+
+class IngredientLocationTests(ApiTestCase):
+
+    def setUp(self):
+        super(IngredientLocationTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.shop = Shop.objects.get(user=self.user)
+        self.locations = [Location.objects.create(name='l%d' % i, shop=self.shop, user=self.user).id for i in range(30)]
+        self.milk = Ingredient.objects.get(user=self.user, name='milk')
+
+    def post(self, locationIds, client=None):
+        return (client or self.client).post('/api/ingredient/%d' % self.milk.id, {'id': self.milk.id, 'name': 'milk', 'locations': locationIds}, format='json')
+
+    def locationIds(self):
+        return sorted(IngredientLocation.objects.filter(ingredient=self.milk).values_list('location_id', flat=True))
+
+    def test_locations_are_added_and_removed(self):
+        self.post(self.locations[0:3])
+
+        response = self.post([self.locations[1], self.locations[4]])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(response.data['locations']), [self.locations[1], self.locations[4]])
+        self.assertEqual(self.locationIds(), [self.locations[1], self.locations[4]])
+
+    def test_number_of_queries_does_not_depend_on_the_locations(self):
+        self.post([])
+        few, response = self.countQueries(lambda: self.post(self.locations[0:2]))
+        self.post([])
+        many, response = self.countQueries(lambda: self.post(self.locations))
+        self.assertEqual(len(self.locationIds()), 30)
+        self.assertEqual(many, few)
+
+        few, response = self.countQueries(lambda: self.post(self.locations[28:]))
+        self.post(self.locations)
+        many, response = self.countQueries(lambda: self.post(self.locations[:2]))
+        self.assertEqual(self.locationIds(), self.locations[:2])
+        self.assertEqual(many, few)
+
+    def test_locations_of_other_users_are_rejected(self):
+        otherUser, otherClient = self.createClient('other')
+        theirs = Location.objects.create(name='theirs', shop=Shop.objects.get(user=otherUser), user=otherUser)
+        self.post(self.locations[0:1])
+
+        response = self.post([self.locations[1], theirs.id])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.locationIds(), self.locations[0:1])
+        self.assertEqual(self.post(['x']).status_code, 400)
+
+class IngredientListTests(ApiTestCase):
+
+    def setUp(self):
+        super(IngredientListTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.shop = Shop.objects.get(user=self.user)
+
+    def addIngredients(self, count):
+        locations = [Location.objects.create(name='l%d' % i, shop=self.shop, user=self.user) for i in range(2)]
+        for i in range(count):
+            ingredient = Ingredient.objects.create(name='i%d' % i, user=self.user)
+            for location in locations[0:i % 3]:
+                IngredientLocation.objects.create(ingredient=ingredient, location=location)
+
+    def test_same_representation_as_single_ingredients(self):
+        self.addIngredients(5)
+
+        ingredients = self.content(self.client.get('/api/ingredients'))
+
+        self.assertEqual(len(ingredients), 8)
+        for ingredient in ingredients:
+            self.assertEqual(ingredient, self.content(self.client.get('/api/ingredient/%d' % ingredient['id'])))
+
+    def test_number_of_queries_does_not_depend_on_the_ingredients(self):
+        self.addIngredients(2)
+        few, response = self.countQueries(lambda: self.client.get('/api/ingredients'))
+        self.addIngredients(30)
+        many, response = self.countQueries(lambda: self.client.get('/api/ingredients'))
+
+        self.assertEqual(len(self.content(response)), 35)
+        self.assertEqual(many, few)
+
+class IngredientCompletionTests(ApiTransactionTestCase):
+
+    def setUp(self):
+        super(IngredientCompletionTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        for name in ('oat milk', 'mint', 'minced meat'):
+            self.client.put('/api/ingredientbyname/%s' % name)
+
+    def complete(self, prefix, limit=10):
+        response = self.client.get('/api/ingredients/complete', {'q': prefix, 'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_names_and_words_matching_the_prefix(self):
+        self.assertEqual(self.complete('mi'), ['milk', 'mint', 'minced meat', 'oat milk'])
+        self.assertEqual(self.complete('MI', limit=2), ['milk', 'mint'])
+        self.assertEqual(self.complete('me'), ['minced meat'])
+        self.assertEqual(self.complete(''), [])
+
+    def test_names_within_one_typo(self):
+        self.assertEqual(self.complete('suagr'), ['sugar'])
+        self.assertEqual(self.complete('cofe'), ['coffee'])
+
+    def test_index_follows_ingredient_and_location_changes(self):
+        milk = Ingredient.objects.get(user=self.user, name='milk')
+        location = Location.objects.create(name='fridge', shop=Shop.objects.get(user=self.user), user=self.user)
+        self.assertEqual(self.complete('mil'), ['milk', 'oat milk'])
+
+        self.client.post('/api/ingredient/%d' % milk.id, {'id': milk.id, 'name': 'cream', 'locations': [location.id]}, format='json')
+        self.client.put('/api/ingredientbyname/millet')
+
+        self.assertEqual(self.complete('mil'), ['millet', 'oat milk'])
+        self.assertEqual(self.client.get('/api/ingredients/complete', {'q': 'cream'}).data[0]['locations'], [location.id])
+
+        self.client.delete('/api/location/%d' % location.id)
+        self.assertEqual(self.client.get('/api/ingredients/complete', {'q': 'cream'}).data[0]['locations'], [])
+
+    def test_other_processes_rebuild_their_index(self):
+        self.complete('mi')
+        otherProcessIndex = IngredientIndex.local.get(self.user.id)
+
+        self.client.put('/api/ingredientbyname/mirin')
+        IngredientIndex.local.set(self.user.id, otherProcessIndex)
+
+        self.assertIn('mirin', self.complete('mi'))
+        self.assertNotIn('mirin', [ingredient['name'] for ingredient in otherProcessIndex.complete('mi')])
+
+#---------------------------------------------------------------------------------------- Shopping lists
+
+class CompactShoppingListTests(ApiTestCase):
+
+    def setUp(self):
+        super(CompactShoppingListTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.shoppingList = self.user.profile.shoppingList
+        self.milk = Ingredient.objects.get(user=self.user, name='milk')
+
+    def addRecipes(self, count):
+        for i in range(count):
+            recipe = Recipe.objects.create(name='r%d' % i, category='c', description='', user=self.user)
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=self.milk, unit='ml', quantity=100)
+            ShoppingItem.objects.create(recipe=recipe, shoppingList=self.shoppingList, unit='serve', quantity=2)
+
+    def test_items_reference_recipes_listed_once(self):
+        self.addRecipes(2)
+        sugar = Ingredient.objects.get(user=self.user, name='sugar')
+        ShoppingItem.objects.create(ingredient=sugar, shoppingList=self.shoppingList, unit='kg', quantity=1)
+
+        response = self.client.get('/api/shopping-list/_?compact=true')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], self.shoppingList.id)
+        recipeIds = [item['recipe'] for item in response.data['items'] if item['recipe'] is not None]
+        self.assertEqual(sorted(recipeIds), [recipe['id'] for recipe in response.data['recipes']])
+        self.assertEqual(response.data['recipes'][0]['recipe_ingredients'][0]['ingredient'], self.milk.id)
+        self.assertEqual([dict(ingredient) for ingredient in response.data['ingredients']],
+                         sorted([{'id': self.milk.id, 'name': 'milk'}, {'id': sugar.id, 'name': 'sugar'}], key=lambda ingredient: ingredient['id']))
+
+    def test_number_of_queries_does_not_depend_on_the_items(self):
+        self.addRecipes(1)
+        few, response = self.countQueries(lambda: self.client.get('/api/shopping-list/%d?compact=true' % self.shoppingList.id))
+        self.assertEqual(len(response.data['items']), 1)
+
+        self.addRecipes(10)
+        many, response = self.countQueries(lambda: self.client.get('/api/shopping-list/%d?compact=true' % self.shoppingList.id))
+        self.assertEqual(len(response.data['items']), 11)
+        self.assertEqual(many, few)
+
+    def test_full_representation_is_unchanged(self):
+        self.addRecipes(1)
+
+        item = self.client.get('/api/shopping-list/_').data['items'][0]
+
+        self.assertEqual(item['recipe']['name'], 'r0')
+        self.assertEqual(item['recipe']['recipe_ingredients'][0]['ingredient'], self.milk.id)
+
+class ShoppingListSaveTests(ApiTestCase):
+
+    def setUp(self):
+        super(ShoppingListSaveTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.shoppingList = self.user.profile.shoppingList
+        self.recipe = Recipe.objects.get(user=self.user, name='cappuccino')
+        self.milk = Ingredient.objects.get(user=self.user, name='milk')
+
+    def itemData(self, count):
+        items = [{'id': '_%d' % i, 'unit': 'l', 'quantity': i, 'ingredient': self.milk.id, 'recipe': None} for i in range(count)]
+        items.append({'id': '_r', 'unit': 'serve', 'quantity': 2, 'ingredient': None, 'recipe': {'id': self.recipe.id}})
+        return items
+
+    def post(self, shoppingListId, items, name='list'):
+        return self.client.post('/api/shopping-list/%s' % shoppingListId, {'id': shoppingListId, 'name': name, 'items': items}, format='json')
+
+    def saveAndUpdate(self, itemCount):
+        # Queries of an update adding items and of an update changing, removing and adding items
+        ShoppingItem.objects.filter(shoppingList=self.shoppingList).delete()
+        added, response = self.countQueries(lambda: self.post(self.shoppingList.id, self.itemData(itemCount)))
+        self.assertEqual(response.status_code, 200)
+
+        items = [dict(item, quantity=10) for item in response.data['items'][1:]]
+        for item in items:
+            if item['recipe'] is not None:
+                item['recipe'] = {'id': item['recipe']['id']}
+        items.append({'id': '_new', 'unit': 'kg', 'quantity': 1, 'ingredient': self.milk.id, 'recipe': None})
+        updated, response = self.countQueries(lambda: self.post(self.shoppingList.id, items, name='renamed'))
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(response.data['name'], 'renamed')
+        self.assertEqual(len(response.data['items']), itemCount + 1)
+        self.assertEqual(ShoppingItem.objects.filter(shoppingList=self.shoppingList, quantity=10).count(), itemCount)
+        return added, updated
+
+    def test_number_of_queries_does_not_depend_on_the_items(self):
+        # The first save also loads the cached data of the user
+        self.saveAndUpdate(2)
+        self.assertEqual(self.saveAndUpdate(3), self.saveAndUpdate(20))
+
+    def test_new_list_clones_the_items_and_becomes_current(self):
+        self.post(self.shoppingList.id, self.itemData(3))
+        items = self.client.get('/api/shopping-list/_').data['items']
+        for item in items:
+            item['recipe'] = None if item['recipe'] is None else {'id': item['recipe']['id']}
+
+        response = self.post('_', items)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data['id'], self.shoppingList.id)
+        self.assertEqual(UserProfile.objects.get(user=self.user).shoppingList_id, response.data['id'])
+        self.assertEqual(ShoppingItem.objects.filter(shoppingList_id=response.data['id']).count(), 4)
+        self.assertEqual(ShoppingItem.objects.filter(shoppingList=self.shoppingList).count(), 4)
+
+    def test_invalid_items_leave_the_list_unchanged(self):
+        self.post(self.shoppingList.id, self.itemData(1))
+        otherUser, otherClient = self.createClient('other')
+        theirs = Ingredient.objects.get(user=otherUser, name='milk')
+
+        items = self.itemData(1)
+        items[0]['ingredient'] = theirs.id
+        self.assertEqual(self.post(self.shoppingList.id, items, name='changed').status_code, 400)
+        items = self.itemData(1)
+        items[0]['id'] = 12345
+        self.assertEqual(self.post(self.shoppingList.id, items, name='changed').status_code, 400)
+
+        self.assertEqual(ShoppingList.objects.get(pk=self.shoppingList.id).name, 'list')
+        self.assertEqual(ShoppingItem.objects.filter(shoppingList=self.shoppingList).count(), 2)
+
+    def test_lists_of_other_users_cannot_be_changed(self):
+        otherUser, otherClient = self.createClient('other')
+
+        response = otherClient.post('/api/shopping-list/%d' % self.shoppingList.id, {'id': self.shoppingList.id, 'name': 'x', 'items': []}, format='json')
+
+        self.assertEqual(response.status_code, 403)
+
+class ConsolidatedShoppingListTests(ApiTransactionTestCase):
+
+    def setUp(self):
+        super(ConsolidatedShoppingListTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.recipe = Recipe.objects.get(user=self.user, name='cappuccino')
+        self.ingredients = dict((ingredient.name, ingredient.id) for ingredient in Ingredient.objects.filter(user=self.user))
+        self.client.post('/api/shopping-list/_/recipe/%d' % self.recipe.id, {'action': 'add'}, format='json')
+
+    def totals(self):
+        response = self.client.get('/api/shopping-list/_/consolidated')
+        self.assertEqual(response.status_code, 200)
+        return dict(((item['ingredient'], item['unit']), item['quantity']) for item in response.data['items'])
+
+    def test_recipe_ingredients_are_scaled_and_merged_with_free_items(self):
+        shoppingList = self.user.profile.shoppingList
+        recipeItem = shoppingList.items.get()
+        self.client.post('/api/shopping-list/%d' % shoppingList.id, {'id': shoppingList.id, 'name': '', 'items': [
+            {'id': recipeItem.id, 'unit': 'serve', 'quantity': 4, 'ingredient': None, 'recipe': {'id': self.recipe.id}},
+            {'id': '_1', 'unit': 'tl', 'quantity': 3, 'ingredient': self.ingredients['sugar'], 'recipe': None},
+            {'id': '_2', 'unit': 'kg', 'quantity': 1, 'ingredient': self.ingredients['sugar'], 'recipe': None},
+        ]}, format='json')
+
+        self.assertEqual(self.totals(), {
+            (self.ingredients['coffee'], 'tl'): 8,
+            (self.ingredients['sugar'], 'tl'): 7,
+            (self.ingredients['sugar'], 'kg'): 1,
+            (self.ingredients['milk'], 'ml'): 300,
+        })
+
+    def test_totals_follow_changes_of_the_recipe(self):
+        self.assertEqual(self.totals()[(self.ingredients['milk'], 'ml')], 150)
+
+        recipe = self.content(self.client.get('/api/recipe/%d' % self.recipe.id))
+        for recipeIngredient in recipe['recipe_ingredients']:
+            if recipeIngredient['ingredient'] == self.ingredients['milk']:
+                recipeIngredient['quantity'] = 200
+        recipe['recipe_ingredients'] = [recipeIngredient for recipeIngredient in recipe['recipe_ingredients']
+                                        if recipeIngredient['ingredient'] != self.ingredients['coffee']]
+        self.assertEqual(self.client.post('/api/recipe/%d' % self.recipe.id, recipe, format='json').status_code, 201)
+
+        self.assertEqual(self.totals(), {
+            (self.ingredients['sugar'], 'tl'): 2,
+            (self.ingredients['milk'], 'ml'): 200,
+        })
+
+    def test_totals_follow_changes_of_the_items(self):
+        self.assertEqual(len(self.totals()), 3)
+
+        self.client.post('/api/shopping-list/_/recipe/%d' % self.recipe.id, {'action': 'remove'}, format='json')
+
+        self.assertEqual(self.totals(), {})
+
+#---------------------------------------------------------------------------------------- Profiles
+
+class UserProfileCacheTests(ApiTransactionTestCase):
+
+    def setUp(self):
+        super(UserProfileCacheTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.shop = Shop.objects.get(user=self.user)
+
+    def profileQueries(self, call):
+        with CaptureQueriesContext(connection) as queries:
+            response = call()
+        return len([query for query in queries.captured_queries if UserProfile._meta.db_table in query['sql']]), response
+
+    def test_profile_is_read_once_and_then_cached(self):
+        recipe = Recipe.objects.get(user=self.user, name='cappuccino')
+        # The recipe and the shopping item commands read the profile, in one request and across requests
+        reads, response = self.profileQueries(lambda: self.client.post('/api/shopping-list/_/recipe/%d' % recipe.id, {'action': 'add'}, format='json'))
+        self.assertEqual(reads, 1)
+        reads, response = self.profileQueries(lambda: self.client.get('/api/shopping-list/_/recipe/%d' % recipe.id))
+        self.assertEqual(reads, 0)
+        self.assertEqual(response.data, True)
+
+    def test_current_shop_change_is_seen_at_once(self):
+        self.assertEqual(self.client.get('/api/shop/current').data['id'], self.shop.id)
+        newShop = self.client.post('/api/shop/_', {'id': '_', 'name': 'market'}, format='json').data
+
+        self.client.post('/api/shop/current', {'id': newShop['id']}, format='json')
+
+        self.assertEqual(self.client.get('/api/shop/current').data, newShop)
+        self.assertEqual(UserProfile.objects.get(user=self.user).shop_id, newShop['id'])
+
+    def test_renamed_and_deleted_shops_are_seen_at_once(self):
+        self.assertEqual(self.client.get('/api/shop/current').data['name'], 'My shop')
+
+        self.client.post('/api/shop/%d' % self.shop.id, {'id': self.shop.id, 'name': 'renamed'}, format='json')
+        self.assertEqual(self.client.get('/api/shop/current').data['name'], 'renamed')
+
+        self.client.delete('/api/shop/%d' % self.shop.id)
+        self.assertEqual(self.client.get('/api/shop/current').data.get('id'), None)
+        self.assertEqual(UserProfile.objects.get(user=self.user).shop_id, None)
+
+    def test_new_shopping_list_is_seen_at_once(self):
+        self.assertEqual(self.content(self.client.get('/api/shopping-list/_'))['id'], self.user.profile.shoppingList_id)
+
+        newList = self.client.post('/api/shopping-list/_', {'id': '_', 'name': 'next', 'items': []}, format='json').data
+
+        self.assertEqual(self.content(self.client.get('/api/shopping-list/_'))['id'], newList['id'])
+
+#---------------------------------------------------------------------------------------- Starter data
+
+class StarterKitTests(ApiTestCase):
+
+    def setUp(self):
+        super(StarterKitTests, self).setUp()
+        self.template = StarterKit.get()
+
+    def tearDown(self):
+        StarterKit.template = self.template
+
+    def largeTemplate(self, size):
+        ingredients = ['i%d' % i for i in range(size)]
+        return {
+            'ingredients': ingredients,
+            'recipes': [{'name': 'r%d' % i, 'category': 'c%d' % (i % 3), 'description': 'recipe %d' % i,
+                         'ingredients': [{'ingredient': name, 'unit': 'g', 'quantity': 1} for name in ingredients[i:i + 3]]}
+                        for i in range(size)],
+            'shop': 'Shop', 'shoppingList': 'List'
+        }
+
+    def test_signup_creates_the_starter_data(self):
+        client = APIClient()
+        response = client.post('/api/auth/signup', {'username': 'jhon', 'email': 'jhon@example.com', 'password': 'pw', 'confirmPassword': 'pw'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        user = User.objects.get(username='jhon')
+
+        recipe = Recipe.objects.get(user=user)
+        self.assertEqual(recipe.name, 'cappuccino')
+        self.assertEqual(sorted(recipe.recipe_ingredients.values_list('ingredient__name', 'unit', 'quantity')),
+                         [('coffee', 'tl', 4), ('milk', 'ml', 150), ('sugar', 'tl', 2)])
+        self.assertEqual(sorted(Ingredient.objects.filter(user=user).values_list('name', flat=True)), ['coffee', 'milk', 'sugar'])
+        profile = UserProfile.objects.get(user=user)
+        self.assertEqual(profile.shop.name, 'My shop')
+        self.assertEqual(profile.shoppingList.user_id, user.id)
+        self.assertEqual(Statistics.read(user.id), Statistics.compute(user.id))
+        self.assertEqual(self.authorizedClient('Token ' + response.data).get('/api/recipes/search?q=expresso').data['count'], 1)
+
+    def test_number_of_queries_does_not_depend_on_the_template(self):
+        StarterKit.template = self.largeTemplate(2)
+        few, user = self.countQueries(lambda: self.createUser('few'))
+        StarterKit.template = self.largeTemplate(30)
+        many, user = self.countQueries(lambda: self.createUser('many'))
+
+        self.assertEqual(many, few)
+        self.assertEqual(Recipe.objects.filter(user=user).count(), 30)
+        self.assertEqual(RecipeIngredient.objects.filter(recipe__user=user).count(), 30 + 29 + 28)
+        self.assertEqual(Statistics.read(user.id), Statistics.compute(user.id))
+
+    def test_invalid_templates_are_refused(self):
+        template = self.largeTemplate(2)
+        template['recipes'][0]['ingredients'][0]['ingredient'] = 'unknown'
+
+        self.assertRaises(ImproperlyConfigured, StarterKit.validate, template)
+        self.assertRaises(ImproperlyConfigured, StarterKit.validate, dict(template, ingredients=['a', 'a']))
+
+#---------------------------------------------------------------------------------------- Authentication
+
+class TokenCacheTests(ApiTransactionTestCase):
+
+    def setUp(self):
+        super(TokenCacheTests, self).setUp()
+        self.user = self.createUser('jhon')
+        self.key = self.login('jhon').data
+        self.client = self.authorizedClient('Token ' + self.key)
+
+    def tokenQueries(self, call):
+        with CaptureQueriesContext(connection) as queries:
+            response = call()
+        return len([query for query in queries.captured_queries if Token._meta.db_table in query['sql']]), response
+
+    def test_tokens_are_read_once_and_then_cached(self):
+        reads, response = self.tokenQueries(lambda: self.client.get('/api/recipes'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(reads, 1)
+
+        reads, response = self.tokenQueries(lambda: self.client.get('/api/recipes'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(reads, 0)
+
+        # Other processes find the token in the shared cache
+        TokenCache.local.clear()
+        reads, response = self.tokenQueries(lambda: self.client.get('/api/recipes'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(reads, 0)
+
+    def test_cached_entries_do_not_hold_the_password(self):
+        self.client.get('/api/recipes')
+
+        entry = TokenCache.local.get(self.key)
+
+        self.assertEqual(entry['id'], self.user.id)
+        self.assertNotIn('password', entry)
+        self.assertNotIn(self.user.password, str(cache.get(TokenCache.cacheKey(self.key))))
+
+    def test_logout_revokes_the_token(self):
+        self.assertEqual(self.client.get('/api/recipes').status_code, 200)
+
+        self.client.get('/api/auth/logout')
+
+        self.assertEqual(self.client.get('/api/recipes').status_code, 401)
+
+    def test_deactivated_users_are_rejected_at_once(self):
+        self.assertEqual(self.client.get('/api/recipes').status_code, 200)
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.client.get('/api/recipes').status_code, 401)
+
+    def test_revocations_reach_the_local_caches_of_other_processes(self):
+        self.assertEqual(self.client.get('/api/recipes').status_code, 200)
+
+        self.inOtherProcess(TokenCache.local, lambda: User.objects.get(pk=self.user.pk).save())
+        self.assertEqual(self.client.get('/api/recipes').status_code, 200)
+        self.inOtherProcess(TokenCache.local, lambda: self.client.get('/api/auth/logout'))
+
+        self.assertEqual(self.client.get('/api/recipes').status_code, 401)
+
+    def test_unknown_tokens_are_rejected(self):
+        self.assertEqual(self.authorizedClient('Token unknown').get('/api/recipes').status_code, 401)
+
+class AccessTokenTests(ApiTransactionTestCase):
+
+    def setUp(self):
+        super(AccessTokenTests, self).setUp()
+        self.user = self.createUser('jhon')
+        tokens = self.login('jhon', mode='access').data
+        self.refresh = tokens['refresh']
+        self.access = tokens['access']
+        self.client = self.authorizedClient('Bearer ' + self.access)
+
+    def test_login_and_refresh_hand_out_access_tokens(self):
+        self.assertEqual(self.client.get('/api/recipes').status_code, 200)
+
+        response = APIClient().post('/api/auth/access-token', {'refresh': self.refresh}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['expires'], 300)
+        self.assertEqual(self.authorizedClient('Bearer ' + response.data['access']).get('/api/recipes').status_code, 200)
+        self.assertEqual(APIClient().post('/api/auth/access-token', {'refresh': 'unknown'}, format='json').status_code, 401)
+
+    def test_access_tokens_are_checked_without_reading_the_user(self):
+        self.client.get('/api/recipes')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/recipes').status_code, 200)
+
+        tables = (User._meta.db_table, Token._meta.db_table)
+        self.assertEqual([query for query in queries.captured_queries if any(table in query['sql'] for table in tables)], [])
+
+    def test_expired_access_tokens_are_rejected(self):
+        # Every access token is older than a negative lifetime
+        with override_settings(ACCESS_TOKEN_LIFETIME=-1):
+            response = self.client.get('/api/recipes')
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'], 'Access token expired.')
+
+    def test_tampered_access_tokens_are_rejected(self):
+        tampered = self.access[:-2] + ('AA' if self.access[-2:] != 'AA' else 'BB')
+
+        response = self.authorizedClient('Bearer ' + tampered).get('/api/recipes')
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'], 'Invalid access token.')
+
+    def test_logout_revokes_the_access_tokens(self):
+        self.assertEqual(self.client.get('/api/recipes').status_code, 200)
+
+        self.authorizedClient('Token ' + self.refresh).get('/api/auth/logout')
+
+        response = self.client.get('/api/recipes')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'], 'Access token revoked.')
+
+    def test_tokens_of_a_new_login_are_accepted(self):
+        self.authorizedClient('Token ' + self.refresh).get('/api/auth/logout')
+
+        tokens = self.login('jhon', mode='access').data
+
+        self.assertEqual(self.authorizedClient('Bearer ' + tokens['access']).get('/api/recipes').status_code, 200)
+        self.assertEqual(self.client.get('/api/recipes').status_code, 401)
+
+    def test_deactivated_users_are_rejected_at_once(self):
+        self.assertEqual(self.client.get('/api/recipes').status_code, 200)
+
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get('/api/recipes')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'], 'User inactive or deleted.')
+
+class BasicCredentialCacheTests(ApiTransactionTestCase):
+
+    def setUp(self):
+        super(BasicCredentialCacheTests, self).setUp()
+        self.user = self.createUser('jhon')
+
+    def get(self, password, client='10.0.0.1'):
+        credentials = base64.b64encode(('jhon:%s' % password).encode('utf-8')).decode('ascii')
+        return self.authorizedClient('Basic ' + credentials).get('/api/recipes', REMOTE_ADDR=client)
+
+    def test_verified_credentials_skip_the_password_hash(self):
+        self.assertEqual(self.get('secret-jhon').status_code, 200)
+        # Not verified against the stored hash any more (changed without signals)
+        User.objects.filter(pk=self.user.pk).update(password='!')
+
+        self.assertEqual(self.get('secret-jhon').status_code, 200)
+        self.assertEqual(self.get('wrong').status_code, 401)
+
+    def test_password_change_revokes_the_cached_credentials(self):
+        self.assertEqual(self.get('secret-jhon').status_code, 200)
+
+        self.user.set_password('changed')
+        self.user.save()
+
+        self.assertEqual(self.get('secret-jhon').status_code, 401)
+        self.assertEqual(self.get('changed').status_code, 200)
+
+    def test_password_changes_reach_the_local_caches_of_other_processes(self):
+        self.assertEqual(self.get('secret-jhon').status_code, 200)
+
+        def changePassword():
+            self.user.set_password('changed')
+            self.user.save()
+        self.inOtherProcess(BasicCredentialCache.local, changePassword)
+
+        self.assertEqual(self.get('secret-jhon').status_code, 401)
+        self.assertEqual(self.get('changed').status_code, 200)
+
+    def test_clients_are_blocked_after_repeated_failures(self):
+        for attempt in range(5):
+            self.assertEqual(self.get('wrong').status_code, 401)
+
+        response = self.get('secret-jhon')
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'], 'Too many failed attempts, try again later.')
+        # Other clients can still log in
+        self.assertEqual(self.get('secret-jhon', client='10.0.0.2').status_code, 200)
+
+    def test_password_reset_lifts_the_block(self):
+        for attempt in range(5):
+            self.get('wrong')
+        token = Token.objects.get_or_create(user=self.user)[0]
+
+        response = APIClient().post('/api/auth/password-reset', {'username': 'jhon', 'token': token.key, 'password': 'new', 'confirmPassword': 'new'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get('new').status_code, 200)
+
+#---------------------------------------------------------------------------------------- E-mails
+
+class RecordingSmtpConnection(object):
+    # SMTP connection keeping the sent messages, failing for the recipients of failures
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.messages = []
+
+    def noop(self):
+        return (250, 'OK')
+
+    def sendmail(self, sender, recipients, message):
+        if recipients[0] in self.failures:
+            raise self.failures[recipients[0]]
+        self.messages.append((recipients[0], message))
+
+    def quit(self):
+        pass
+
+
+class RecordingOutboxWorker(OutboxWorker):
+
+    def __init__(self, failures=None):
+        super(RecordingOutboxWorker, self).__init__()
+        self.failures = failures or {}
+        self.connections = []
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = RecordingSmtpConnection(self.failures)
+            self.connections.append(self.connection)
+        return self.connection
+
+
+class OutboxTests(ApiTestCase):
+
+    def test_password_reset_request_is_queued(self):
+        user = self.createUser('jhon')
+
+        response = APIClient().post('/api/auth/request-password-reset', {'username': 'jhon'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.recipient, 'jhon@example.com')
+        self.assertIn('/reset/jhon/%s' % Token.objects.get(user=user).key, email.body)
+        self.assertEqual(email.sent, None)
+
+    def test_due_emails_are_sent_over_one_connection(self):
+        for i in range(3):
+            Outbox.enqueue('u%d@example.com' % i, 'subject', 'body')
+        worker = RecordingOutboxWorker()
+
+        self.assertEqual(worker.drain(), 3)
+
+        self.assertEqual(len(worker.connections), 1)
+        self.assertEqual(sorted(recipient for recipient, message in worker.connections[0].messages), ['u0@example.com', 'u1@example.com', 'u2@example.com'])
+        self.assertEqual(OutgoingEmail.objects.filter(sent__isnull=True).count(), 0)
+        self.assertEqual(worker.drain(), 0)
+
+    def test_delivery_errors_are_retried_later_then_given_up(self):
+        email = Outbox.enqueue('bad@example.com', 'subject', 'body')
+        Outbox.enqueue('good@example.com', 'subject', 'body')
+        worker = RecordingOutboxWorker({'bad@example.com': smtplib.SMTPServerDisconnected('gone')})
+
+        self.assertEqual(worker.drain(), 1)
+
+        email = OutgoingEmail.objects.get(pk=email.pk)
+        self.assertEqual((email.attempts, email.failed, email.sent), (1, False, None))
+        self.assertIn('gone', email.lastError)
+        self.assertGreater(email.nextAttempt, timezone.now())
+
+        for attempt in range(worker.maxAttempts - 1):
+            OutgoingEmail.objects.filter(pk=email.pk).update(nextAttempt=timezone.now())
+            worker.drain()
+        email = OutgoingEmail.objects.get(pk=email.pk)
+        self.assertEqual((email.attempts, email.failed), (worker.maxAttempts, True))
+
+    def test_other_errors_are_given_up_at_once(self):
+        email = Outbox.enqueue('bad@example.com', 'subject', 'body')
+        worker = RecordingOutboxWorker({'bad@example.com': ValueError('cannot encode')})
+
+        self.assertEqual(worker.drain(), 0)
+
+        email = OutgoingEmail.objects.get(pk=email.pk)
+        self.assertEqual((email.attempts, email.failed), (1, True))
+
+    def test_emails_are_claimed_by_one_worker(self):
+        Outbox.enqueue('u@example.com', 'subject', 'body')
+        email, = Outbox.due(10)
+        stale, = Outbox.due(10)
+
+        self.assertTrue(Outbox.claim(email, 300))
+        self.assertFalse(Outbox.claim(stale, 300))
+        self.assertEqual(Outbox.due(10), [])
+        self.assertEqual(RecordingOutboxWorker().drain(), 0)
+
+#---------------------------------------------------------------------------------------- Account deletion
+
+class FailingDeletionWorker(DeletionWorker):
+    # Fails once when it reaches the given stage
+
+    def __init__(self, failingStage, chunkSize=None):
+        super(FailingDeletionWorker, self).__init__(chunkSize)
+        self.failingStage = failingStage
+
+    def purgeChunk(self, model, lookup, userId):
+        if model is self.failingStage:
+            self.failingStage = None
+            raise RuntimeError('purge interrupted')
+        return super(FailingDeletionWorker, self).purgeChunk(model, lookup, userId)
+
+
+class AccountDeletionTests(ApiTestCase):
+
+    def setUp(self):
+        super(AccountDeletionTests, self).setUp()
+        self.user = self.createUser('jhon')
+        self.key = self.login('jhon').data
+        self.otherUser, self.otherClient = self.createClient('other')
+        milk = Ingredient.objects.get(user=self.user, name='milk')
+        for i in range(5):
+            recipe = Recipe.objects.create(name='r%d' % i, category='c', description='', user=self.user)
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=milk, unit='ml', quantity=1)
+
+    def userRows(self, user):
+        return sum(model.objects.filter(**{lookup: user.id}).count() for model, lookup in DeletionWorker.STAGES)
+
+    def closeUp(self):
+        response = self.authorizedClient('Token ' + self.key).get('/api/auth/closeup')
+        self.assertEqual(response.status_code, 200)
+
+    def test_closing_deactivates_at_once_and_defers_the_purge(self):
+        self.closeUp()
+
+        self.assertFalse(User.objects.get(pk=self.user.pk).is_active)
+        self.assertEqual(self.authorizedClient('Token ' + self.key).get('/api/recipes').status_code, 401)
+        self.assertEqual(self.login('jhon').status_code, 403)
+        deletion = UserDeletion.objects.get(userId=self.user.id)
+        self.assertEqual(deletion.finished, None)
+        self.assertEqual(Recipe.objects.filter(user_id=self.user.id).count(), 6)
+
+    def test_username_stays_taken_until_the_purge_finishes(self):
+        self.closeUp()
+        # Purged up to the profile only
+        model, lookup = DeletionWorker.STAGES[0]
+        DeletionWorker().purgeChunk(model, lookup, self.user.id)
+        self.assertFalse(UserProfile.objects.filter(user_id=self.user.id).exists())
+        signUp = {'username': 'jhon', 'email': 'jhon@example.com', 'password': 'pw', 'confirmPassword': 'pw'}
+
+        self.assertEqual(APIClient().post('/api/auth/signup', signUp, format='json').status_code, 400)
+        DeletionWorker().drain()
+        self.assertEqual(APIClient().post('/api/auth/signup', signUp, format='json').status_code, 200)
+
+    def test_purge_deletes_all_data_in_chunks(self):
+        otherRows = self.userRows(self.otherUser)
+        self.closeUp()
+
+        self.assertEqual(DeletionWorker(chunkSize=2).drain(), 1)
+
+        deletion = UserDeletion.objects.get(userId=self.user.id)
+        self.assertNotEqual(deletion.finished, None)
+        self.assertEqual(deletion.stage, len(DeletionWorker.STAGES))
+        self.assertGreater(deletion.rowsDeleted, 20)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual(self.userRows(self.user), 0)
+        self.assertEqual(self.userRows(self.otherUser), otherRows)
+        self.assertEqual(DeletionWorker().drain(), 0)
+
+    def test_interrupted_purge_is_resumed(self):
+        self.closeUp()
+        worker = FailingDeletionWorker(Recipe, chunkSize=2)
+
+        self.assertEqual(worker.drain(), 0)
+
+        deletion = UserDeletion.objects.get(userId=self.user.id)
+        self.assertIn('purge interrupted', deletion.lastError)
+        self.assertEqual(DeletionWorker.STAGES[deletion.stage][0], Recipe)
+        self.assertFalse(RecipeIngredient.objects.filter(recipe__user_id=self.user.id).exists())
+        self.assertTrue(Recipe.objects.filter(user_id=self.user.id).exists())
+
+        self.assertEqual(worker.drain(), 1)
+        self.assertEqual(self.userRows(self.user), 0)
+
+    def test_data_of_other_users_referring_to_the_account_is_detached(self):
+        # Rows of other users referring to the data of the account (not possible through the API)
+        recipe = Recipe.objects.filter(user=self.user).first()
+        otherList = self.otherUser.profile.shoppingList
+        ShoppingItem.objects.create(recipe=recipe, shoppingList=otherList, unit='serve', quantity=1)
+        UserProfile.objects.filter(user=self.otherUser).update(shop=Shop.objects.get(user=self.user))
+        self.closeUp()
+
+        self.assertEqual(DeletionWorker(chunkSize=2).drain(), 1)
+
+        self.assertFalse(ShoppingItem.objects.filter(shoppingList=otherList).exists())
+        self.assertEqual(UserProfile.objects.get(user=self.otherUser).shop_id, None)
+        self.assertEqual(self.otherClient.get('/api/recipes').status_code, 200)
+
+    def test_delete_user_purges_at_once(self):
+        DeletionWorker().purge(Utils.deleteUser('jhon'))
+
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual(self.userRows(self.user), 0)
+
+#---------------------------------------------------------------------------------------- Batches
+
+class BatchTests(ApiTransactionTestCase):
+
+    def setUp(self):
+        super(BatchTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+
+    def batch(self, *requests):
+        return self.client.post('/api/batch', {'requests': list(requests)}, format='json')
+
+    def test_requests_refer_to_earlier_responses(self):
+        response = self.batch(
+            {'method': 'POST', 'url': '/api/shop/_', 'body': {'id': '_', 'name': 'market'}},
+            {'method': 'POST', 'url': '/api/location/_', 'body': {'name': 'fruits', 'shop': '$0.id'}},
+            {'method': 'GET', 'url': '/api/location/$1.id'},
+            {'method': 'POST', 'url': '/api/shop/current', 'body': {'id': '$0.id'}},
+            {'method': 'GET', 'url': '/api/shop/current'},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        responses = response.data['responses']
+        self.assertEqual([subResponse['status'] for subResponse in responses], [201, 201, 200, 200, 200])
+        self.assertEqual(responses[2]['body']['name'], 'fruits')
+        self.assertEqual(responses[2]['body']['shop'], responses[0]['body']['id'])
+        self.assertEqual(responses[4]['body']['name'], 'market')
+        self.assertEqual(self.client.get('/api/shop/current').data['name'], 'market')
+
+    def test_failed_request_rolls_back_the_batch(self):
+        response = self.batch(
+            {'method': 'POST', 'url': '/api/shop/_', 'body': {'id': '_', 'name': 'market'}},
+            {'method': 'POST', 'url': '/api/shop/current', 'body': {'id': '$0.id'}},
+            {'method': 'POST', 'url': '/api/recipe/_', 'body': recipeData('soup', [(12345, 'g', 1)])},
+            {'method': 'GET', 'url': '/api/recipes'},
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual(len(response.data['responses']), 3)
+        self.assertFalse(Shop.objects.filter(name='market').exists())
+        self.assertFalse(Recipe.objects.filter(name='soup').exists())
+        self.assertEqual(self.client.get('/api/shop/current').data['name'], 'My shop')
+
+    def test_only_data_endpoints_can_be_batched(self):
+        for url in ('/api/auth/logout', '/api/auth/closeup', '/api/batch', '/api/sync', '/api/collection/export'):
+            response = self.batch({'method': 'GET', 'url': '/api/recipes'}, {'method': 'GET', 'url': url})
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['responses'][1]['body'], 'Url cannot be batched: %s' % url)
+        self.assertTrue(User.objects.get(pk=self.user.pk).is_active)
+
+    def test_invalid_batches_and_references_are_rejected(self):
+        self.assertEqual(self.client.post('/api/batch', {'requests': 'x'}, format='json').status_code, 400)
+        self.assertEqual(self.batch({'method': 'PATCH', 'url': '/api/recipes'}).status_code, 400)
+        self.assertEqual(self.batch(*[{'url': '/api/recipes'}] * 51).status_code, 400)
+
+        response = self.batch({'method': 'GET', 'url': '/api/recipe/$1.id'}, {'method': 'GET', 'url': '/api/recipes'})
+        self.assertEqual(response.data['responses'][0]['status'], 400)
+        response = self.batch({'method': 'GET', 'url': '/api/recipes'}, {'method': 'GET', 'url': '/api/recipe/$0.5.id'})
+        self.assertEqual(response.data['responses'][1]['status'], 400)
+        self.assertEqual(self.batch({'method': 'GET', 'url': '/api/unknown'}).data['responses'][0]['status'], 404)
+
+    def test_new_shopping_list_is_current_in_the_rest_of_the_batch(self):
+        response = self.batch(
+            {'method': 'POST', 'url': '/api/shopping-list/_', 'body': {'id': '_', 'name': 'next', 'items': []}},
+            {'method': 'GET', 'url': '/api/shopping-list/_'},
+        )
+
+        responses = response.data['responses']
+        self.assertEqual(responses[1]['body']['id'], responses[0]['body']['id'])
+        self.assertEqual(self.content(self.client.get('/api/shopping-list/_'))['id'], responses[0]['body']['id'])
+
+#---------------------------------------------------------------------------------------- Synchronization
+
+class SyncTests(ApiTestCase):
+
+    def setUp(self):
+        super(SyncTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.shop = Shop.objects.get(user=self.user)
+
+    def sync(self, since=None):
+        response = self.client.get('/api/sync', {} if since is None else {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def ids(self, objects):
+        return sorted(obj['id'] for obj in objects)
+
+    def test_first_sync_returns_everything(self):
+        delta = self.sync()
+
+        self.assertTrue(delta['full'])
+        self.assertEqual([recipe['name'] for recipe in delta['recipes']], ['cappuccino'])
+        self.assertEqual(len(delta['recipes'][0]['recipe_ingredients']), 3)
+        self.assertEqual(len(delta['ingredients']), 3)
+        self.assertEqual(self.ids(delta['shops']), [self.shop.id])
+        self.assertEqual(delta['profile'], {'shop': self.shop.id, 'shoppingList': self.user.profile.shoppingList_id})
+        self.assertEqual(self.sync(delta['cursor'])['full'], False)
+
+    def test_delta_holds_the_changed_and_deleted_objects(self):
+        cursor = self.sync()['cursor']
+        location = self.client.post('/api/location/_', {'name': 'fridge', 'shop': self.shop.id}, format='json').data
+        milk = Ingredient.objects.get(user=self.user, name='milk')
+        self.client.post('/api/ingredient/%d' % milk.id, {'id': milk.id, 'name': 'milk', 'locations': [location['id']]}, format='json')
+        recipe = self.client.post('/api/recipe/_', recipeData('tea', [(milk.id, 'ml', 10)]), format='json').data
+        cappuccino = Recipe.objects.get(user=self.user, name='cappuccino')
+        self.client.delete('/api/recipe/%d' % cappuccino.id)
+        self.client.post('/api/shopping-list/_/recipe/%d' % recipe['id'], {'action': 'add'}, format='json')
+
+        delta = self.sync(cursor)
+
+        self.assertFalse(delta['full'])
+        self.assertGreater(delta['cursor'], cursor)
+        self.assertEqual(self.ids(delta['recipes']), [recipe['id']])
+        self.assertEqual(delta['recipes'][0]['recipe_ingredients'][0]['ingredient'], milk.id)
+        self.assertEqual(delta['deleted']['recipes'], [cappuccino.id])
+        self.assertEqual(delta['ingredients'], [{'id': milk.id, 'name': 'milk', 'locations': [location['id']]}])
+        self.assertEqual(self.ids(delta['locations']), [location['id']])
+        self.assertEqual(delta['shops'], [])
+        self.assertEqual(self.ids(delta['shoppingLists']), [self.user.profile.shoppingList_id])
+        self.assertEqual(len(delta['shoppingLists'][0]['items']), 1)
+
+        delta = self.sync(delta['cursor'])
+        self.assertFalse(delta['full'])
+        self.assertEqual((delta['recipes'], delta['deleted']['recipes'], delta['shoppingLists']), ([], [], []))
+
+    def test_unknown_cursors_get_everything(self):
+        cursor = self.sync()['cursor']
+
+        self.assertTrue(self.sync(cursor + 1)['full'])
+        self.assertEqual(self.client.get('/api/sync', {'since': 'x'}).status_code, 400)
+
+    def test_cursors_older_than_the_pruned_deletions_get_everything(self):
+        cursor = self.sync()['cursor']
+        self.client.delete('/api/shop/%d' % self.shop.id)
+        afterDelete = self.sync(cursor)
+        self.assertEqual(afterDelete['deleted']['shops'], [self.shop.id])
+        Change.objects.filter(user=self.user, deleted=True).update(changed=timezone.now() - timedelta(days=31))
+        self.client.post('/api/shop/_', {'id': '_', 'name': 'market'}, format='json')
+
+        self.assertEqual(Changes.prune(30), 1)
+
+        self.assertFalse(Change.objects.filter(user=self.user, deleted=True).exists())
+        delta = self.sync(cursor)
+        self.assertTrue(delta['full'])
+        self.assertEqual([shop['name'] for shop in delta['shops']], ['market'])
+        delta = self.sync(afterDelete['cursor'])
+        self.assertFalse(delta['full'])
+        self.assertEqual([shop['name'] for shop in delta['shops']], ['market'])
+
+    def test_recent_deletions_are_kept(self):
+        cursor = self.sync()['cursor']
+        self.client.delete('/api/shop/%d' % self.shop.id)
+
+        self.assertEqual(Changes.prune(30), 0)
+
+        self.assertEqual(self.sync(cursor)['deleted']['shops'], [self.shop.id])
+
+#---------------------------------------------------------------------------------------- Conditional requests and response caching
+
+class ConditionalRequestTests(ApiTransactionTestCase):
+
+    def setUp(self):
+        super(ConditionalRequestTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.recipe = Recipe.objects.get(user=self.user, name='cappuccino')
+
+    def renameRecipe(self, name, ifMatch=None):
+        recipe = self.content(self.client.get('/api/recipe/%d' % self.recipe.id))
+        recipe['name'] = name
+        headers = {} if ifMatch is None else {'HTTP_IF_MATCH': ifMatch}
+        return self.client.post('/api/recipe/%d' % self.recipe.id, recipe, format='json', **headers)
+
+    def test_unchanged_data_is_not_sent_again(self):
+        response = self.client.get('/api/recipes')
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        queries, response = self.countQueries(lambda: self.client.get('/api/recipes', HTTP_IF_NONE_MATCH=etag))
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(queries, 1)
+        self.assertEqual(self.client.get('/api/recipes', HTTP_IF_NONE_MATCH='"other", W/' + etag).status_code, 304)
+
+    def test_every_write_changes_the_etags(self):
+        etags = [self.client.get(url)['ETag'] for url in ('/api/recipes', '/api/shops', '/api/recipe/%d' % self.recipe.id)]
+
+        self.client.post('/api/shop/_', {'id': '_', 'name': 'market'}, format='json')
+
+        for url, etag in zip(('/api/recipes', '/api/shops', '/api/recipe/%d' % self.recipe.id), etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([shop['name'] for shop in self.content(self.client.get('/api/shops'))], ['My shop', 'market'])
+
+    def test_etags_and_bodies_of_cached_responses_match(self):
+        first = self.client.get('/api/recipes')
+        second = self.client.get('/api/recipes')
+        self.assertEqual((second['ETag'], second.content), (first['ETag'], first.content))
+
+        self.renameRecipe('latte')
+
+        third = self.client.get('/api/recipes')
+        self.assertNotEqual(third['ETag'], first['ETag'])
+        self.assertEqual([recipe['name'] for recipe in self.content(third)], ['latte'])
+
+    def test_writes_with_a_current_if_match_are_applied(self):
+        etag = self.client.get('/api/recipe/%d' % self.recipe.id)['ETag']
+
+        response = self.renameRecipe('latte', ifMatch=etag)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get('/api/recipe/%d' % self.recipe.id, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_writes_with_a_stale_if_match_are_refused(self):
+        etag = self.client.get('/api/recipe/%d' % self.recipe.id)['ETag']
+        self.renameRecipe('latte')
+
+        response = self.renameRecipe('mocha', ifMatch=etag)
+
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(Recipe.objects.get(pk=self.recipe.id).name, 'latte')
+
+    def test_object_etags_ignore_changes_of_other_objects(self):
+        etag = self.client.get('/api/recipe/%d' % self.recipe.id)['ETag']
+        self.client.post('/api/recipe/_', recipeData('tea'), format='json')
+
+        self.assertEqual(self.renameRecipe('latte', ifMatch=etag).status_code, 201)
+
+    def test_shopping_list_writes_check_if_match(self):
+        shoppingList = self.user.profile.shoppingList
+        etag = self.client.get('/api/shopping-list/_')['ETag']
+        data = {'id': shoppingList.id, 'name': 'weekly', 'items': []}
+
+        self.assertEqual(self.client.post('/api/shopping-list/%d' % shoppingList.id, data, format='json', HTTP_IF_MATCH=etag).status_code, 200)
+        data['name'] = 'monthly'
+        self.assertEqual(self.client.post('/api/shopping-list/%d' % shoppingList.id, data, format='json', HTTP_IF_MATCH=etag).status_code, 412)
+        self.assertEqual(ShoppingList.objects.get(pk=shoppingList.id).name, 'weekly')
+
+class ResponseCacheTests(ApiTransactionTestCase):
+
+    def setUp(self):
+        super(ResponseCacheTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+
+    def tearDown(self):
+        ResponseCache.store = None
+
+    def hits(self):
+        stats = ResponseCache.stats()
+        return (stats['hits'], stats['misses'])
+
+    def test_responses_are_served_from_the_cache_until_the_data_changes(self):
+        hits, misses = self.hits()
+        self.client.get('/api/shops')
+        queries, response = self.countQueries(lambda: self.client.get('/api/shops'))
+
+        self.assertEqual(self.hits(), (hits + 1, misses + 1))
+        # Only the versions of the user (ETag) and of its shops are read
+        self.assertEqual(queries, 2)
+
+        shop = Shop.objects.get(user=self.user)
+        self.client.post('/api/shop/%d' % shop.id, {'id': shop.id, 'name': 'renamed'}, format='json')
+
+        self.assertEqual([shop['name'] for shop in self.content(self.client.get('/api/shops'))], ['renamed'])
+        self.assertEqual(self.hits(), (hits + 1, misses + 2))
+
+    def test_changes_of_other_kinds_of_objects_keep_the_responses(self):
+        self.client.get('/api/shops')
+        recipe = Recipe.objects.get(user=self.user)
+        self.client.get('/api/recipe/%d' % recipe.id)
+        hits, misses = self.hits()
+
+        self.client.post('/api/location/_', {'name': 'fruits', 'shop': Shop.objects.get(user=self.user).id}, format='json')
+        self.client.get('/api/shops')
+        self.assertEqual(self.hits(), (hits + 1, misses))
+
+        # The recipe shows the ingredients, whose deletion removes them from the recipe
+        Ingredient.objects.get(user=self.user, name='milk').delete()
+        self.assertEqual(len(self.content(self.client.get('/api/recipe/%d' % recipe.id))['recipe_ingredients']), 2)
+        self.assertEqual(self.hits(), (hits + 1, misses + 1))
+
+    def test_pruned_deletions_do_not_bring_back_old_responses(self):
+        shop = self.client.post('/api/shop/_', {'id': '_', 'name': 'market'}, format='json').data
+        myShop = Shop.objects.get(user=self.user, name='My shop')
+        self.client.post('/api/shop/%d' % myShop.id, {'id': myShop.id, 'name': 'renamed'}, format='json')
+        self.assertEqual(len(self.content(self.client.get('/api/shops'))), 2)
+        self.client.delete('/api/shop/%d' % shop['id'])
+        self.assertEqual(len(self.content(self.client.get('/api/shops'))), 1)
+
+        # Without its tombstone, the last change of the shops is the one of the response with two shops
+        Change.objects.filter(deleted=True).update(changed=timezone.now() - timedelta(days=60))
+        Changes.prune(30)
+
+        self.assertEqual(len(self.content(self.client.get('/api/shops'))), 1)
+
+    def test_changes_made_elsewhere_are_seen(self):
+        self.assertEqual(len(self.content(self.client.get('/api/ingredients'))), 3)
+
+        # e.g. by another process, which only shares the database
+        Ingredient.objects.create(name='tea', user=self.user)
+
+        self.assertEqual(len(self.content(self.client.get('/api/ingredients'))), 4)
+
+    def test_responses_are_cached_per_user_and_url(self):
+        otherUser, otherClient = self.createClient('other')
+        Recipe.objects.create(name='theirs', category='c', description='', user=otherUser)
+        self.client.get('/api/recipes')
+
+        self.assertEqual(len(self.content(otherClient.get('/api/recipes'))), 2)
+        self.assertEqual(len(self.content(self.client.get('/api/recipes'))), 1)
+        recipe = Recipe.objects.get(user=self.user)
+        self.assertEqual(self.content(self.client.get('/api/recipe/%d' % recipe.id))['name'], 'cappuccino')
+
+    def test_responses_read_in_a_batch_are_not_cached(self):
+        hits, misses = self.hits()
+
+        response = self.client.post('/api/batch', {'requests': [
+            {'method': 'POST', 'url': '/api/shop/_', 'body': {'id': '_', 'name': 'market'}},
+            {'method': 'GET', 'url': '/api/shops'},
+        ]}, format='json')
+
+        self.assertEqual(len(response.data['responses'][1]['body']), 2)
+        self.assertEqual(self.hits(), (hits, misses))
+
+    def test_file_store(self):
+        root = tempfile.mkdtemp()
+        try:
+            with override_settings(RESPONSE_CACHE_BACKEND='file', RESPONSE_CACHE_ROOT=root):
+                ResponseCache.store = None
+                first = self.client.get('/api/locations')
+                self.assertEqual(len(os.listdir(root)), 1)
+                self.assertEqual(self.client.get('/api/locations').content, first.content)
+        finally:
+            shutil.rmtree(root)
+
+    def test_per_process_cache_is_refused_when_a_shared_one_is_required(self):
+        with override_settings(SHARED_CACHE_REQUIRED=True):
+            self.assertRaises(ImproperlyConfigured, SharedCache.check)
+        with override_settings(SHARED_CACHE_REQUIRED=True, CACHES={'default': {'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache'}}):
+            SharedCache.check()
+
+class CompressionTests(ApiTransactionTestCase):
+
+    def setUp(self):
+        super(CompressionTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        for i in range(50):
+            Recipe.objects.create(name='recipe %d' % i, category='c', description='', user=self.user)
+
+    def tearDown(self):
+        ResponseCache.store = None
+
+    def test_large_responses_are_compressed_once(self):
+        plain = self.client.get('/api/recipes')
+        compressions = ResponseCache.stats()['compressions']
+
+        for attempt in range(2):
+            response = self.client.get('/api/recipes', HTTP_ACCEPT_ENCODING='gzip')
+
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(zlib.decompress(response.content, 16 + zlib.MAX_WBITS), plain.content)
+            self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+            self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(ResponseCache.stats()['compressions'], compressions + 1)
+
+    def test_small_responses_and_unsupported_encodings_are_not_compressed(self):
+        self.assertFalse(self.client.get('/api/recipes', HTTP_ACCEPT_ENCODING='compress').has_header('Content-Encoding'))
+        self.assertFalse(self.client.get('/api/recipes', HTTP_ACCEPT_ENCODING='gzip;q=0').has_header('Content-Encoding'))
+        self.assertFalse(self.client.get('/api/shops', HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'))
+
+    def test_compressed_responses_are_revalidated(self):
+        etag = self.client.get('/api/recipes', HTTP_ACCEPT_ENCODING='gzip')['ETag']
+
+        self.assertEqual(self.client.get('/api/recipes', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_encodings_are_negotiated(self):
+        self.assertEqual(Compression.negotiate('gzip, deflate'), 'gzip')
+        self.assertEqual(Compression.negotiate('*'), Compression.available()[0])
+        others = [encoding for encoding in Compression.available() if encoding != 'gzip']
+        self.assertEqual(Compression.negotiate('gzip;q=0, *;q=0.5'), others[0] if others else None)
+        self.assertEqual(Compression.negotiate('identity'), None)
+        self.assertEqual(Compression.negotiate(''), None)
+
+#---------------------------------------------------------------------------------------- Collections
+
+class CollectionTests(ApiTransactionTestCase):
+
+    def setUp(self):
+        super(CollectionTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.otherUser, self.otherClient = self.createClient('other')
+
+        # A collection with objects of every kind referring to each other
+        shop = self.client.post('/api/shop/_', {'id': '_', 'name': 'market'}, format='json').data
+        location = self.client.post('/api/location/_', {'name': 'fruits', 'shop': shop['id']}, format='json').data
+        apple = self.client.put('/api/ingredientbyname/apple').data
+        self.client.post('/api/ingredient/%d' % apple['id'], {'id': apple['id'], 'name': 'apple', 'locations': [location['id']]}, format='json')
+        milk = Ingredient.objects.get(user=self.user, name='milk')
+        pie = self.client.post('/api/recipe/_', recipeData('pie', [(apple['id'], 'pc', 3), (milk.id, 'ml', 50.5)], category='cakes', serves=4), format='json').data
+        shoppingList = self.client.post('/api/shopping-list/_', {'id': '_', 'name': 'party', 'items': [
+            {'id': '_1', 'unit': 'serve', 'quantity': 8, 'ingredient': None, 'recipe': {'id': pie['id']}},
+            {'id': '_2', 'unit': 'kg', 'quantity': 1, 'ingredient': apple['id'], 'recipe': None},
+        ]}, format='json').data
+        ShoppingList.objects.filter(pk=shoppingList['id']).update(name='party', date=date(2016, 10, 10))
+        self.client.post('/api/shop/current', {'id': shop['id']}, format='json')
+
+    def export(self, client):
+        response = client.get('/api/collection/export')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return b''.join(response.streaming_content)
+
+    def collection(self, client):
+        # The exported objects, with the references replaced by names (ids differ between users)
+        objects = {}
+        for line in self.export(client).decode('utf-8').splitlines():
+            data = json.loads(line)
+            objects.setdefault(data.pop('type'), []).append(data)
+        names = dict((kind, dict((obj['id'], obj['name']) for obj in objects.get(kind, []))) for kind in ('shop', 'location', 'ingredient', 'recipe'))
+        shoppingLists = dict((shoppingList['id'], (shoppingList['name'], shoppingList['date'])) for shoppingList in objects['shoppingList'])
+        profile = objects['profile'][0]
+        return {
+            'shops': sorted(names['shop'].values()),
+            'locations': sorted((location['name'], names['shop'][location['shop']]) for location in objects.get('location', [])),
+            'ingredients': sorted((ingredient['name'], sorted(names['location'][locationId] for locationId in ingredient['locations'])) for ingredient in objects['ingredient']),
+            'recipes': sorted((recipe['name'], recipe['category'], recipe['duration'], recipe['serves'], recipe['description'],
+                               sorted((names['ingredient'][recipeIngredient['ingredient']], recipeIngredient['unit'], recipeIngredient['quantity']) for recipeIngredient in recipe['ingredients']))
+                              for recipe in objects['recipe']),
+            'shoppingLists': sorted((shoppingList['name'], shoppingList['date'],
+                                     sorted((names['recipe'].get(item['recipe']), names['ingredient'].get(item['ingredient']), item['unit'], item['quantity']) for item in shoppingList['items']))
+                                    for shoppingList in objects['shoppingList']),
+            'profile': (names['shop'][profile['shop']], shoppingLists[profile['shoppingList']]),
+        }
+
+    def importCollection(self, client, body):
+        return client.post('/api/collection/import', data=body, content_type='application/x-ndjson')
+
+    def test_export_and_import_round_trip(self):
+        exported = self.collection(self.client)
+        before = self.collection(self.otherClient)
+
+        response = self.importCollection(self.otherClient, self.export(self.client))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['recipe'], 2)
+        self.assertEqual(response.data['ingredient'], 1)
+        imported = self.collection(self.otherClient)
+        self.assertEqual(imported['shops'], sorted(exported['shops'] + before['shops']))
+        self.assertEqual(imported['locations'], exported['locations'])
+        self.assertEqual(imported['ingredients'], exported['ingredients'])
+        self.assertEqual(imported['recipes'], sorted(exported['recipes'] + before['recipes']))
+        self.assertEqual(imported['shoppingLists'], sorted(exported['shoppingLists'] + before['shoppingLists']))
+        self.assertEqual(imported['profile'], ('market', ('party', '2016-10-10')))
+
+    def test_imported_data_is_indexed_and_counted(self):
+        self.assertEqual(self.otherClient.get('/api/recipes/cook', {'ingredients': Ingredient.objects.get(user=self.otherUser, name='milk').id}).data[0]['name'], 'cappuccino')
+        self.assertEqual(self.otherClient.get('/api/ingredients/complete', {'q': 'app'}).data, [])
+        syncCursor = self.otherClient.get('/api/sync').data['cursor']
+
+        self.importCollection(self.otherClient, self.export(self.client))
+
+        milk = Ingredient.objects.get(user=self.otherUser, name='milk')
+        self.assertEqual(sorted(recipe['name'] for recipe in self.otherClient.get('/api/recipes/cook', {'ingredients': milk.id}).data), ['cappuccino', 'cappuccino', 'pie'])
+        self.assertEqual([ingredient['name'] for ingredient in self.otherClient.get('/api/ingredients/complete', {'q': 'app'}).data], ['apple'])
+        self.assertEqual(self.otherClient.get('/api/recipes/search', {'q': 'pie'}).data['count'], 1)
+        self.assertEqual(Statistics.read(self.otherUser.id), Statistics.compute(self.otherUser.id))
+        self.assertEqual(len(self.otherClient.get('/api/sync', {'since': syncCursor}).data['recipes']), 2)
+
+    def test_invalid_collections_are_not_imported(self):
+        lines = self.export(self.client).splitlines(True)
+        recipes = Recipe.objects.filter(user=self.otherUser).count()
+        invalid = [line for line in lines if b'"type":"recipe"' in line][0].replace(b'"serves":4', b'"serves":"four"')
+
+        response = self.importCollection(self.otherClient, b''.join([line if b'"name":"pie"' not in line else invalid for line in lines]))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['line'], [number for number, line in enumerate(lines, 1) if b'"name":"pie"' in line][0])
+        self.assertEqual(Recipe.objects.filter(user=self.otherUser).count(), recipes)
+        self.assertFalse(Shop.objects.filter(user=self.otherUser, name='market').exists())
+        self.assertEqual(self.importCollection(self.otherClient, b'{"type":"recipe","name":"x","ingredients":[{"ingredient":1}]}\n').status_code, 400)
+        self.assertEqual(self.importCollection(self.otherClient, b'{"type":"shoppingList","date":"10.10.2016"}\n').status_code, 400)
+
+    def test_merged_ingredients_get_each_location_once(self):
+        body = b''.join(json.dumps(line).encode('utf-8') + b'\n' for line in [
+            {'type': 'shop', 'id': 1, 'name': 'market'},
+            {'type': 'location', 'id': 2, 'name': 'dairy', 'shop': 1},
+            {'type': 'ingredient', 'id': 3, 'name': 'milk', 'locations': [2, 2]},
+            {'type': 'ingredient', 'id': 4, 'name': 'milk', 'locations': [2]},
+        ])
+
+        self.assertEqual(self.importCollection(self.otherClient, body).status_code, 201)
+
+        milk = Ingredient.objects.get(user=self.otherUser, name='milk')
+        self.assertEqual(list(IngredientLocation.objects.filter(ingredient=milk).values_list('location__name', flat=True)), ['dairy'])
+
+    def test_profiles_are_created_when_missing(self):
+        UserProfile.objects.filter(user=self.otherUser).delete()
+
+        response = self.importCollection(self.otherClient, self.export(self.client))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(UserProfile.objects.get(user=self.otherUser).shop.name, 'market')
+
+    def test_large_collections_are_refused(self):
+        body = self.export(self.client)
+
+        with override_settings(COLLECTION_IMPORT_MAX_BYTES=len(body) - 1):
+            self.assertEqual(self.importCollection(self.otherClient, body).status_code, 413)
+        with override_settings(COLLECTION_IMPORT_MAX_LINES=3):
+            response = self.importCollection(self.otherClient, body)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['line'], 4)
+        self.assertFalse(Shop.objects.filter(user=self.otherUser, name='market').exists())
+
+    def test_large_collections_are_spooled_to_disk(self):
+        body = self.export(self.client)
+
+        with override_settings(COLLECTION_IMPORT_SPOOL_SIZE=16):
+            spooled = CollectionImport.spool(io.BytesIO(body), len(body), 1000)
+        with spooled:
+            self.assertTrue(spooled._rolled)
+            self.assertEqual(spooled.read(), body)
+
+#---------------------------------------------------------------------------------------- Statistics
+
+class StatsTests(ApiTestCase):
+
+    def setUp(self):
+        super(StatsTests, self).setUp()
+        self.user, self.client = self.createClient('jhon')
+        self.ingredients = dict((ingredient.name, ingredient.id) for ingredient in Ingredient.objects.filter(user=self.user))
+
+    def stats(self, live=False):
+        stats = self.content(self.client.get('/api/stats?live=true' if live else '/api/stats'))
+        stats['recipes'] = sorted((row['category'], row['recipes']) for row in stats['recipes'])
+        stats['ingredients'] = sorted((row['ingredient'], row['recipes']) for row in stats['ingredients'])
+        return stats
+
+    def test_counters_of_new_user(self):
+        stats = self.stats()
+
+        self.assertEqual(stats['recipe_number'], 1)
+        self.assertEqual(stats['recipes'], [('other', 1)])
+        self.assertEqual(stats['ingredient_number'], 3)
+        self.assertEqual(stats['ingredients'], [('coffee', 1), ('milk', 1), ('sugar', 1)])
+        self.assertEqual(stats['shoppingList_number'], 1)
+
+    def test_counters_match_the_data_after_changes(self):
+        created = self.client.post('/api/recipe/_', recipeData('tea', [(self.ingredients['milk'], 'ml', 50), (self.ingredients['sugar'], 'tl', 1)], category='drinks'), format='json').data
+        self.client.put('/api/ingredientbyname/lemon')
+        lemon = Ingredient.objects.get(user=self.user, name='lemon').id
+
+        created['category'] = 'hot drinks'
+        created['recipe_ingredients'] = [dict(recipeIngredient) for recipeIngredient in created['recipe_ingredients']
+                                         if recipeIngredient['ingredient'] == self.ingredients['milk']]
+        created['recipe_ingredients'].append({'id': '_1', 'ingredient': lemon, 'unit': 'pc', 'quantity': 1})
+        self.client.post('/api/recipe/%d' % created['id'], created, format='json')
+        self.client.delete('/api/recipe/%d' % Recipe.objects.get(user=self.user, name='cappuccino').id)
+        self.client.post('/api/shopping-list/_', {'id': '_', 'name': 'next', 'items': []}, format='json')
+
+        stats = self.stats()
+
+        self.assertEqual(stats, self.stats(live=True))
+        self.assertEqual(stats['recipes'], [('hot drinks', 1)])
+        self.assertEqual(stats['ingredients'], [('coffee', 0), ('lemon', 1), ('milk', 1), ('sugar', 0)])
+        self.assertEqual(stats['shoppingList_number'], 2)
+
+    def test_missing_counters_are_rebuilt(self):
+        UserStatistic.objects.filter(user=self.user).delete()
+
+        self.assertEqual(self.stats(), self.stats(live=True))
+        self.assertTrue(UserStatistic.objects.filter(user=self.user).exists())
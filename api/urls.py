@@ -8,14 +8,20 @@ router = routers.DefaultRouter()
 urlpatterns = [
     url(r'^auth/login', views.LoginEp),
     url(r'^auth/signup', views.SignUpEp),
+    url(r'^auth/access-token', views.AccessTokenEp),
     url(r'^auth/logout', views.LogoutEp),
     url(r'^auth/closeup', views.CloseUpEp),
     url(r'^auth/password-reset', views.PassResetEp),
     url(r'^auth/request-password-reset', views.PassResetRequestEp),
+    url(r'^recipes/search', views.RecipeSearchEp.as_view()),
+    url(r'^recipes/cook', views.CookableRecipesEp.as_view()),
     url(r'^recipes', views.RecipeListEp.as_view()),
     url(r'^recipe/(?P<recipeId>[_0-9]+)', views.RecipeEp.as_view()),
     url(r'^shopping-list/(?P<shoppingListId>[_0-9]+)/recipe/(?P<recipeId>[0-9]+)', views.ShoppingRecipeItemEp.as_view()),
+    url(r'^shopping-list/(?P<shoppingListId>[_0-9]+)/consolidated', views.ConsolidatedShoppingListEp.as_view()),
     url(r'^shopping-list/(?P<shoppingListId>[_0-9]+)', views.ShoppingListEp.as_view()),
+    url(r'^image/(?P<imageId>[_0-9a-f]+)(?:/(?P<size>[0-9]+))?', views.ImageEp.as_view()),
+    url(r'^ingredients/complete', views.IngredientCompletionEp.as_view()),
     url(r'^ingredients', views.IngredientListEp.as_view()),  
     url(r'^ingredient/(?P<ingredientId>[_0-9]+)', views.IngredientEp.as_view()),
     url(r'^ingredientbyname/(?P<ingredientName>.+)', views.IngredientByNameEp.as_view()),
@@ -25,5 +31,10 @@ urlpatterns = [
     url(r'^locations', views.LocationListEp.as_view()), 
     url(r'^location/(?P<locationId>[_0-9]+)', views.LocationEp.as_view()),
     url(r'^stats', views.StatsEp.as_view()),
+    url(r'^cache-stats', views.CacheStatsEp.as_view()),
+    url(r'^batch', views.BatchEp.as_view()),
+    url(r'^sync', views.SyncEp.as_view()),
+    url(r'^collection/export', views.CollectionExportEp.as_view()),
+    url(r'^collection/import', views.CollectionImportEp.as_view()),
     url(r'^', include(router.urls)),    
 ]
\ No newline at end of file
@@ -1,54 +1,58 @@
-from .models import Recipe, RecipeIngredient, Ingredient, UserProfile, ShoppingList, Shop
 from django.contrib.auth.models import User
+from django.db import transaction, connections
+from django.db.models import Case, When, Value
 
 
 class Utils(object):
 
     @staticmethod
     def createUser(username, email, password):
-        user = User.objects.create_user(username, email, password)
-        user.save()
-
-        #--- Create Ingredients
-        coffee = Ingredient(name='coffee', user=user)
-        coffee.save()
-
-        sugar = Ingredient(name='sugar', user=user)
-        sugar.save()
-
-        milk = Ingredient(name='milk', user=user)
-        milk.save()
-
-        #--- Create Recipe
-        cappuccino = Recipe(name='cappuccino', category='', duration=10, serves=2, user=user)
-        cappuccino.description = 'Make an expresso. Make milk foam. Add foam to expresso. Add warm milk. Add sugar topping.'
-        cappuccino.save()
-
-        #--- Add ingredients to recipe
-        r_coffee = RecipeIngredient(unit='tl', quantity='4', recipe=cappuccino, ingredient=coffee)
-        r_coffee.save()
-
-        r_sugar = RecipeIngredient(unit='tl', quantity='2', recipe=cappuccino, ingredient=sugar)
-        r_sugar.save()
-
-        r_milk = RecipeIngredient(unit='ml', quantity='150', recipe=cappuccino, ingredient=milk)
-        r_milk.save()
-
-        #--- Create ShoppingList
-        shoppingList = ShoppingList(user=user)
-        shoppingList.save()
-
-        #--- Create Shop
-        shop = Shop(user=user)
-        shop.name = 'My shop'
-        shop.save()
-
-        # --- Create UserProfile
-        userProfile = UserProfile(user=user, shoppingList=shoppingList, shop=shop)
-        userProfile.save()
+        # The user and its starter data (see starterkit.json) are created together, or not at all
+        from .starterkit import StarterKit
+        with transaction.atomic():
+            user = User.objects.create_user(username, email, password)
+            StarterKit.create(user)
+        return user
 
     @staticmethod
     def deleteUser(username):
+        # The user is deactivated at once, its data is purged in the background (see deletion.py)
+        from .deletion import UserDeletions
         user = User.objects.get(username = username)
-        user.delete()
+        return UserDeletions.schedule(user)
+
+    @staticmethod
+    def bulkUpdate(model, objs, fields):
+        # Update the given fields of several rows with a single UPDATE statement (one CASE per field)
+        if not objs:
+            return
+        values = {}
+        for fieldName in fields:
+            field = model._meta.get_field(fieldName)
+            outputField = field.target_field if field.is_relation else field
+            values[field.attname] = Case(
+                *[When(pk=obj.pk, then=Value(getattr(obj, field.attname))) for obj in objs],
+                output_field=outputField
+            )
+        model.objects.filter(pk__in=[obj.pk for obj in objs]).update(**values)
+
+    @staticmethod
+    def bulkDelete(queryset, chunkSize=500):
+        # Delete the rows with plain DELETE statements, without collecting them or sending signals.
+        # queryset.delete() would load the rows and send pre/post_delete for each of them, which the
+        # callers do not want: they only delete rows no other model refers to (nothing to cascade)
+        # and keep what is derived from them (e.g. the statistics) up to date themselves.
+        model = queryset.model
+        connection = connections[queryset.db]
+        quoteName = connection.ops.quote_name
+        ids = list(queryset.values_list('pk', flat=True))
+        deleted = 0
+        with connection.cursor() as cursor:
+            for start in range(0, len(ids), chunkSize):
+                chunk = ids[start:start + chunkSize]
+                cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+                    quoteName(model._meta.db_table), quoteName(model._meta.pk.column), ', '.join(['%s'] * len(chunk))
+                ), chunk)
+                deleted += cursor.rowcount
+        return deleted
 
@@ -0,0 +1,133 @@
+import re
+import functools
+
+from .models import Change
+from .changes import Changes
+from .profiles import UserProfiles
+
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class Versions():
+    """
+    Versions of the data of a user, for conditional requests.
+
+    The version of a user is its last change number and the version of an object the number
+    of its last change (see changes.py), so every write to the user's recipes, ingredients,
+    shopping lists and items, shops, locations or profile changes them. Read endpoints send
+    ETags '"<user>-<user version>[-<object kind><object version>]"' and answer If-None-Match
+    with 304 Not Modified before doing anything else. The user version is read once per request.
+    Cached responses (see responses.py) are looked up with the version of the kinds of objects
+    they show, read after the user version: a body is never older than its ETag. The object
+    version drives If-Match on writes.
+    """
+
+    OBJECT_VERSION = re.compile(r'^(?:W/)?"\d+-\d+-([a-zA-Z]+)(\d+)"$')
+
+    @staticmethod
+    def user(userId):
+        return Changes.current(userId)
+
+    @staticmethod
+    def state(request):
+        # (user version, change number up to which deletions were pruned) of the request, read once
+        state = getattr(request, '_userState', None)
+        if state is None:
+            state = Changes.state(request.user.id)
+            request._userState = state
+        return state
+
+    @staticmethod
+    def current(request):
+        return Versions.state(request)[0]
+
+    @staticmethod
+    def kinds(request, kinds):
+        # The number of the last change of the user's objects of the given kinds, with the number up
+        # to which deletions were pruned: pruning may remove the last change of the kinds
+        last = Change.objects.filter(user_id=request.user.id, kind__in=kinds).order_by('-sequence').values_list('sequence', flat=True).first()
+        return '%s.%s' % (last or 0, Versions.state(request)[1])
+
+    @staticmethod
+    def object(userId, kind, objectId):
+        version = Change.objects.filter(user_id=userId, kind=kind, objectId=objectId).values_list('sequence', flat=True).first()
+        return version or 0
+
+    @staticmethod
+    def etag(userId, userVersion, kind=None, objectVersion=None):
+        if kind is None:
+            return '"%s-%s"' % (userId, userVersion)
+        return '"%s-%s-%s%s"' % (userId, userVersion, kind, objectVersion)
+
+    @staticmethod
+    def lock(userId):
+        # No change of the user can be committed meanwhile (until the end of the transaction),
+        # the sequence row is created first if the user has no change yet
+        Changes.lock(userId)
+
+    @staticmethod
+    def ifMatch(request, kind, objectId):
+        # False if the request is conditional and the object changed since the client's version.
+        # To be called in the transaction of the write, which then cannot be preceded by another one.
+        header = request.META.get('HTTP_IF_MATCH')
+        if not header or header.strip() == '*':
+            return True
+        userId = request.user.id
+        Versions.lock(userId)
+        currentVersion = Versions.object(userId, kind, objectId)
+        for etag in header.split(','):
+            match = Versions.OBJECT_VERSION.match(etag.strip())
+            if match and match.group(1) == kind and int(match.group(2)) == currentVersion:
+                return True
+        return False
+
+    @staticmethod
+    def preconditionFailed():
+        return Response('The object was changed meanwhile', status=status.HTTP_412_PRECONDITION_FAILED)
+
+    @staticmethod
+    def setETag(response, etag):
+        # Compressed payloads are not byte-identical to the version, their ETag is weak
+        response['ETag'] = ('W/' + etag) if response.has_header('Content-Encoding') else etag
+        # Clients have to revalidate, shared caches must not keep the data
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @staticmethod
+    def objectId(request, kind, objectId):
+        # '_' stands for the current shopping list
+        if (objectId == '_') and (kind == Changes.SHOPPING_LIST):
+            return UserProfiles.get(request).shoppingList_id
+        try:
+            return int(objectId)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def conditional(kind=None, objectIdArg=None):
+        """
+        Decorator of APIView.get methods: ETag and If-None-Match handling.
+        With a kind, the version of the object whose id is the objectIdArg url argument is added to the ETag.
+        """
+        def decorator(get):
+            @functools.wraps(get)
+            def conditionalGet(self, request, *args, **kwargs):
+                userId = request.user.id
+                if kind is None:
+                    etag = Versions.etag(userId, Versions.current(request))
+                else:
+                    objectId = Versions.objectId(request, kind, kwargs.get(objectIdArg))
+                    objectVersion = 0 if objectId is None else Versions.object(userId, kind, objectId)
+                    etag = Versions.etag(userId, Versions.current(request), kind, objectVersion)
+
+                ifNoneMatch = request.META.get('HTTP_IF_NONE_MATCH', '')
+                if etag in [value.strip().replace('W/', '', 1) for value in ifNoneMatch.split(',')]:
+                    return Versions.setETag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+                response = get(self, request, *args, **kwargs)
+                if response.status_code == status.HTTP_200_OK:
+                    Versions.setETag(response, etag)
+                return response
+            return conditionalGet
+        return decorator
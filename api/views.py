@@ -1,8 +1,23 @@
 from .models import Recipe, RecipeIngredient, Ingredient, ShoppingList, ShoppingItem, UserProfile, IngredientLocation, Shop, Location
-from .serializers import ShortRecipeSerializer, RecipeSerializer, FullRecipeSerializer, IngredientSerializer, ShoppingListSerializer, IngredientLocationSerializer, ShopSerializer, LocationSerializer
+from .serializers import ShortRecipeSerializer, RecipeSerializer, FullRecipeSerializer, IngredientSerializer, ShoppingListSerializer, CompactShoppingListSerializer, IngredientLocationSerializer, IngredientCatalogueSerializer, ShopSerializer, LocationSerializer
 from .permissions import IsOwner
-from .authentications import CsrfExemptTokenAuthentication, CsrfExemptSessionAuthentication
+from .authentications import CsrfExemptTokenAuthentication, CsrfExemptSessionAuthentication, CachedBasicAuthentication, TokenCache, AccessTokens, BasicCredentialCache
 from .utils import Utils
+from .images import imageStore, UserImages
+from .consolidation import ConsolidatedShoppingList
+from .statistics import Statistics
+from .profiles import UserProfiles
+from .outbox import Outbox
+from .deletion import UserDeletions
+from .search import SearchIndex
+from .pantry import PantryIndex
+from .autocomplete import IngredientIndex
+from .batch import Batch, BatchError
+from .sync import Sync
+from .changes import Changes
+from .versions import Versions
+from .responses import ResponseCache
+from .collection import CollectionExport, CollectionImport, CollectionImportError
 from .site import Site
 
 from django.views.decorators.csrf import csrf_exempt
@@ -12,30 +27,28 @@ from django.contrib.auth.models import User
 
 from django.shortcuts import get_object_or_404
 
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError
 from django.db.models import Model
 
 from rest_framework.authtoken.models import Token
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import viewsets
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view, authentication_classes
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.authentication import BasicAuthentication
 from rest_framework.renderers import JSONRenderer
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+
+import re
 
-import socket
-import smtplib
-from email.mime.text import MIMEText
-from email.header import Header
-from email.utils import formataddr
  
 #{"username":"jhon","password":"papa"} 
 
 @api_view(['POST'])
 @csrf_exempt
-@authentication_classes((CsrfExemptTokenAuthentication, CsrfExemptSessionAuthentication, BasicAuthentication))
+@authentication_classes((CsrfExemptTokenAuthentication, CsrfExemptSessionAuthentication, CachedBasicAuthentication))
 def LoginEp(request):
     username = request.data['username']
     password = request.data['password']
@@ -44,7 +57,7 @@ def LoginEp(request):
         if user.is_active:
             login(request, user)
             token = Token.objects.get_or_create(user=user)
-            return Response(token[0].key, status=status.HTTP_200_OK)
+            return ViewUtils.loginResponse(request, user, token[0])
         else:
             return Response('Account has been disabled', status=status.HTTP_403_FORBIDDEN)            
     else:
@@ -52,7 +65,7 @@ def LoginEp(request):
 
 @api_view(['POST'])
 @csrf_exempt
-@authentication_classes((CsrfExemptTokenAuthentication, CsrfExemptSessionAuthentication, BasicAuthentication))
+@authentication_classes((CsrfExemptTokenAuthentication, CsrfExemptSessionAuthentication, CachedBasicAuthentication))
 def SignUpEp(request):
 
     sigunpRequest = request.data
@@ -67,25 +80,50 @@ def SignUpEp(request):
 
     if (password != confirmPassword):
         return Response('The provided passwords are not identical', status=status.HTTP_400_BAD_REQUEST)
-    if UserProfile.objects.filter(user__username=username).exists():
+    # The user row of a closed account is kept until its data is purged (see deletion.py)
+    if User.objects.filter(username=username).exists():
         return Response('The provided email is already in use', status=status.HTTP_400_BAD_REQUEST)
 
-    Utils.createUser(username, email, password)
+    try:
+        Utils.createUser(username, email, password)
+    except IntegrityError:
+        # Signed up concurrently
+        return Response('The provided email is already in use', status=status.HTTP_400_BAD_REQUEST)
     user = authenticate(username=username, password=password)
     if user is not None:
         if user.is_active:
             login(request, user)
             token = Token.objects.get_or_create(user=user)
-            return Response(token[0].key, status=status.HTTP_200_OK)
+            return ViewUtils.loginResponse(request, user, token[0])
         else:
             return Response('Account has been disabled', status=status.HTTP_403_FORBIDDEN)
     else:
         return Response('Invalid login combination', status=status.HTTP_401_UNAUTHORIZED)
 
+# Exchange a refresh token (the token returned at login) for a signed access token
+@api_view(['POST'])
+@authentication_classes([])
+def AccessTokenEp(request):
+
+    accessTokenRequest = request.data
+
+    if not ViewUtils.isValidAccessTokenRequest(accessTokenRequest) or not ('refresh' in accessTokenRequest):
+        return Response('Invalid access token request', status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        token = Token.objects.select_related('user').get(key=accessTokenRequest['refresh'])
+    except Token.DoesNotExist:
+        return Response('Invalid refresh token', status=status.HTTP_401_UNAUTHORIZED)
+    if not token.user.is_active:
+        return Response('Account has been disabled', status=status.HTTP_403_FORBIDDEN)
+
+    return Response({'access': AccessTokens.create(token.user, token.key), 'expires': AccessTokens.lifetime()}, status=status.HTTP_200_OK)
+
 @api_view(['GET'])
 def LogoutEp(request):
     if request.user.is_authenticated():
         token = Token.objects.get_or_create(user=request.user)
+        TokenCache.revoke(token[0].key)
         token[0].delete()
     logout(request)
     return Response('User logged out', status=status.HTTP_200_OK)
@@ -93,11 +131,10 @@ def LogoutEp(request):
 @api_view(['GET'])
 def CloseUpEp(request):
     user = request.user
-    if request.user.is_authenticated():
-        token = Token.objects.get_or_create(user=request.user)
-        token[0].delete()
     logout(request)
-    user.delete()
+    if user.is_authenticated():
+        # Deactivated (and its tokens revoked) at once, the data is purged by the deletion worker
+        UserDeletions.schedule(user)
 
     return Response('User account closed', status=status.HTTP_200_OK)
 
@@ -129,6 +166,8 @@ def PassResetEp(request):
     user = User.objects.get(username=username)
     user.set_password(password)
     user.save()
+    TokenCache.revokeUser(user)
+    BasicCredentialCache.revoke(user.username)
 
     return Response('OK', status=status.HTTP_200_OK)
 
@@ -156,16 +195,8 @@ http://%s/#/reset/%s/%s
     emailMessage = emailMessage %(Site.serverHttpIp, username, token[0].key)
     #print emailMessage
 
-    msg = MIMEText(emailMessage)
-    msg['Subject'] = 'Password reset request'
-    msg['From'] = formataddr((str(Header(Site.serverFromName, 'utf-8')), Site.serverFromEmail))
-    msg['To'] = user.email
-
-    emailServer = smtplib.SMTP(socket.gethostbyname(Site.serverSmtp), Site.serverPort, socket.gethostbyname('recipicon.com'))
-    emailServer.starttls()
-    emailServer.login(Site.serverFromEmail, Site.serverPass)
-    emailServer.sendmail(Site.serverFromEmail, [user.email], msg.as_string())
-    emailServer.quit()
+    # Sent asynchronously by the outbox worker (send_emails.py)
+    Outbox.enqueue(user.email, 'Password reset request', emailMessage)
 
     return Response('OK', status=status.HTTP_200_OK)
 
@@ -173,34 +204,72 @@ http://%s/#/reset/%s/%s
 class RecipeListEp(APIView):
     permission_classes = (IsAuthenticated,IsOwner)
     
+    @Versions.conditional()
+    @ResponseCache.cached(Changes.RECIPE, Changes.SHOPPING_LIST, Changes.PROFILE)
     def get(self, request, format=None):    
         user = self.request.user
-        recipes = user.recipes.all()
-        recipeIds = [recipe.id for recipe in recipes]
         
-        # Recipes have to be marked to indicate whether they are included in the current shopping ist or not
-        # To this end, the shooping liist is retrieved first from the user profile
-        # Then the set of recipe ids in the current shopping list is computed.
-        # Based n this set the previously retrieved recipes are marked appropriately.
-
-        userProfile = get_object_or_404(UserProfile,user__username=user.username)
-        shoppingList = userProfile.shoppingList
-        items = shoppingList.items.filter(recipe_id__in = recipeIds)
-        selectedRecipeIds = set([item.recipe.id for item in items])
-
-        for recipe in recipes:
-            if recipe.id in selectedRecipeIds:
-                recipe.in_shopping_list = True
-            else:
-                recipe.in_shopping_list = False
+        # Recipes have to be marked to indicate whether they are included in the current shopping list or not
+        # The mark is computed by the database as an EXISTS subquery over the items of the shopping list
+        # registered in the user profile, so the number of queries does not depend on the number of recipes
+        # or shopping items. The rows are serialized directly, without building model instances.
+
+        recipes = user.recipes.extra(
+            select = {'in_shopping_list': ViewUtils.inCurrentShoppingListSql()},
+            select_params = (user.id,)
+        ).values('id', 'name', 'category', 'duration', 'in_shopping_list')
         
         serializer = ShortRecipeSerializer(recipes, many=True)
         return Response(serializer.data)   
         
+class RecipeSearchEp(APIView):
+    permission_classes = (IsAuthenticated,IsOwner)
+
+    # ?q=<words>&offset=<n>&limit=<n>, recipes ranked by relevance (see search.py)
+    @Versions.conditional()
+    def get(self, request, format=None):
+        user = self.request.user
+
+        try:
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response('Invalid paging parameters', status=status.HTTP_400_BAD_REQUEST)
+
+        count, recipeIds = SearchIndex.search(user.id, request.query_params.get('q', ''), offset, limit)
+
+        recipes = user.recipes.filter(id__in = recipeIds).extra(
+            select = {'in_shopping_list': ViewUtils.inCurrentShoppingListSql()},
+            select_params = (user.id,)
+        ).values('id', 'name', 'category', 'duration', 'in_shopping_list')
+        recipes = sorted(recipes, key=lambda recipe: recipeIds.index(recipe['id']))
+
+        serializer = ShortRecipeSerializer(recipes, many=True)
+        return Response({'count': count, 'offset': offset, 'results': serializer.data})
+
+class CookableRecipesEp(APIView):
+    permission_classes = (IsAuthenticated,IsOwner)
+
+    # ?ingredients=<id>,<id>,...&limit=<n>, recipes ranked by the share of their ingredients in the pantry
+    @Versions.conditional()
+    def get(self, request, format=None):
+        user = self.request.user
+
+        try:
+            ingredientIds = set(int(ingredientId) for ingredientId in request.query_params.get('ingredients', '').split(',') if ingredientId.strip())
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 1000)
+        except ValueError:
+            return Response('Invalid ingredients or limit', status=status.HTTP_400_BAD_REQUEST)
+
+        # Answered from the in-memory index, the database is only read when the index is (re)built
+        return Response(PantryIndex.get(user.id).cook(ingredientIds, limit))
+
 class RecipeEp(APIView):
     permission_classes = (IsAuthenticated, IsOwner,)
     
     #return recipe together with ingredients and presence in the shopping list
+    @Versions.conditional(Changes.RECIPE, 'recipeId')
+    @ResponseCache.cached(Changes.RECIPE, Changes.INGREDIENT, Changes.SHOPPING_LIST, Changes.PROFILE)
     def get(self, request, recipeId, format=None):    
         
         recipe = get_object_or_404(Recipe, pk=recipeId)
@@ -210,7 +279,7 @@ class RecipeEp(APIView):
         # The current shopping list has to be retrieved first from the user profile.
         recipe.in_shopping_list = False        
         user = self.request.user
-        userProfile = get_object_or_404(UserProfile,user__username=user.username)            
+        userProfile = UserProfiles.get(request)            
         shoppingList = userProfile.shoppingList
         items = shoppingList.items.filter(recipe_id = recipeId)
         if (len(items) == 1):
@@ -224,6 +293,7 @@ class RecipeEp(APIView):
         self.check_object_permissions(self.request, recipe)
 
         recipe.delete()
+        PantryIndex.recipeChanged(recipe.user_id, int(recipeId))
 
         return Response(status.HTTP_204_NO_CONTENT)       
     
@@ -235,84 +305,214 @@ class RecipeEp(APIView):
         newRecipe = request.data;
         if not ViewUtils.isValidRecipe(newRecipe):
             return Response('Unknown recipe data', status=status.HTTP_400_BAD_REQUEST)
+
+        # Images are kept in the image store, the recipe only references them.
+        # Clients may send either a reference or the encoded image, stored with the recipe once all is valid.
+        try:
+            imageId, imageData = UserImages.prepare(user.id, newRecipe.get('image'))
+        except ValueError as e:
+            return Response('Unknown image data: ' + str(e), status=status.HTTP_400_BAD_REQUEST)
+        
+        #------------------------------- Check ingredients
+        # All referenced ingredients are resolved at once and everything is validated before writing
+        newRecipeIngredientIds = set([])
+        for newRecipeIngredient in newRecipe['recipe_ingredients']:          
+            if not ViewUtils.isValidRecipeIngredient(newRecipeIngredient):
+                return Response('Unknown recipe ingredient data: '+ str(newRecipeIngredient), status=status.HTTP_400_BAD_REQUEST)
+            try:
+                newRecipeIngredient['ingredient'] = int(newRecipeIngredient['ingredient'])
+            except (TypeError, ValueError):
+                return Response('Unknown recipe ingredient data: '+ str(newRecipeIngredient), status=status.HTTP_400_BAD_REQUEST)
+            newRecipeIngredient['id'] = str(newRecipeIngredient['id'])
+            newRecipeIngredientIds.add(newRecipeIngredient['id'])
+
+        ingredients = Ingredient.objects.filter(user=user).in_bulk(
+            set([newRecipeIngredient['ingredient'] for newRecipeIngredient in newRecipe['recipe_ingredients']]))
         
-        #------------------------------- Update recipe            
         # recipe exists
         if (newRecipe['id'] != '_'):                       
             oldRecipe = get_object_or_404(Recipe, pk=newRecipe['id'])
             self.check_object_permissions(self.request, oldRecipe)
+            dOldRecipeIngredients = dict([(str(oldRecipeIngredient.id), oldRecipeIngredient) for oldRecipeIngredient in oldRecipe.recipe_ingredients.all()])
         # recipe is new
         else :
             oldRecipe = Recipe(user=user)
+            dOldRecipeIngredients = {}
+
+        for newRecipeIngredient in newRecipe['recipe_ingredients']:
+            if not newRecipeIngredient['ingredient'] in ingredients:
+                return Response('Unknown ingredient: '+ str(newRecipeIngredient['ingredient']), status=status.HTTP_400_BAD_REQUEST)
+            if not (newRecipeIngredient['id'].startswith('_') or newRecipeIngredient['id'] in dOldRecipeIngredients):
+                return Response('Unknown recipe ingredient: '+ newRecipeIngredient['id'], status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            # Optimistic concurrency: If-Match with the ETag of the recipe read by the client,
+            # checked in the transaction of the write (see Versions.ifMatch)
+            if (oldRecipe.id is not None) and not Versions.ifMatch(request, Changes.RECIPE, oldRecipe.id):
+                return Versions.preconditionFailed()
+
+            if imageData is not None:
+                UserImages.save(user.id, imageData)
+
+            #------------------------------- Update recipe
+            oldRecipe.name = newRecipe['name']
+            oldRecipe.category = newRecipe['category']
+            oldRecipe.description = newRecipe['description']
+            oldRecipe.serves = newRecipe['serves']
+            oldRecipe.duration = newRecipe['duration']
+            oldRecipe.image = imageId
             oldRecipe.save()
-        
-        oldRecipe.name = newRecipe['name']
-        oldRecipe.category = newRecipe['category']
-        oldRecipe.description = newRecipe['description']
-        oldRecipe.serves = newRecipe['serves']
-        oldRecipe.duration = newRecipe['duration']
-        oldRecipe.image = newRecipe['image']
-            
-        #------------------------------- Update ingredients 
-        #- Remove deleted recipe ingredient relations
-        newRecipeIngredientIds = set([])
-        for newRecipeIngredient in newRecipe['recipe_ingredients']:          
-            if not ViewUtils.isValidRecipeIngredient(newRecipeIngredient):
-                return Response('Unknown recipe ingredient data: '+ str(newRecipeIngredient), status=status.HTTP_400_BAD_REQUEST)
-            else:
-                newRecipeIngredient['id'] = str(newRecipeIngredient['id'])
-                newRecipeIngredientIds.add(newRecipeIngredient['id'])
-        #print newRecipeIngredientIds
-        
-        dOldRecipeIngredients = {}
-        for oldRecipeIngredient in oldRecipe.recipe_ingredients.all():
-            oldRecipeIngredientId = str(oldRecipeIngredient.id)
-            if not oldRecipeIngredientId in newRecipeIngredientIds:
-                oldRecipeIngredient.delete()
-            else:
-                dOldRecipeIngredients[oldRecipeIngredientId] = oldRecipeIngredient
-        
-        
-        #- Add new recipe ingredient relations
-        for newRecipeIngredient in newRecipe['recipe_ingredients']:            
-            if newRecipeIngredient['id'].startswith('_'):         
-                oldRecipeIngredient = RecipeIngredient(recipe=oldRecipe)
-            else:
-                oldRecipeIngredient = dOldRecipeIngredients[str(newRecipeIngredient['id'])]
-                      
-            oldRecipeIngredient.unit = newRecipeIngredient['unit']
-            oldRecipeIngredient.quantity = newRecipeIngredient['quantity'] 
-            oldRecipeIngredient.ingredient = Ingredient.objects.get(id=newRecipeIngredient['ingredient'], user=user)
-            oldRecipeIngredient.save()
-            
-        #------------------------------- Save recipe  
-        oldRecipe.save()
+
+            #------------------------------- Update ingredients
+            # Bulk operations do not send signals, the ingredient statistics are updated explicitly
+            ingredientDeltas = {}
+
+            #- Remove deleted recipe ingredient relations
+            removedRecipeIngredients = [oldRecipeIngredient for oldRecipeIngredientId, oldRecipeIngredient in dOldRecipeIngredients.items()
+                                        if not oldRecipeIngredientId in newRecipeIngredientIds]
+            if removedRecipeIngredients:
+                Utils.bulkDelete(RecipeIngredient.objects.filter(id__in = [oldRecipeIngredient.id for oldRecipeIngredient in removedRecipeIngredients]))
+            for oldRecipeIngredient in removedRecipeIngredients:
+                ingredientDeltas[oldRecipeIngredient.ingredient_id] = ingredientDeltas.get(oldRecipeIngredient.ingredient_id, 0) - 1
+
+            #- Add new and update existing recipe ingredient relations
+            newRecipeIngredients = []
+            updatedRecipeIngredients = []
+            for newRecipeIngredient in newRecipe['recipe_ingredients']:            
+                if newRecipeIngredient['id'].startswith('_'):         
+                    oldRecipeIngredient = RecipeIngredient(recipe=oldRecipe)
+                    newRecipeIngredients.append(oldRecipeIngredient)
+                else:
+                    oldRecipeIngredient = dOldRecipeIngredients[newRecipeIngredient['id']]
+                    updatedRecipeIngredients.append(oldRecipeIngredient)
+                    ingredientDeltas[oldRecipeIngredient.ingredient_id] = ingredientDeltas.get(oldRecipeIngredient.ingredient_id, 0) - 1
+                          
+                oldRecipeIngredient.unit = newRecipeIngredient['unit']
+                oldRecipeIngredient.quantity = newRecipeIngredient['quantity'] 
+                oldRecipeIngredient.ingredient = ingredients[newRecipeIngredient['ingredient']]
+                ingredientDeltas[oldRecipeIngredient.ingredient_id] = ingredientDeltas.get(oldRecipeIngredient.ingredient_id, 0) + 1
+
+            RecipeIngredient.objects.bulk_create(newRecipeIngredients)
+            Utils.bulkUpdate(RecipeIngredient, updatedRecipeIngredients, ['unit', 'quantity', 'ingredient'])
+            Statistics.addIngredients(user.id, ingredientDeltas)
+            SearchIndex.indexRecipes(user.id, [oldRecipe.id])
+            PantryIndex.recipeChanged(user.id, oldRecipe.id)
         
         # Check if the recipe is in the current shopping list
         # To this end, retrieve first the shopping list from the user profile
         oldRecipe.in_shopping_list = False        
-        userProfile = get_object_or_404(UserProfile,user__username=user.username)            
+        userProfile = UserProfiles.get(request)            
         shoppingList = userProfile.shoppingList
         items = shoppingList.items.filter(recipe_id = oldRecipe.id)
         if (len(items) == 1):
             oldRecipe.in_shopping_list = True
 
         serializer = FullRecipeSerializer(oldRecipe)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        response = Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Versions.setETag(response, Versions.etag(user.id, Versions.user(user.id), Changes.RECIPE, Versions.object(user.id, Changes.RECIPE, oldRecipe.id)))
         
+class ImageEp(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+    # Images are immutable (content-addressed), so clients can cache them indefinitely
+    def get(self, request, imageId, size=None, format=None):
+
+        if not imageStore.isImageId(imageId):
+            return Response('Unknown image', status=status.HTTP_400_BAD_REQUEST)
+
+        user = self.request.user
+        if not UserImages.owns(user.id, imageId):
+            return Response('Unknown image', status=status.HTTP_404_NOT_FOUND)
+
+        etag = '"%s"' % (imageId if size is None else '%s-%s' % (imageId, size))
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            data = imageStore.get(imageId, None if size is None else int(size))
+            if data is None:
+                return Response('Unknown image', status=status.HTTP_404_NOT_FOUND)
+            response = self.rangeResponse(request, data)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+    # Use id = '_' to store a new image, the image reference is returned
+    def post(self, request, imageId, size=None, format=None):
+
+        if (imageId != '_') or ('image' not in request.data):
+            return Response('Unknown image data', status=status.HTTP_400_BAD_REQUEST)
+        try:
+            imageId = UserImages.store(request.user.id, request.data['image'])
+        except ValueError as e:
+            return Response('Unknown image data: ' + str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(imageId, status=status.HTTP_201_CREATED)
+
+    def rangeResponse(self, request, data):
+        contentType = imageStore.contentType(data)
+        match = self.RANGE_PATTERN.match(request.META.get('HTTP_RANGE', ''))
+        if (match is None) or (match.group(1) == '' and match.group(2) == ''):
+            response = HttpResponse(data, content_type=contentType)
+        else:
+            length = len(data)
+            if match.group(1) == '':
+                # suffix range: last n bytes
+                start = max(length - int(match.group(2)), 0)
+                end = length - 1
+            else:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), length - 1) if match.group(2) != '' else length - 1
+            if start >= length or start > end:
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = 'bytes */%d' % length
+                return response
+            response = HttpResponse(data[start:end + 1], content_type=contentType, status=status.HTTP_206_PARTIAL_CONTENT)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, length)
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
 class IngredientListEp(APIView):
     permission_classes = (IsAuthenticated,IsOwner)
     
+    @Versions.conditional()
+    @ResponseCache.cached(Changes.INGREDIENT)
     def get(self, request, format=None):    
         user = self.request.user
-        ingredients = user.ingredients
 
-        serializer = IngredientLocationSerializer(ingredients, many=True)
+        # The location ids of all ingredients are fetched in one query and grouped in memory
+        ingredientLocations = {}
+        for ingredientId, locationId in IngredientLocation.objects.filter(ingredient__user = user).values_list('ingredient_id', 'location_id'):
+            ingredientLocations.setdefault(ingredientId, []).append(locationId)
+
+        ingredients = list(user.ingredients.values('id', 'name'))
+        for ingredient in ingredients:
+            ingredient['locations'] = ingredientLocations.get(ingredient['id'], [])
+
+        serializer = IngredientCatalogueSerializer(ingredients, many=True)
         return Response(serializer.data)
         
+class IngredientCompletionEp(APIView):
+    permission_classes = (IsAuthenticated,IsOwner)
+
+    # ?q=<prefix>&limit=<n>, the best matching ingredients with their locations
+    @Versions.conditional()
+    def get(self, request, format=None):
+        user = self.request.user
+
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+        except ValueError:
+            return Response('Invalid limit', status=status.HTTP_400_BAD_REQUEST)
+
+        # Answered from the in-memory index, the database is only read when the index is (re)built
+        return Response(IngredientIndex.get(user.id).complete(request.query_params.get('q', ''), limit))
+
 class IngredientEp(APIView):
     permission_classes = (IsAuthenticated,IsOwner)
     
+    @Versions.conditional()
     def get(self, request, ingredientId, format=None):    
         
         ingredient = get_object_or_404(Ingredient, pk=ingredientId)
@@ -332,34 +532,38 @@ class IngredientEp(APIView):
         
         if (str(newIngredient['id']).startswith('_')):
             ingredient = Ingredient(user=user)
-            ingredient.save()
         else:
-            ingredient = Ingredient.objects.get(id=newIngredient['id'])
+            ingredient = get_object_or_404(Ingredient, id=newIngredient['id'])
             self.check_object_permissions(self.request, ingredient)
-            
-        ingredient.name = newIngredient['name']
-
-        locations = Location.objects.filter(id__in = newIngredient['locations']) 
-        newLocationIds = [location.id for location in locations]
-        ingredientLocations = IngredientLocation.objects.filter(ingredient__id= ingredientId)
-        oldLocationIds = [ingredientLocation.location.id for ingredientLocation in ingredientLocations]
-
-        newIngredientLocations = []
-        # delete removed locations
-        for ingredientLocation in ingredientLocations:
-            if not (ingredientLocation.location.id in newLocationIds):
-                ingredientLocation.delete()
-            else:
-                newIngredientLocations.append(ingredientLocation)
-        # add new locations
-        for location in locations:
-            if not (location.id in oldLocationIds):
-                ingredientLocation = IngredientLocation(location = location, ingredient = ingredient)
-                ingredientLocation.save()
-                newIngredientLocations.append(ingredientLocation)
-
-        ingredient.locations.set(newIngredientLocations)
-        ingredient.save()
+
+        # Locations are diffed as sets of ids, only the user's own locations can be assigned
+        try:
+            requestedLocationIds = set(int(locationId) for locationId in newIngredient.get('locations', []))
+        except (TypeError, ValueError):
+            return Response('Unknown ingredient data', status=status.HTTP_400_BAD_REQUEST)
+        newLocationIds = set(Location.objects.filter(user=user, id__in = requestedLocationIds).values_list('id', flat=True))
+        if len(newLocationIds) != len(requestedLocationIds):
+            return Response('Unknown location: '+ str(sorted(requestedLocationIds - newLocationIds)), status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            renamed = (ingredient.id is not None) and (ingredient.name != newIngredient['name'])
+            ingredient.name = newIngredient['name']
+            ingredient.save()
+            if renamed:
+                SearchIndex.indexIngredient(ingredient)
+
+            ingredientLocations = IngredientLocation.objects.filter(ingredient = ingredient)
+            oldLocationIds = set(ingredientLocations.values_list('location_id', flat=True))
+
+            # delete removed locations
+            removedLocationIds = oldLocationIds - newLocationIds
+            if removedLocationIds:
+                Utils.bulkDelete(ingredientLocations.filter(location_id__in = removedLocationIds))
+            # add new locations
+            IngredientLocation.objects.bulk_create([
+                IngredientLocation(location_id = locationId, ingredient = ingredient) for locationId in newLocationIds - oldLocationIds
+            ])
+            IngredientIndex.ingredientChanged(user.id, ingredient.id)
    
         serializer = IngredientLocationSerializer(ingredient)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -367,6 +571,7 @@ class IngredientEp(APIView):
 class IngredientByNameEp(APIView):
     permission_classes = (IsAuthenticated,IsOwner)
     
+    @Versions.conditional()
     def get(self, request, ingredientName, format=None):
         
         user = self.request.user
@@ -376,11 +581,13 @@ class IngredientByNameEp(APIView):
         serializer = IngredientLocationSerializer(ingredient)
         return Response(serializer.data)
 
+    @transaction.atomic
     def put(self, request, ingredientName, format=None):
         
         user = self.request.user
         ingredient = Ingredient(user=user, name=ingredientName)
         ingredient.save()
+        IngredientIndex.ingredientChanged(user.id, ingredient.id)
 
         serializer = IngredientLocationSerializer(ingredient)
         return Response(serializer.data)
@@ -389,10 +596,25 @@ class ShoppingListEp(APIView):
     permission_classes = (IsAuthenticated,IsOwner)
     
     # Use id = '_' to get the current shopping list from the user profile
+    # Use ?compact=true to get the items with recipe/ingredient ids and the referenced recipes/ingredients listed once
+    @Versions.conditional(Changes.SHOPPING_LIST, 'shoppingListId')
+    @ResponseCache.cached(Changes.SHOPPING_LIST, Changes.RECIPE, Changes.INGREDIENT, Changes.PROFILE)
     def get(self, request, shoppingListId, format=None):
+        if ViewUtils.isTrue(request.query_params.get('compact')):
+            if (shoppingListId == '_'):
+                user = self.request.user
+                userProfile = UserProfiles.get(request)
+                shoppingListId = userProfile.shoppingList_id
+            shoppingLists = ShoppingList.objects.prefetch_related('items__recipe__recipe_ingredients')
+            shoppingList = get_object_or_404(shoppingLists, pk=shoppingListId)
+            self.check_object_permissions(self.request, shoppingList)
+
+            serializer = CompactShoppingListSerializer(shoppingList)
+            return Response(serializer.data)
+
         if (shoppingListId == '_'):
             user = self.request.user
-            userProfile = get_object_or_404(UserProfile,user__username=user.username)            
+            userProfile = UserProfiles.get(request)            
             shoppingList = userProfile.shoppingList
         else:
             shoppingList = get_object_or_404(ShoppingList, pk=shoppingListId)
@@ -409,84 +631,137 @@ class ShoppingListEp(APIView):
         newShoppingList = request.data;
         if not ViewUtils.isValidShoppingList(newShoppingList):
             return Response('Unkonwn shopping list data', status=status.HTTP_400_BAD_REQUEST)   
-        
-        #---------------------------- Update existing shopping list ---
-        if (shoppingListId != '_'):                       
+
+        if (shoppingListId != '_'):
             shoppingList = get_object_or_404(ShoppingList, pk=shoppingListId)
             self.check_object_permissions(self.request, shoppingList)
 
-            shoppingList.name = newShoppingList['name']
-            
-            #- Remove deleted items
-            newShoppingItems = set([])
-            for newItem in newShoppingList['items']:
-                if not ViewUtils.isValidShoppingItem(newItem):
-                    return Response('Unkonwn shopping list item data: '+ str(newItem), status=status.HTTP_400_BAD_REQUEST)
-                else:
-                    newItem['id'] = str(newItem['id'])
-                    newShoppingItems.add(newItem['id'])
-            
-            dOldShoppingItems = {}
-            for oldShoppingItem in shoppingList.items.all():
-                oldShoppingItemId = str(oldShoppingItem.id)
-                if not oldShoppingItemId in newShoppingItems:
-                    oldShoppingItem.delete()
-                else:
-                    dOldShoppingItems[oldShoppingItemId] = oldShoppingItem
-        
-            #- Add new items
-            for newItem in newShoppingList['items']:           
-                if newItem['id'].startswith('_'):         
-                    shoppingItem = ShoppingItem(shoppingList = shoppingList)
-                else:
-                    shoppingItem = dOldShoppingItems[str(newItem['id'])]
-                    
-                shoppingItem.unit = newItem['unit']
-                shoppingItem.quantity = newItem['quantity']                
-                # ingredient items are created if they do not exist already
+        # All items are validated and the referenced ingredients and recipes are resolved at once before writing
+        ingredientIds = set([])
+        recipeIds = set([])
+        newShoppingItemIds = set([])
+        for newItem in newShoppingList['items']:
+            if not ViewUtils.isValidShoppingItem(newItem):
+                return Response('Unkonwn shopping list item data: '+ str(newItem), status=status.HTTP_400_BAD_REQUEST)
+            try:
                 if (newItem['ingredient'] is not None):
-                    shoppingItem.recipe = None
-                    shoppingItem.ingredient = Ingredient.objects.get(pk=newItem['ingredient'], user=user)
-                # recipe items have to exist already or an error will be raised
-                # 10.10.2016: this assumes shoppping lists can be edited by adding recipes - currently not used
+                    newItem['ingredient'] = int(newItem['ingredient'])
+                    ingredientIds.add(newItem['ingredient'])
                 elif (newItem['recipe'] is not None):
-                    shoppingItem.ingredient = None
-                    shoppingItem.recipe = get_object_or_404(Recipe, pk=newItem['recipe']['id'])
-                shoppingItem.save()
+                    newItem['recipe'] = {'id': int(newItem['recipe']['id'])}
+                    recipeIds.add(newItem['recipe']['id'])
+            except (KeyError, TypeError, ValueError):
+                return Response('Unkonwn shopping list item data: '+ str(newItem), status=status.HTTP_400_BAD_REQUEST)
+            newItem['id'] = str(newItem.get('id', '_'))
+            newShoppingItemIds.add(newItem['id'])
+
+        ingredients = Ingredient.objects.filter(user=user).in_bulk(ingredientIds)
+        if len(ingredients) != len(ingredientIds):
+            return Response('Unknown ingredient: '+ str(sorted(ingredientIds - set(ingredients))), status=status.HTTP_400_BAD_REQUEST)
+        recipes = Recipe.objects.filter(user=user).in_bulk(recipeIds)
+        if len(recipes) != len(recipeIds):
+            return Response('Unknown recipe: '+ str(sorted(recipeIds - set(recipes))), status=status.HTTP_400_BAD_REQUEST)
+        
+        #---------------------------- Update existing shopping list ---
+        if (shoppingListId != '_'):                       
+            dOldShoppingItems = dict([(str(oldShoppingItem.id), oldShoppingItem) for oldShoppingItem in shoppingList.items.all()])
+            for newItem in newShoppingList['items']:
+                if not (newItem['id'].startswith('_') or newItem['id'] in dOldShoppingItems):
+                    return Response('Unkonwn shopping list item: '+ newItem['id'], status=status.HTTP_400_BAD_REQUEST)
+
+            with transaction.atomic():
+                # Optimistic concurrency: If-Match with the ETag of the shopping list read by the client,
+                # checked in the transaction of the write (see Versions.ifMatch)
+                if not Versions.ifMatch(request, Changes.SHOPPING_LIST, shoppingList.id):
+                    return Versions.preconditionFailed()
+
+                shoppingList.name = newShoppingList['name']
+                shoppingList.save()
+
+                #- Remove deleted items
+                removedShoppingItemIds = [oldShoppingItem.id for oldShoppingItemId, oldShoppingItem in dOldShoppingItems.items()
+                                          if not oldShoppingItemId in newShoppingItemIds]
+                if removedShoppingItemIds:
+                    Utils.bulkDelete(ShoppingItem.objects.filter(id__in = removedShoppingItemIds))
+            
+                #- Add new items and update existing ones
+                newShoppingItems = []
+                updatedShoppingItems = []
+                for newItem in newShoppingList['items']:           
+                    if newItem['id'].startswith('_'):         
+                        shoppingItem = ShoppingItem(shoppingList = shoppingList)
+                        newShoppingItems.append(shoppingItem)
+                    else:
+                        shoppingItem = dOldShoppingItems[newItem['id']]
+                        updatedShoppingItems.append(shoppingItem)
+                    self.setItem(shoppingItem, newItem, ingredients, recipes)
+
+                ShoppingItem.objects.bulk_create(newShoppingItems)
+                Utils.bulkUpdate(ShoppingItem, updatedShoppingItems, ['unit', 'quantity', 'ingredient', 'recipe'])
             
         #--------------------------------- Create new shopping list ---
         else :
-            shoppingList = ShoppingList(user=user)  
-            shoppingList.save()
+            userProfile = UserProfiles.get(request)
+
+            with transaction.atomic():
+                shoppingList = ShoppingList(user=user)  
+                shoppingList.save()
             
-            # Make this the current shopping list in the user profile
-            userProfile = get_object_or_404(UserProfile,user__username=user.username)
-            userProfile.shoppingList = shoppingList
-            userProfile.save()   
+                # Make this the current shopping list in the user profile
+                userProfile.shoppingList = shoppingList
+                userProfile.save(update_fields=['shoppingList'])
             
-            # Clone all items (if any) - can be used to create a new shopping list starting from an old one
-            for newItem in newShoppingList['items']:
-                shoppingItem = ShoppingItem(unit = newItem['unit'], quantity = newItem['quantity'], shoppingList = shoppingList)
-                # ingredient items are created if they do not exist already
-                if (newItem['ingredient'] is not None):
-                    shoppingItem.recipe = None
-                    shoppingItem.ingredient = Ingredient.objects.get(pk=newItem['ingredient'], user=user)
-                # recipe items have to exist already or an error will be raised
-                elif (newItem['recipe'] is not None):
-                    shoppingItem.ingredient = None
-                    shoppingItem.recipe = get_object_or_404(Recipe, pk=newItem['recipe']['id'])
-                shoppingItem.save()
-                shoppingList.items.add(shoppingItem)         
+                # Clone all items (if any) - can be used to create a new shopping list starting from an old one
+                newShoppingItems = []
+                for newItem in newShoppingList['items']:
+                    shoppingItem = ShoppingItem(shoppingList = shoppingList)
+                    self.setItem(shoppingItem, newItem, ingredients, recipes)
+                    newShoppingItems.append(shoppingItem)
+                ShoppingItem.objects.bulk_create(newShoppingItems)
                
-        
-        shoppingList.save()
+        # Bulk operations do not send signals
+        ConsolidatedShoppingList.invalidate([shoppingList.id])
+
+        shoppingList = ShoppingList.objects.prefetch_related('items__recipe__recipe_ingredients').get(pk=shoppingList.id)
         serializer = ShoppingListSerializer(shoppingList)
-        return Response(serializer.data)  
+        response = Response(serializer.data)
+        return Versions.setETag(response, Versions.etag(user.id, Versions.user(user.id), Changes.SHOPPING_LIST, Versions.object(user.id, Changes.SHOPPING_LIST, shoppingList.id)))
+
+    def setItem(self, shoppingItem, newItem, ingredients, recipes):
+        shoppingItem.unit = newItem['unit']
+        shoppingItem.quantity = newItem['quantity']                
+        # ingredient items
+        if (newItem['ingredient'] is not None):
+            shoppingItem.recipe = None
+            shoppingItem.ingredient = ingredients[newItem['ingredient']]
+        # recipe items
+        # 10.10.2016: this assumes shoppping lists can be edited by adding recipes - currently not used
+        elif (newItem['recipe'] is not None):
+            shoppingItem.ingredient = None
+            shoppingItem.recipe = recipes[newItem['recipe']['id']]
         
+class ConsolidatedShoppingListEp(APIView):
+    permission_classes = (IsAuthenticated,IsOwner)
+
+    # Ingredient totals of the shopping list (recipe items expanded and merged with the ingredient items)
+    # Use id = '_' to get the totals of the current shopping list from the user profile
+    @Versions.conditional()
+    def get(self, request, shoppingListId, format=None):
+        if (shoppingListId == '_'):
+            user = self.request.user
+            userProfile = UserProfiles.get(request)
+            shoppingList = userProfile.shoppingList
+        else:
+            shoppingList = get_object_or_404(ShoppingList, pk=shoppingListId)
+            self.check_object_permissions(self.request, shoppingList)
+
+        return Response(ConsolidatedShoppingList.get(shoppingList.id))
+
 class ShoppingRecipeItemEp(APIView):
     permission_classes = (IsAuthenticated,IsOwner)
 
     # use shoppingListId = '_' to search for recipe in the current shopping list
+    @Versions.conditional()
     def get(self, request, shoppingListId, recipeId, format=None):
         
         result = False
@@ -494,7 +769,7 @@ class ShoppingRecipeItemEp(APIView):
         
         # get shopping list
         if (shoppingListId == '_'):  
-            userProfile = get_object_or_404(UserProfile,user__username=user.username)            
+            userProfile = UserProfiles.get(request)            
             shoppingList = userProfile.shoppingList
         else:
             shoppingList = get_object_or_404(ShoppingList, pk=shoppingListId)
@@ -507,6 +782,8 @@ class ShoppingRecipeItemEp(APIView):
             
         return Response(result)
         
+    # The item and the change of its shopping list (see changes.py) are written together
+    @transaction.atomic
     def post(self, request, shoppingListId, recipeId, format=None):
         command = request.data        
         
@@ -517,7 +794,7 @@ class ShoppingRecipeItemEp(APIView):
         # get shopping list
         user = self.request.user
         if (shoppingListId == '_'):  
-            userProfile = get_object_or_404(UserProfile,user__username=user.username)            
+            userProfile = UserProfiles.get(request)            
             shoppingList = userProfile.shoppingList
         else:
             shoppingList = get_object_or_404(ShoppingList, pk=shoppingListId)
@@ -555,6 +832,8 @@ class ShoppingRecipeItemEp(APIView):
 class ShopListEp(APIView):
     permission_classes = (IsAuthenticated,IsOwner)
     
+    @Versions.conditional()
+    @ResponseCache.cached(Changes.SHOP)
     def get(self, request, format=None):
         user = self.request.user
         shops = user.shops
@@ -565,11 +844,12 @@ class ShopListEp(APIView):
 class ShopEp(APIView):
     permission_classes = (IsAuthenticated,IsOwner)
     
+    @Versions.conditional()
     def get(self, request, shopId, format=None):
     
         if (shopId == '_'):
             user = self.request.user
-            userProfile = get_object_or_404(UserProfile,user__username=user.username)            
+            userProfile = UserProfiles.get(request)            
             shop = userProfile.shop
         else:
             shop = get_object_or_404(Shop, pk=shopId)
@@ -578,6 +858,8 @@ class ShopEp(APIView):
         serializer = ShopSerializer(shop)
         return Response(serializer.data)
         
+    # A new shop is created and named in one transaction
+    @transaction.atomic
     def post(self, request, shopId, format=None):
     
         user = self.request.user        
@@ -614,28 +896,30 @@ class CurrentShopEp(APIView):
 
     permission_classes = (IsAuthenticated,IsOwner)
     
+    @Versions.conditional()
     def get(self, request, format=None):
     
         user = self.request.user
-        userProfile = get_object_or_404(UserProfile,user__username=user.username)
+        userProfile = UserProfiles.get(request)
         shop = userProfile.shop
             
         serializer = ShopSerializer(shop)
         return Response(serializer.data)
         
+    @transaction.atomic
     def post(self, request, format=None):
     
         user = self.request.user        
         newCurrentShop = request.data
         
-        userProfile = get_object_or_404(UserProfile,user__username=user.username)
+        userProfile = UserProfiles.get(request)
         shop = None
         if (newCurrentShop['id'] is not None):
             shop = get_object_or_404(Shop, pk=newCurrentShop['id'])
             self.check_object_permissions(self.request, shop)
 
         userProfile.shop = shop
-        userProfile.save()
+        userProfile.save(update_fields=['shop'])
             
         serializer = ShopSerializer(shop)
         return Response(serializer.data)
@@ -644,6 +928,8 @@ class LocationListEp(APIView):
 
     permission_classes = (IsAuthenticated,IsOwner)
     
+    @Versions.conditional()
+    @ResponseCache.cached(Changes.LOCATION)
     def get(self, request, format=None):
         user = self.request.user
         locations = user.locations
@@ -654,6 +940,7 @@ class LocationListEp(APIView):
 class LocationEp(APIView):
     permission_classes = (IsAuthenticated,IsOwner)
     
+    @Versions.conditional()
     def get(self, request, locationId, format=None):
     
         try:
@@ -667,6 +954,8 @@ class LocationEp(APIView):
         serializer = LocationSerializer(location)
         return Response(serializer.data)
         
+    # A new location is created and named in one transaction
+    @transaction.atomic
     def post(self, request, locationId, format=None):
     
         user = self.request.user        
@@ -705,53 +994,146 @@ class LocationEp(APIView):
 class StatsEp(APIView):
     permission_classes = (IsAuthenticated,IsOwner)
     
+    # Statistics are read from the incrementally maintained counters
+    # Use ?live=true to compute them from the data instead
+    @Versions.conditional()
     def get(self, request, format=None):
         user = self.request.user
         
-        stats = {}
+        if ViewUtils.isTrue(request.query_params.get('live')):
+            counters = Statistics.compute(user.id)
+        else:
+            counters = Statistics.read(user.id)
 
-        #--- Recipes
-        statsRecipes = []
-        _stats = {}
+        stats = Statistics.format(user.id, counters)
+        return JsonResponse(stats)
 
-        recipes = Recipe.objects.filter(user__username=user.username)
-        for recipe in recipes:
-            category = recipe.category            
-            if (category == ''):
-                category = "other"
-            if category in _stats:
-                _stats[category] += 1
-            else:
-                _stats[category] = 1
-        for k in _stats:
-            statsRecipes.append({'category':k, 'recipes':_stats[k]})
+class CacheStatsEp(APIView):
+    permission_classes = (IsAdminUser,)
 
-        #--- Shopping lists
-        shoppingLists = ShoppingList.objects.filter(user__username=user.username)
+    # Hit ratios and evictions of the caches of this process
+    def get(self, request, format=None):
+        return Response({'responses': ResponseCache.stats(), 'tokens': TokenCache.stats()})
+        
+class BatchEp(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    # The data endpoints, authentication, account, admin and collection endpoints cannot be batched
+    BATCHABLE = (
+        RecipeListEp, RecipeSearchEp, CookableRecipesEp, RecipeEp, ImageEp,
+        IngredientListEp, IngredientCompletionEp, IngredientEp, IngredientByNameEp,
+        ShoppingListEp, ConsolidatedShoppingListEp, ShoppingRecipeItemEp,
+        ShopListEp, ShopEp, CurrentShopEp, LocationListEp, LocationEp, StatsEp,
+    )
+
+    # {"requests": [{"method": ..., "url": ..., "body": ...}, ...]}, run in order and in one transaction (see batch.py)
+    def post(self, request, format=None):
 
-        #--- Ingredients
-        statsIngredients = []
-        _stats = {}
+        batchRequests = request.data.get('requests') if isinstance(request.data, dict) else None
+        if not Batch.isValid(batchRequests):
+            return Response('Invalid batch request', status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            responses = Batch(request, BatchEp.BATCHABLE).run(batchRequests)
+        except BatchError as e:
+            # Nothing was applied, the responses up to the failed request are returned
+            return Response({'failed': e.index, 'responses': e.responses}, status=e.status)
+
+        return Response({'responses': responses})
+
+class SyncEp(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    # ?since=<cursor>, the objects changed and deleted since the cursor of a previous sync (see sync.py)
+    def get(self, request, format=None):
+        user = self.request.user
+
+        since = request.query_params.get('since')
+        try:
+            since = None if since in (None, '') else int(since)
+        except ValueError:
+            return Response('Invalid cursor', status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(Sync.delta(user.id, since))
+
+class CollectionExportEp(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    # The whole collection of the user as NDJSON, streamed (see collection.py)
+    def get(self, request, format=None):
+        user = self.request.user
+
+        response = StreamingHttpResponse(CollectionExport.lines(user.id), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="recipicon-collection.ndjson"'
+        return response
+
+class CollectionImportEp(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    # NDJSON body in the format of the export, added to the collection of the user (see collection.py)
+    def post(self, request, format=None):
+        user = self.request.user
+
+        maxBytes = getattr(settings, 'COLLECTION_IMPORT_MAX_BYTES', 64 * 1024 * 1024)
+        try:
+            contentLength = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            contentLength = 0
+        if contentLength > maxBytes:
+            return Response('The collection is larger than %d bytes' % maxBytes, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        # The body is read line by line from the underlying request, it is never parsed as a whole.
+        # It is spooled before the import starts, so that a slow client does not hold the transaction.
+        try:
+            body = CollectionImport.spool(request._request, maxBytes, getattr(settings, 'COLLECTION_IMPORT_MAX_LINES', 100000))
+            with body:
+                with transaction.atomic():
+                    counts = CollectionImport(user).run(body)
+        except CollectionImportError as e:
+            return Response({'line': e.line, 'error': e.message}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(counts, status=status.HTTP_201_CREATED)
 
-        ingredients = Ingredient.objects.filter(user__username=user.username)
-        for ingredient in ingredients:
-           _stats[ingredient.name] = len(ingredient.recipe_ingredients.all())
-        for k in _stats:
-            statsIngredients.append({'ingredient':k, 'recipes':_stats[k]})
-        #---
-        stats['recipes'] = statsRecipes
-        stats['recipe_number'] = len(recipes)
-        stats['shoppingList_number'] = len(shoppingLists)
-        stats['ingredients'] = statsIngredients
-        stats['ingredient_number'] = len(ingredients)
-        return JsonResponse(stats)
-        
 class ViewUtils():
 
+    @staticmethod
+    def isTrue(value):
+        return (value is not None) and (value.lower() in ('1', 'true', 'yes'))
+
+    @staticmethod
+    def inCurrentShoppingListSql():
+        # EXISTS subquery marking a recipe row that is included in the current shopping list of a user.
+        # The user profile is joined in the subquery, the user id is passed as the only parameter.
+        qn = connection.ops.quote_name
+        item = ShoppingItem._meta
+        profile = UserProfile._meta
+        recipe = Recipe._meta
+        return ('EXISTS (SELECT 1 FROM %(item)s INNER JOIN %(profile)s ON %(profile)s.%(profileList)s = %(item)s.%(itemList)s'
+                ' WHERE %(profile)s.%(profileUser)s = %%s AND %(item)s.%(itemRecipe)s = %(recipe)s.%(recipeId)s)') % {
+            'item': qn(item.db_table),
+            'profile': qn(profile.db_table),
+            'recipe': qn(recipe.db_table),
+            'profileList': qn(profile.get_field('shoppingList').column),
+            'profileUser': qn(profile.get_field('user').column),
+            'itemList': qn(item.get_field('shoppingList').column),
+            'itemRecipe': qn(item.get_field('recipe').column),
+            'recipeId': qn(recipe.pk.column),
+        }
+
+    @staticmethod
+    def loginResponse(request, user, token):
+        # Clients opt in to access tokens with "mode": "access", otherwise only the token key is returned
+        if request.data.get('mode') == 'access':
+            return Response({'refresh': token.key, 'access': AccessTokens.create(user, token.key), 'expires': AccessTokens.lifetime()}, status=status.HTTP_200_OK)
+        return Response(token.key, status=status.HTTP_200_OK)
 
     @staticmethod
     def isValidSignupRequest(signupRequest):
-        return set(signupRequest.keys()).issubset(set(['username', 'email', 'password', 'confirmPassword']))
+        return set(signupRequest.keys()).issubset(set(['username', 'email', 'password', 'confirmPassword', 'mode']))
+
+    @staticmethod
+    def isValidAccessTokenRequest(accessTokenRequest):
+        return set(accessTokenRequest.keys()).issubset(set(['refresh']))
 
     @staticmethod
     def isValidPassResetRequest(passResetRequest):
@@ -0,0 +1,42 @@
+import sys
+import time
+import base64
+
+import os
+os.environ['DJANGO_SETTINGS_MODULE'] = 'recipicon.settings'
+
+import django
+django.setup()
+
+from django.test import RequestFactory
+from rest_framework.authentication import BasicAuthentication
+from api.authentications import CachedBasicAuthentication
+
+# CPU time per authenticated request with and without the verified credentials cache
+# Usage: python benchmark_basic_auth.py <username> <password> [requests]
+
+cpuTime = getattr(time, 'process_time', time.clock)
+
+
+def benchmark(authentication, request, requests):
+    authentication.authenticate(request)    # warm up (fills the cache)
+    start = cpuTime()
+    for i in range(requests):
+        authentication.authenticate(request)
+    return (cpuTime() - start) / requests
+
+
+if __name__ == "__main__":
+    username = sys.argv[1]
+    password = sys.argv[2]
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    credentials = base64.b64encode(('%s:%s' % (username, password)).encode('utf-8')).decode('ascii')
+    request = RequestFactory().get('/api/recipes', HTTP_AUTHORIZATION='Basic ' + credentials)
+
+    plain = benchmark(BasicAuthentication(), request, requests)
+    cached = benchmark(CachedBasicAuthentication(), request, requests)
+
+    print('BasicAuthentication       : %.3f ms CPU per request' % (plain * 1000))
+    print('CachedBasicAuthentication : %.3f ms CPU per request' % (cached * 1000))
+    print('CPU saved per request     : %.3f ms (%.0fx)' % ((plain - cached) * 1000, plain / max(cached, 1e-9)))
@@ -1,46 +1,14 @@
-import sys
-
 import os
 os.environ['DJANGO_SETTINGS_MODULE'] = 'recipicon.settings'
 
 import django
 django.setup()
 
-from api.models import Recipe, RecipeIngredient, Ingredient, UserProfile
-from django.contrib.auth.models import User
+from api.utils import Utils
 
 user = raw_input('User:')
 email = raw_input('E-mail:')
 password = raw_input('Password:')
 
-#--- Create user
-user = User.objects.create_user(user, email, password)
-user.save()
-
-userProfile = UserProfile(user = user)
-userProfile.save()
-
-#--- Create ingredients
-coffee = Ingredient(name = 'coffee', user = user)
-coffee.save()
-
-sugar = Ingredient(name = 'sugar', user = user)
-sugar.save()
-
-milk = Ingredient(name = 'milk', user = user)
-milk.save()
-
-#--- Create recipe
-cappuccino = Recipe(name = 'cappuccino', category = '', duration = 10, serves = 2, user = user)
-cappuccino.description = 'Make an expresso. Make milk foam. Add foam to expresso. Add warm milk. Add sugar topping.'
-cappuccino.save()
-
-#--- Add ingredients to recipe
-r_coffee = RecipeIngredient(unit = 'tl', quantity = '4', recipe = cappuccino, ingredient = coffee)
-r_coffee.save()
-
-r_sugar = RecipeIngredient(unit = 'tl', quantity = '2', recipe = cappuccino, ingredient = sugar)
-r_sugar.save()
-
-r_milk = RecipeIngredient(unit = 'ml', quantity = '150', recipe = cappuccino, ingredient = milk)
-r_milk.save()
\ No newline at end of file
+#--- Create user, with the starter data of api/starterkit.json
+Utils.createUser(user, email, password)
@@ -6,12 +6,22 @@ os.environ['DJANGO_SETTINGS_MODULE'] = 'recipicon.settings'
 import django
 django.setup()
 
-from api.models import Recipe, RecipeIngredient, Ingredient, UserProfile
-from django.contrib.auth.models import User
+from api.utils import Utils
+from api.deletion import DeletionWorker
 
 
+# python delete_user.py <username>  - deactivates the user and purges its data
+# python delete_user.py             - purges the data of the closed accounts, runs forever
+# python delete_user.py --once      - purges the data of the closed accounts and exits
+
 if __name__ == "__main__":
-    username = sys.argv[1]
+    args = sys.argv[1:]
+    worker = DeletionWorker()
 
-    user = User.objects.get(username=username)
-    user.delete()
+    if args and args[0] != '--once':
+        username = args[0]
+        worker.purge(Utils.deleteUser(username))
+    elif args:
+        print worker.drain()
+    else:
+        worker.run()
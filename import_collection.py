@@ -0,0 +1,35 @@
+import sys
+import io
+
+import os
+os.environ['DJANGO_SETTINGS_MODULE'] = 'recipicon.settings'
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from api.collection import CollectionImport, CollectionImportError
+
+
+# python import_collection.py <username> <file>  - adds the NDJSON collection in file (- for stdin) to the user's collection
+# python import_collection.py <username>         - same, from stdin
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args:
+        print 'Usage: python import_collection.py <username> [<file>]'
+        sys.exit(1)
+
+    user = User.objects.get(username=args[0])
+    path = args[1] if len(args) > 1 else '-'
+    lines = sys.stdin if path == '-' else io.open(path, 'rb')
+
+    try:
+        with transaction.atomic():
+            counts = CollectionImport(user).run(lines)
+    except CollectionImportError as e:
+        print e
+        sys.exit(1)
+    print counts
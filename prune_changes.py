@@ -0,0 +1,21 @@
+import sys
+
+import os
+os.environ['DJANGO_SETTINGS_MODULE'] = 'recipicon.settings'
+
+import django
+django.setup()
+
+from django.conf import settings
+
+from api.changes import Changes
+
+
+# python prune_changes.py          - deletes the deletions older than CHANGE_RETENTION_DAYS from the change log
+# python prune_changes.py <days>   - deletes the deletions older than the given number of days
+# Meant to be run daily, e.g. from cron. Clients that did not sync since then get all their data again.
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    days = int(args[0]) if args else getattr(settings, 'CHANGE_RETENTION_DAYS', 30)
+    print Changes.prune(days)
@@ -44,9 +44,10 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.BasicAuthentication',
+        'api.authentications.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentications.CachedTokenAuthentication',
+        'api.authentications.SignedTokenAuthentication',
     ),
     'PAGE_SIZE': 10
 }
@@ -107,6 +108,76 @@ DATABASES = {
 
 
 
+# Cache
+# The local memory cache is private to each process, use a shared cache (e.g. memcached)
+# when running several worker processes so that invalidations reach all of them, and set
+# SHARED_CACHE_REQUIRED so that a per-process cache is refused at startup.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+SHARED_CACHE_REQUIRED = False
+
+CONSOLIDATED_SHOPPING_LIST_TIMEOUT = 300
+
+USER_PROFILE_CACHE_TIMEOUT = 600
+
+# Authenticated tokens: local (per process) LRU tier and shared cache tier
+
+AUTH_TOKEN_CACHE_SIZE = 10000
+
+AUTH_TOKEN_CACHE_LOCAL_TIMEOUT = 60
+
+AUTH_TOKEN_CACHE_TIMEOUT = 600
+
+# Signed access tokens (opt-in, "Authorization: Bearer <token>"), lifetime in seconds
+
+ACCESS_TOKEN_LIFETIME = 300
+
+# Cached state (is_active, refresh token stamps) access tokens are checked against, in seconds
+
+ACCESS_TOKEN_STATE_TIMEOUT = 60
+
+# Verified basic auth credentials (per process), failures allowed per username and window
+
+BASIC_AUTH_CACHE_SIZE = 10000
+
+BASIC_AUTH_CACHE_TIMEOUT = 60
+
+BASIC_AUTH_MAX_FAILURES = 5
+
+BASIC_AUTH_FAILURE_WINDOW = 300
+
+# E-mail outbox worker (send_emails.py): batch size, poll interval and retry backoff in seconds
+
+OUTBOX_BATCH_SIZE = 50
+
+OUTBOX_POLL_INTERVAL = 5
+
+OUTBOX_MAX_ATTEMPTS = 8
+
+OUTBOX_RETRY_DELAY = 30
+
+OUTBOX_MAX_RETRY_DELAY = 3600
+
+# Seconds an e-mail claimed by a worker is not sent by others (then due again, e.g. the worker stopped)
+
+OUTBOX_CLAIM_TIMEOUT = 300
+
+# Deferred account deletion (delete_user.py): rows deleted per transaction, poll interval in seconds
+
+ACCOUNT_DELETION_CHUNK_SIZE = 500
+
+ACCOUNT_DELETION_POLL_INTERVAL = 30
+
+# Change log (sync): days the deletions are kept (prune_changes.py), older cursors get a full resync
+
+CHANGE_RETENTION_DAYS = 30
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -144,3 +215,63 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Starter data of new users (ingredients, recipes, shop and shopping list)
+
+STARTER_KIT = os.path.join(BASE_DIR, 'api', 'starterkit.json')
+
+# Maximum number of requests in a batch (/api/batch)
+
+BATCH_MAX_REQUESTS = 50
+
+# Collection export and import (/api/collection, import_collection.py): rows read and objects written at a time
+
+COLLECTION_EXPORT_CHUNK_SIZE = 500
+
+COLLECTION_IMPORT_BATCH_SIZE = 500
+
+# Collection imports over HTTP: maximum size in bytes and lines, bytes spooled in memory (then to disk)
+
+COLLECTION_IMPORT_MAX_BYTES = 64 * 1024 * 1024
+
+COLLECTION_IMPORT_MAX_LINES = 100000
+
+COLLECTION_IMPORT_SPOOL_SIZE = 1024 * 1024
+
+# "What can I cook" indexes (per process), number of users and lifetime in seconds
+
+PANTRY_INDEX_CACHE_SIZE = 1000
+
+PANTRY_INDEX_TIMEOUT = 3600
+
+# Ingredient autocompletion indexes (per process), number of users and lifetime in seconds
+
+INGREDIENT_INDEX_CACHE_SIZE = 1000
+
+INGREDIENT_INDEX_TIMEOUT = 3600
+
+# Rendered responses of the read endpoints, keyed on the last change of the kinds of objects
+# they show (database): 'memory' (per process), 'file' or 'shared' (the cache
+# RESPONSE_CACHE_ALIAS), maximum size in bytes (memory and file) and lifetime in seconds
+
+RESPONSE_CACHE_BACKEND = 'memory'
+
+RESPONSE_CACHE_SIZE = 64 * 1024 * 1024
+
+RESPONSE_CACHE_TIMEOUT = 3600
+
+RESPONSE_CACHE_ROOT = os.path.join(BASE_DIR, 'responses')
+
+# Cached responses of at least this size in bytes are compressed (gzip, brotli and zstd if installed)
+
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+
+# Recipe images (content-addressed store, thumbnails require Pillow)
+
+IMAGE_STORE_ROOT = os.path.join(BASE_DIR, 'images')
+
+IMAGE_THUMBNAIL_SIZES = (128, 512)
+
+# Maximum size of an uploaded image in bytes (decoded)
+
+IMAGE_MAX_SIZE = 5 * 1024 * 1024
@@ -0,0 +1,33 @@
+import sys
+
+import os
+os.environ['DJANGO_SETTINGS_MODULE'] = 'recipicon.settings'
+
+import django
+django.setup()
+
+from api.outbox import OutboxWorker
+
+
+# Sends the e-mails queued in the outbox:
+#   python send_emails.py                    - runs forever, using the SMTP server in api/site.py
+#   python send_emails.py localhost 1025     - no TLS and no login, e.g. for python -m smtpd -n -c DebuggingServer localhost:1025
+#   python send_emails.py --once ...         - sends the e-mails that are due and exits
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    once = '--once' in args
+    args = [arg for arg in args if arg != '--once']
+
+    if args:
+        worker = OutboxWorker(args[0], int(args[1]) if len(args) > 1 else 25, password='', useTls=False)
+    else:
+        worker = OutboxWorker()
+
+    if once:
+        try:
+            print worker.drain()
+        finally:
+            worker.close()
+    else:
+        worker.run()